@@ -0,0 +1,33 @@
+"""
+Builds src/chainlink/cleaning/data/zipcodes.parquet, the zipcode table used by
+load_zip_table, from the USPS data in the zipcodes package.
+
+The table has one row per 5-digit zipcode with its city and state, uppercased
+and sorted by zipcode. The committed table was built from zipcodes 3.0.0 and
+has 42,789 rows. To rebuild it:
+
+    uv run --with zipcodes==3.0.0 python scripts/build_zipcodes.py
+"""
+
+from pathlib import Path
+
+import polars as pl
+import zipcodes
+
+OUTPUT_PATH = Path(__file__).parents[1] / "src" / "chainlink" / "cleaning" / "data" / "zipcodes.parquet"
+
+
+def build_zip_table() -> pl.DataFrame:
+    """
+    Builds the zipcode table from every zipcode in the zipcodes package.
+
+    Returns a pl.DataFrame with zipcode, city and state columns
+    """
+    return pl.DataFrame(
+        [{"zipcode": row["zip_code"], "city": row["city"], "state": row["state"]} for row in zipcodes.list_all()],
+        schema={"zipcode": pl.String, "city": pl.String, "state": pl.String},
+    ).select(pl.col("zipcode"), pl.col("city", "state").str.to_uppercase()).sort("zipcode")
+
+
+if __name__ == "__main__":
+    build_zip_table().write_parquet(OUTPUT_PATH, compression="zstd", compression_level=22, statistics=False)
@@ -1,13 +1,26 @@
+import hashlib
+import heapq
+import math
 import multiprocessing
+import os
 import re
+import tempfile
+import time
+from collections import Counter
+from collections.abc import Callable
 from concurrent.futures import ProcessPoolExecutor
-from math import ceil
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import cache
+from importlib.metadata import version
+from pathlib import Path
+from time import perf_counter
 
 import polars as pl
+import pyarrow as pa
 import us
 import usaddress
-from scourgify import normalize_address_record
-from uszipcode import SearchEngine
+from duckdb import DuckDBPyConnection
+from scourgify import address_constants, normalize_address_record
 
 from chainlink.cleaning.patterns import (
     abb_patterns as ABB_PATTERNS,
@@ -18,16 +31,118 @@ from chainlink.cleaning.patterns import (
 from chainlink.cleaning.patterns import (
     excluded_patterns as EXCLUDED_PATTERNS,
 )
+from chainlink.cleaning.patterns import (
+    individual_names_patterns as INDIVIDUAL_NAMES_PATTERNS,
+)
 from chainlink.cleaning.patterns import (
     word_patterns as WORD_PATTERNS,
 )
+from chainlink.cleaning.rules import default_rules
 from chainlink.cleaning.usps_suffixes import suffixes
 
-zip_cache: dict[str, dict[str, str]] = {}
+# components of a cleaned address, as returned by clean_address
+ADDRESS_STRUCT = pl.Struct([
+    pl.Field("raw", pl.Utf8),
+    pl.Field("address_number", pl.Utf8),
+    pl.Field("street_pre_directional", pl.Utf8),
+    pl.Field("street_name", pl.Utf8),
+    pl.Field("street_post_type", pl.Utf8),
+    pl.Field("unit_type", pl.Utf8),
+    pl.Field("unit_number", pl.Utf8),
+    pl.Field("subaddress_type", pl.Utf8),
+    pl.Field("subaddress_identifier", pl.Utf8),
+    pl.Field("city", pl.Utf8),
+    pl.Field("state", pl.Utf8),
+    pl.Field("postal_code", pl.Utf8),
+    pl.Field("street", pl.Utf8),
+    pl.Field("address_norm", pl.Utf8),
+])
+
+# characters matched by \s in Python's re and stripped by str.strip, which differ
+# from whitespace in the Rust regex engine used by Polars (e.g. \x1c-\x1f)
+python_whitespace = "".join(chr(i) for i in range(0x3001) if chr(i).isspace())
+# the same characters as a regex class body
+whitespace_class = "".join(f"\\x{{{ord(c):X}}}" for c in python_whitespace)
+
+# address components taken directly from the usaddress labels
+ADDRESS_TAGS = {
+    "address_number": "AddressNumber",
+    "street_pre_directional": "StreetNamePreDirectional",
+    "street_name": "StreetName",
+    "street_post_type": "StreetNamePostType",
+    "unit_type": "OccupancyType",
+    "unit_number": "OccupancyIdentifier",
+    "subaddress_type": "SubaddressType",
+    "subaddress_identifier": "SubaddressIdentifier",
+    "city": "PlaceName",
+    "state": "StateName",
+    "postal_code": "ZipCode",
+}
+
+# with a time budget, ambiguous addresses longer than this, such as several
+# addresses concatenated into one field, are not given to the full parser
+FULL_PARSE_MAX_CHARS = 200
+FULL_PARSE_MAX_TOKENS = 32
 
 state_names = [s.name for s in us.states.STATES_AND_TERRITORIES]
 state_abbr = [s.abbr for s in us.states.STATES_AND_TERRITORIES]
 
+# vocabularies for parse_address_fast. Street types are limited to common USPS
+# abbreviations that usaddress reliably tags as the street type, and reserved
+# words are any words scourgify or usaddress may rewrite or treat as a label.
+fast_directionals = ["N", "S", "E", "W", "NE", "NW", "SE", "SW"]
+fast_unit_types = ["APT", "UNIT", "STE"]
+fast_street_types = ["ST", "AVE", "BLVD", "DR", "RD", "LN", "CT", "PL", "PKWY", "TER", "CIR", "WAY", "HWY", "TRL", "SQ"]
+fast_reserved_words = {"OLD", "EL"} | {
+    word
+    for vocabulary in [
+        suffixes,
+        suffixes.values(),
+        address_constants.STREET_TYPE_ABBREVIATIONS,
+        address_constants.STREET_TYPE_ABBREVIATIONS.values(),
+        address_constants.LONGHAND_DIRECTIONALS,
+        address_constants.LONGHAND_DIRECTIONALS.values(),
+        address_constants.OCCUPANCY_TYPE_ABBREVIATIONS,
+        address_constants.OCCUPANCY_TYPE_ABBREVIATIONS.values(),
+        address_constants.CITY_ABBREVIATIONS,
+        address_constants.CITY_ABBREVIATIONS.values(),
+    ]
+    for key in vocabulary
+    for word in key.split()
+}
+
+
+def new_address_trace(slowest: int = 0) -> dict:
+    """
+    Creates an address parse trace, recorded by tag_addresses:
+        * slowest: number of slowest addresses kept; 0 disables tracing
+        * latencies: histogram of parse latencies, see trace_address
+        * records: heap of the (seconds, address, timed_out) of the slowest addresses
+        * timed_out: addresses that ran out of time
+
+    Returns a dict
+    """
+    return {"slowest": slowest, "latencies": Counter(), "records": [], "timed_out": []}
+
+
+@cache
+def get_cleaning_version(rules_fingerprint: str = "") -> str:
+    """
+    Fingerprint of the cleaning code, the address parsing libraries it uses and
+    the cleaning rules from the config (see compile_rules). Changes whenever the
+    cleaning rules change, so stored cleaning results can be invalidated.
+
+    Returns:
+        str: A short hex digest.
+    """
+    fingerprint = hashlib.sha256(rules_fingerprint.encode())
+    for package in ["usaddress", "usaddress-scourgify"]:
+        fingerprint.update(f"{package}=={version(package)}".encode())
+    for source in sorted(Path(__file__).parent.glob("*.py")):
+        fingerprint.update(source.read_bytes())
+
+    return fingerprint.hexdigest()[:16]
+
 
 def predict_org(name: str) -> int:
     """
@@ -39,11 +154,6 @@ def predict_org(name: str) -> int:
     Returns:
         int: 1 if the name is an organization, 0 if the name is an individual.
     """
-    individual_names = re.compile(
-        r"CURRENT OWNER|TAX PAYER OF|OWNER OF RECORD|PROPERTY OWNER",
-        flags=re.IGNORECASE,
-    )
-
     if (
         re.search("0-1", name)
         or re.search(ABB_PATTERNS, name)
@@ -53,13 +163,30 @@ def predict_org(name: str) -> int:
         return 1
 
     # Doing this because GX PROPERTY OWNER LLC exists
-    if re.search(individual_names, name):
+    if re.search(INDIVIDUAL_NAMES_PATTERNS, name):
         return 0
 
     else:
         return 0
 
 
+def predict_org_expr(name: pl.Expr, rules: dict | None = None) -> pl.Expr:
+    """
+    Vectorized version of predict_org as a Polars expression, testing the
+    organization patterns of the compiled cleaning rules in one pass.
+
+    Args:
+        name (pl.Expr): An expression of entity names.
+        rules (dict): Cleaning rules from compile_rules, the built-in rules by default.
+
+    Returns:
+        pl.Expr: A boolean expression, true if the name is an organization.
+    """
+    rules = rules or default_rules
+
+    return name.str.contains(rules["organization"])
+
+
 def clean_zipcode(raw: str | int) -> str:
     """
     Modified from the function written by Anthony Moser of the deseguys project.
@@ -80,9 +207,42 @@ def clean_zipcode(raw: str | int) -> str:
         return zipcode
 
 
+def clean_zipcode_expr(raw: pl.Expr) -> pl.Expr:
+    """
+    Vectorized version of clean_zipcode as a Polars expression, with nulls kept
+    as nulls.
+
+    Returns a pl.Expr
+    """
+    return raw.cast(pl.String).str.slice(0, 5)
+
+
+@cache
+def load_zip_table() -> pl.DataFrame:
+    """
+    Loads the bundled table of 5-digit zipcodes with their city and state, built
+    from USPS data in the zipcodes package, version 3.0.0, by
+    scripts/build_zipcodes.py: one row per zipcode, with city and state
+    uppercased. It is read once per process.
+
+    Returns:
+        pl.DataFrame: A DataFrame with zipcode, city and state columns.
+    """
+    return pl.read_parquet(Path(__file__).parent / "data" / "zipcodes.parquet")
+
+
+@cache
+def get_zip_lookup() -> dict[str, tuple[str, str]]:
+    """
+    Returns a dict from 5-digit zipcode to (city, state), built from load_zip_table.
+    """
+    zips = load_zip_table()
+    return dict(zip(zips["zipcode"], zip(zips["city"], zips["state"])))
+
+
 def identify_state_city(zipcode: str) -> tuple:
     """
-    Use zipcode to look up state and city info using the uszipcode API.
+    Use zipcode to look up state and city info in the bundled zipcode table.
 
     Args:
         zipcode (str): A zipcode.
@@ -92,115 +252,424 @@ def identify_state_city(zipcode: str) -> tuple:
     """
     zipcode = clean_zipcode(zipcode)
     try:
-        if zipcode in zip_cache:
-            zip_city = zip_cache[zipcode]["city"]
-            zip_state = zip_cache[zipcode]["state"]
+        zipcode = str(int(zipcode)).zfill(5)
 
-            return (zip_city, zip_state)
+    # Handle cases where zip code is null or not a number
+    except ValueError:
+        return (None, None)
 
-        else:
-            engine = SearchEngine()
-            zipcode_obj = engine.by_zipcode(int(zipcode))
-            # zip_cache[zipcode] = zipcode
+    return get_zip_lookup().get(zipcode, (None, None))
 
-            zip_city = zipcode_obj.major_city.upper()
-            zip_state = zipcode_obj.state
 
-            zip_citystate = {"city": zip_city, "state": zip_state}
-            zip_cache[zipcode] = zip_citystate
+def backfill_city_state(addresses: pl.Series) -> pl.Series:
+    """
+    Vectorized zipcode backfill for a Series of address structs from
+    clean_address. Where the parsed state is not a valid state abbreviation,
+    overwrite city and state with those of the postal code, if it is known.
 
-            return (zip_city, zip_state)
+    Args:
+        addresses (pl.Series): A Series of address structs.
 
-    # Handle cases where zip code is null or not a number
-    except AttributeError:
-        return (None, None)
+    Returns:
+        pl.Series: A Series of address structs.
+    """
+    # same zipcodes as identify_state_city: the first five characters if they are digits
+    zipcode = pl.col("postal_code").str.slice(0, 5).str.strip_chars()
+    zipcode = pl.when(zipcode.str.contains(r"^[0-9]+$")).then(zipcode.str.zfill(5))
+    zips = load_zip_table().rename({"city": "zip_city", "state": "zip_state"})
+    invalid_state = pl.col("state").is_null() | ~pl.col("state").is_in(state_abbr)
+
+    return (
+        addresses.struct.unnest()
+        .with_columns(zipcode.alias("zipcode"))
+        .join(zips, on="zipcode", how="left", maintain_order="left")
+        .with_columns(
+            pl.when(invalid_state).then(pl.coalesce("zip_city", "city")).otherwise("city").alias("city"),
+            pl.when(invalid_state).then(pl.coalesce("zip_state", "state")).otherwise("state").alias("state"),
+        )
+        .select(list(ADDRESS_STRUCT.to_schema()))
+        .to_struct(addresses.name)
+    )
 
-    except TypeError:
-        return (None, None)
 
-    except ValueError:
-        return (None, None)
+def init_address_worker() -> None:
+    """
+    Warms up an address cleaning worker process once, before it is given any work:
+    runs clean_address once so the usaddress model and scourgify are loaded.
+    """
+    clean_address("123 E HYDE PARK BLVD APT 15 CHICAGO IL 60615")
+
+
+def new_address_executor(n_workers: int | None = None) -> ProcessPoolExecutor:
+    """
+    Creates a pool of warmed up address cleaning worker processes. Workers are
+    spawned rather than forked, since forking a process running polars can deadlock.
+
+    Args:
+        n_workers (int): Number of worker processes. Defaults to the number of cores.
+
+    Returns:
+        ProcessPoolExecutor: The worker pool, to be shut down by the caller.
+    """
+    return ProcessPoolExecutor(
+        max_workers=n_workers or multiprocessing.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_address_worker,
+    )
+
+
+def recycle_address_executor(pool: dict) -> None:
+    """
+    Kills the worker processes of pool["executor"] and drops the pool, so a new
+    one is started on next use. A worker stuck in the parser can't be
+    interrupted, and ProcessPoolExecutor has no way to stop a single worker.
+
+    Returns None
+    """
+    executor = pool["executor"]
+    for process in list(executor._processes.values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+    pool["executor"] = None
+
+
+def address_worker_pid(delay: float) -> int:
+    """
+    Worker task for start_address_executor: waits delay seconds, so each task
+    is picked up by a different idle worker.
+
+    Returns the worker's process id
+    """
+    time.sleep(delay)
+
+    return os.getpid()
+
+
+def start_address_executor(pool: dict) -> None:
+    """
+    Starts a worker pool in pool["executor"] with pool["workers"] workers, and
+    waits until all of them are warmed up, so starting them doesn't count
+    against the deadline of tag_addresses_in_pool.
+
+    Returns None
+    """
+    n_workers = max(pool["workers"], 1)
+    pool["executor"] = new_address_executor(n_workers)
+    pids: set[int] = set()
+    while len(pids) < n_workers:
+        pids.update(pool["executor"].map(address_worker_pid, [0.01] * n_workers))
+
+
+def time_address_parser(parser: Callable[[str], dict], address: str) -> tuple[dict, float]:
+    """
+    Worker task for tag_addresses_in_pool: parses an address and times it.
+
+    Returns a tuple of the tags and seconds taken
+    """
+    start = perf_counter()
+    tags = parser(address)
+
+    return tags, perf_counter() - start
+
+
+def tag_addresses_in_pool(
+    addresses: list[str], pool: dict, budget: float, parser: Callable[[str], dict] | None = None
+) -> list[tuple[dict | None, float]]:
+    """
+    Parses addresses with parser in the worker pool of pool, under a deadline of
+    budget seconds per address. Addresses are sent in waves of one per worker,
+    and the results of a wave are waited for until budget seconds after it was
+    sent. If any address of a wave is still running by then, it is left
+    untagged and the pool is recycled with recycle_address_executor.
+
+    Args:
+        addresses (list): Normalized addresses.
+        pool (dict): A dict holding the worker pool under "executor", or None
+            to start one with start_address_executor, and its number of workers
+            under "workers", such as a clean cache.
+        budget (float): Seconds an address may take.
+        parser (function): The full parser, parse_address_full by default. It
+            must be picklable, to be sent to the workers.
+
+    Returns:
+        list: The tags of each address, or None if it ran out of time, and the
+            seconds it took.
+    """
+    parser = parser or parse_address_full
+    n_workers = max(pool["workers"], 1)
+    results: list[tuple[dict | None, float]] = []
+    for start in range(0, len(addresses), n_workers):
+        if pool["executor"] is None:
+            start_address_executor(pool)
+
+        deadline = perf_counter() + budget
+        wave = addresses[start : start + n_workers]
+        futures = [pool["executor"].submit(time_address_parser, parser, address) for address in wave]
+        hung = False
+        for future in futures:
+            try:
+                results.append(future.result(timeout=max(deadline - perf_counter(), 0)))
+            except FutureTimeoutError:
+                results.append((None, budget))
+                hung = True
+        if hung:
+            recycle_address_executor(pool)
+
+    return results
 
 
 def clean_address_batch(address_batch: list[str]) -> list[dict]:
     return [clean_address(addr) for addr in address_batch]
 
 
-def clean_address_batch_parser(df_batch: pl.Series) -> pl.Series:
-    # 2) Pull the batch into Python for parallel parsing
-    addresses = df_batch.to_list()
-
-    # 3) Spin up one process per core (or core-1)
-    n_workers = multiprocessing.cpu_count()
-
-    def chunk_list(lst: list, n_chunks: int) -> list[list]:
-        chunk_size = ceil(len(lst) / n_chunks)
-        return [lst[i : i + chunk_size] for i in range(0, len(lst), chunk_size)]
-
-    chunks = chunk_list(addresses, n_workers)
-
-    with ProcessPoolExecutor(max_workers=n_workers) as exe:
-        results = exe.map(clean_address_batch, chunks)
-
-    # Flatten the list of lists
-    parsed_dicts = [item for sublist in results for item in sublist]
-
-    # 4) Build a Polars DataFrame of the parsed results
-    parsed_df = pl.DataFrame(
-        parsed_dicts,
-        schema={
-            "raw": pl.String,
-            "address_number": pl.String,
-            "street_pre_directional": pl.String,
-            "street_name": pl.String,
-            "street_post_type": pl.String,
-            "unit_type": pl.String,
-            "unit_number": pl.String,
-            "subaddress_type": pl.String,
-            "subaddress_identifier": pl.String,
-            "city": pl.String,
-            "state": pl.String,
-            "postal_code": pl.String,
-            "street": pl.String,
-        },
-    )
+def tag_address_ipc_chunk(
+    input_path: str, offset: int, length: int, output_path: str, slowest: int = 0, budget: float | None = None
+) -> tuple[Counter[str], dict]:
+    """
+    Worker task for clean_address_batch_parser. Memory maps the Arrow IPC file of
+    normalized addresses at input_path, tags the length addresses starting at
+    offset with tag_addresses, and writes the tag columns to an Arrow IPC file
+    at output_path. Returns the number of addresses parsed by each tier and the
+    address trace of the chunk, keeping its slowest addresses.
+    """
+    tiers: Counter[str] = Counter()
+    trace = new_address_trace(slowest)
+    with pa.memory_map(input_path) as source:
+        addresses = pa.ipc.open_file(source).read_all().column(0).slice(offset, length).to_pylist()
+
+    columns = tag_addresses(addresses, tiers, trace, budget)
+    tags = pa.table({field: pa.array(values, type=pa.string()) for field, values in columns.items()})
+    with pa.OSFile(output_path, "wb") as sink, pa.ipc.new_file(sink, tags.schema) as writer:
+        writer.write_table(tags)
+
+    return tiers, trace
+
+
+def clean_address_batch_parser(
+    df_batch: pl.Series,
+    n_workers: int | None = None,
+    chunk_size: int = 10_000,
+    executor: ProcessPoolExecutor | None = None,
+    normalized: bool = False,
+    tiers: Counter[str] | None = None,
+    trace: dict | None = None,
+    budget: float | None = None,
+) -> pl.Series:
+    """
+    Cleans a Series of raw addresses, tagging them in parallel worker processes.
+    The output is identical to clean_addresses, or parse_addresses if normalized.
 
-    # 5) Re-attach the original address for the join key
-    parsed_struct = parsed_df.select(pl.struct(pl.all()).alias("address_struct")).to_series(0)
+    Addresses are exchanged with the workers as Arrow IPC files in shared memory
+    (/dev/shm where available): workers memory map their chunk of the input and
+    write back tag columns, so only file paths and offsets are pickled.
 
-    return parsed_struct
+    Args:
+        df_batch (pl.Series): Raw addresses.
+        n_workers (int): Number of worker processes if no executor is given.
+        chunk_size (int): Number of addresses sent to a worker at a time.
+        executor (ProcessPoolExecutor): Worker pool from new_address_executor to
+            reuse. If None, a pool is created and shut down for this call.
+        normalized (bool): Whether the addresses are already normalized, in which
+            case the raw and address_norm components are left empty.
+        tiers (Counter): If given, the number of addresses parsed by each tier
+            of tag_addresses is added to it.
+        trace (dict): If given, an address trace from new_address_trace that the
+            workers' traces are merged into.
+        budget (float): Seconds an address may take in the full parser, or None.
 
+    Returns:
+        pl.Series: A Series of address structs.
+    """
+    if df_batch.is_empty():
+        return pl.Series(df_batch.name, [], dtype=ADDRESS_STRUCT)
+
+    raw = df_batch.cast(pl.String)
+    addresses = raw if normalized else raw.to_frame().select(normalize_address_expr(pl.col(raw.name))).to_series()
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None  # noqa: S108
+
+    with tempfile.TemporaryDirectory(dir=shm_dir, prefix="chainlink_") as tmp_dir:
+        input_path = os.path.join(tmp_dir, "addresses.arrow")
+        addresses = pa.table({"address": addresses.to_arrow()})
+        with pa.OSFile(input_path, "wb") as sink, pa.ipc.new_file(sink, addresses.schema) as writer:
+            writer.write_table(addresses)
+
+        offsets = list(range(0, len(df_batch), chunk_size))
+        lengths = [min(chunk_size, len(df_batch) - offset) for offset in offsets]
+        output_paths = [os.path.join(tmp_dir, f"tags_{i}.arrow") for i in range(len(offsets))]
+        slowest = 0 if trace is None else trace["slowest"]
+        n_tasks = len(offsets)
+        tasks = ([input_path] * n_tasks, offsets, lengths, output_paths, [slowest] * n_tasks, [budget] * n_tasks)
+
+        if executor is None:
+            with new_address_executor(n_workers) as exe:
+                results = list(exe.map(tag_address_ipc_chunk, *tasks))
+        else:
+            results = list(executor.map(tag_address_ipc_chunk, *tasks))
+        for counts, chunk_trace in results:
+            if tiers is not None:
+                tiers.update(counts)
+            if trace is not None:
+                merge_address_trace(trace, chunk_trace)
 
-def clean_address(raw: str) -> dict:
+        tags = []
+        for path in output_paths:
+            with pa.OSFile(path, "rb") as source:
+                tags.append(pa.ipc.open_file(source).read_all())
+
+    return finish_address_tags(pl.DataFrame(pa.concat_tables(tags)), None if normalized else raw).alias(df_batch.name)
+
+
+def parse_address_fast(address: str) -> dict | None:
     """
-    Given a raw address, first conduct baseline address cleaning, then
-    identify and return the components of the address. Where possible, infer
-    correct city and state value from the zip code given.
+    Fast deterministic parser for well-formed addresses such as
+    "1234 N MAIN ST APT 5 CHICAGO IL 60601": a house number, an optional
+    directional, a street name, a common street type, an optional unit, a city,
+    a state abbreviation and a zipcode. Any address that doesn't match exactly,
+    or contains words that scourgify or usaddress might treat differently, is left
+    to parse_address_full.
 
     Args:
-        raw (str): A raw address.
+        address (str): An address with punctuation removed and single spaces.
 
     Returns:
-        dict: A dictionary of address components.
+        dict: usaddress labels and values, or None if the address is ambiguous.
     """
-    if not isinstance(raw, str) or raw == "":
-        return {
-            "raw": raw,
-            "address_number": None,
-            "street_pre_directional": None,
-            "street_name": None,
-            "street_post_type": None,
-            "unit_type": None,
-            "unit_number": None,
-            "subaddress_type": None,
-            "subaddress_identifier": None,
-            "city": None,
-            "state": None,
-            "postal_code": None,
-            "street": None,
-            "address_norm": None,
-        }
+    tokens = address.split(" ")
+    if len(tokens) < 6 or not re.fullmatch(r"[1-9][0-9]*", tokens[0]):
+        return None
+    if tokens[-2] not in state_abbr or not re.fullmatch(r"[0-9]{5}(-[0-9]{4})?", tokens[-1]):
+        return None
+
+    tags = {"AddressNumber": tokens[0]}
+    i = 1
+    if tokens[i] in fast_directionals:
+        tags["StreetNamePreDirectional"] = tokens[i]
+        i += 1
+
+    # street name words up to the street type
+    j = i
+    while (
+        j < len(tokens) - 2
+        and tokens[j] not in fast_reserved_words
+        and re.fullmatch(r"[A-Z]+|[0-9]+(ST|ND|RD|TH)", tokens[j])
+    ):
+        j += 1
+    if j == i or j >= len(tokens) - 3 or tokens[j] not in fast_street_types:
+        return None
+    tags["StreetName"] = " ".join(tokens[i:j])
+    tags["StreetNamePostType"] = tokens[j]
+    j += 1
+
+    if tokens[j] in fast_unit_types:
+        if j + 1 >= len(tokens) - 3 or not re.fullmatch(r"[A-Z0-9]+", tokens[j + 1]):
+            return None
+        tags["OccupancyType"] = tokens[j]
+        tags["OccupancyIdentifier"] = tokens[j + 1]
+        j += 2
+
+    # usaddress splits multi-word cities with short words, like MC HENRY, unpredictably
+    city = tokens[j:-2]
+    if not 1 <= len(city) <= 3:
+        return None
+    for word in city:
+        if word in fast_reserved_words or not re.fullmatch(r"[A-Z]+", word) or (len(city) > 1 and len(word) < 3):
+            return None
+
+    tags["PlaceName"] = " ".join(city)
+    tags["StateName"] = tokens[-2]
+    tags["ZipCode"] = tokens[-1]
+
+    return tags
 
+
+def parse_address_full(address: str) -> dict:
+    """
+    Normalizes an address with scourgify, then tags its components with usaddress.
+    If usaddress finds a repeated label, the fields parsed before it are kept.
+    To parse many addresses, use tag_address_batch on the results of
+    normalize_address_scourgify.
+
+    Args:
+        address (str): An address with punctuation removed and single spaces.
+
+    Returns:
+        dict: usaddress labels and values.
+    """
+    return tag_address_batch([normalize_address_scourgify(address)])[0]
+
+
+def normalize_address_scourgify(address: str) -> str:
+    """
+    Normalizes an address with scourgify, or returns it unchanged if scourgify fails.
+
+    Returns a str
+    """
+    try:
+        normalized = normalize_address_record(address)
+        return " ".join(value for value in normalized.values() if value is not None)
+
+    except Exception:
+        return address
+
+
+def address_token_features(token: str) -> tuple[list[str], list[str], list[str]]:
+    """
+    Computes the usaddress CRF features of a token, flattened to the attribute
+    names pycrfsuite builds from usaddress.tokens2features, for the token itself
+    and as the previous and next token of its neighbours. Features that are
+    False have zero weight and are left out.
+
+    Returns a tuple of lists of str
+    """
+
+    def flatten(features: dict, prefix: str) -> list[str]:
+        attributes = []
+        for key, value in features.items():
+            if isinstance(value, str):
+                attributes.append(f"{prefix}{key}:{value}")
+            elif value:
+                attributes.append(prefix + key)
+        return attributes
+
+    features = usaddress.tokenFeatures(token)
+    return flatten(features, ""), flatten(features, "previous:"), flatten(features, "next:")
+
+
+def tag_address_batch(addresses: list[str]) -> list[dict]:
+    """
+    Batched version of usaddress.tag. Tokenizes a batch of addresses, computes
+    the CRF features of each distinct token once for the whole batch, and runs
+    the usaddress CRF tagger over each address with tag_address.
+
+    Args:
+        addresses (list): Addresses normalized by normalize_address_scourgify.
+
+    Returns:
+        list: A dict of usaddress labels and values per address.
+    """
+    token_features: dict[str, tuple[list[str], list[str], list[str]]] = {}
+
+    return [tag_address(address, token_features) for address in addresses]
+
+
+def tag_address(address: str, token_features: dict[str, tuple[list[str], list[str], list[str]]]) -> dict:
+    """
+    Tags an address with the usaddress CRF tagger, as usaddress.tag does.
+    token_features caches the features of each token from
+    address_token_features, to be shared by all the addresses of a batch.
+
+    As with usaddress.tag, tokens with the same label are joined. If a label is
+    repeated after another label, where usaddress.tag raises
+    RepeatedLabelError, the last value of each of the labels used by
+    clean_address is kept instead.
+
+    Args:
+        address (str): An address normalized by normalize_address_scourgify.
+        token_features (dict): Features of the tokens seen so far.
+
+    Returns:
+        dict: usaddress labels and values.
+    """
     FIELD_NAMES = [
         "AddressNumber",
         "StreetNamePreDirectional",
@@ -215,6 +684,73 @@ def clean_address(raw: str) -> dict:
         "ZipCode",
     ]
 
+    tokens = usaddress.tokenize(address)
+    if not tokens:
+        return {}
+
+    features = []
+    for token in tokens:
+        if token not in token_features:
+            token_features[token] = address_token_features(token)
+        features.append(token_features[token])
+
+    # the same features as usaddress.tokens2features
+    n_tokens = len(tokens)
+    items = []
+    for i, (own, _, _) in enumerate(features):
+        item = list(own)
+        if i > 0:
+            item += features[i - 1][1]
+        if i < n_tokens - 1:
+            item += features[i + 1][2]
+        items.append(item)
+    items[0].append("address.start")
+    items[-1].append("address.end")
+    if n_tokens > 1:
+        items[1].append("previous:address.start")
+        items[-2].append("next:address.end")
+
+    parsed = list(zip(tokens, usaddress.TAGGER.tag(items)))
+
+    # group tokens by label, as in usaddress.tag
+    components: dict[str, list[str]] = {}
+    last_label = None
+    is_intersection = False
+    repeated = False
+    for token, label in parsed:
+        if label == "IntersectionSeparator":
+            is_intersection = True
+        if "StreetName" in label and is_intersection:
+            label = "Second" + label
+
+        if label == last_label:
+            components[label].append(token)
+        elif label not in components:
+            components[label] = [token]
+        else:
+            repeated = True
+            break
+
+        last_label = label
+
+    # retain any successfully parsed fields
+    if repeated:
+        return {label: token for token, label in parsed if label in FIELD_NAMES}
+
+    return {label: " ".join(values).strip(" ,;") for label, values in components.items()}
+
+
+def normalize_address(raw: str) -> str:
+    """
+    Baseline address cleaning before parsing: removes commas and periods,
+    replaces # with UNIT, and collapses whitespace.
+
+    Args:
+        raw (str): A raw address.
+
+    Returns:
+        str: The normalized address.
+    """
     # remove spaces and punct
     raw_stripped = re.sub(r",|\.", "", raw).strip()
     # replace # with UNIT
@@ -222,100 +758,351 @@ def clean_address(raw: str) -> dict:
     # replace multiple spaces with single space
     to_normalize = re.sub(r"\s+", " ", to_normalize)
 
-    try:
-        normalized = normalize_address_record(to_normalize)
-        normalized = " ".join(value for value in normalized.values() if value is not None)
+    return to_normalize
 
-    except Exception:
-        normalized = to_normalize
 
-    try:
-        tags = usaddress.tag(normalized)
-        tags = dict(tags[0])
+def normalize_address_expr(raw: pl.Expr) -> pl.Expr:
+    """
+    Vectorized version of normalize_address as a Polars expression.
 
-    # retain any successfully parsed fields
-    except usaddress.RepeatedLabelError as e:
-        tags = {}
-
-        for parsed_field in e.parsed_string:
-            value, label = parsed_field
-
-            if label in FIELD_NAMES:
-                tags[label] = value
-
-    record = {
-        "raw": raw,
-        "address_number": tags.get("AddressNumber"),
-        "street_pre_directional": tags.get("StreetNamePreDirectional"),
-        "street_name": tags.get("StreetName"),
-        "street_post_type": tags.get("StreetNamePostType"),
-        "unit_type": tags.get("OccupancyType"),
-        "unit_number": tags.get("OccupancyIdentifier"),
-        "subaddress_type": tags.get("SubaddressType"),
-        "subaddress_identifier": tags.get("SubaddressIdentifier"),
-        "city": tags.get("PlaceName"),
-        "state": tags.get("StateName"),
-        "postal_code": tags.get("ZipCode"),
-        "address_norm": str(re.sub(r"[^a-zA-Z0-9]+", "", raw).upper()),
-    }
+    Args:
+        raw (pl.Expr): An expression of raw addresses.
 
-    if record["city"] is not None:
-        record["city"] = re.sub(r"[^A-z\s]", "", record["city"]).strip()
+    Returns:
+        pl.Expr: An expression of normalized addresses.
+    """
+    return (
+        raw.str.replace_all(r"[,.]", "")
+        .str.strip_chars(python_whitespace)
+        .str.replace_all("#", " UNIT ", literal=True)
+        .str.replace_all(f"[{whitespace_class}]+", " ")
+    )
 
-        if record["city"] == "":
-            record["city"] = None
 
-    if record["street_name"] is not None:
-        record["street_name"] = re.sub(r",\.", "", record["street_name"]).strip()
-        # Remove unit from street name for cases where the address parser
-        # erroneously included it
-        record["street_name"] = re.sub(r"UNIT.*", "", record["street_name"]).strip()
-        if record["street_name"] == "":
-            record["street_name"] = None
+def address_norm_expr(raw: pl.Expr) -> pl.Expr:
+    """
+    Computes the address_norm component of clean_address, the raw address with
+    only its letters and digits, as a Polars expression.
 
-    if record["unit_number"] is not None:
-        record["unit_number"] = re.sub(r"[^[A-z0-9]", "", record["unit_number"])
+    Args:
+        raw (pl.Expr): An expression of raw addresses.
+
+    Returns:
+        pl.Expr: An expression of uppercase strings, null if empty.
+    """
+    address_norm = raw.str.replace_all("[^a-zA-Z0-9]+", "").str.to_uppercase()
 
-        if record["unit_number"] == "":
-            record["unit_number"] = None
+    return pl.when(address_norm != "").then(address_norm)
 
-    # Overwrite city and state using uszip if the parsed state is not valid
-    if record["state"] not in state_abbr or record["state"] is None:
-        zip_city, zip_state = identify_state_city(record["postal_code"])
 
-        # if don't find valid city, state, leave original
-        if zip_city is not None:
-            record["city"] = zip_city
+def clean_address(raw: str) -> dict:
+    """
+    Given a raw address, first conduct baseline address cleaning, then
+    identify and return the components of the address. To clean many
+    addresses, use clean_addresses. Use backfill_city_state on the results
+    to infer the correct city and state from the zip code given.
 
-        if zip_state is not None:
-            record["state"] = zip_state
+    Args:
+        raw (str): A raw address.
+
+    Returns:
+        dict: A dictionary of address components.
+    """
+    return clean_addresses(pl.Series([raw if isinstance(raw, str) else None], dtype=pl.String))[0]
+
+
+def clean_addresses(raw: pl.Series) -> pl.Series:
+    """
+    Cleans a Series of raw addresses: normalizes them with normalize_address_expr,
+    tags them with tag_addresses and finishes the components with
+    finish_address_tags.
+
+    Args:
+        raw (pl.Series): Raw addresses.
+
+    Returns:
+        pl.Series: A Series of address structs.
+    """
+    addresses = raw.to_frame("raw").select(normalize_address_expr(pl.col("raw")))["raw"]
+
+    return finish_address_tags(pl.DataFrame(tag_addresses(addresses.to_list())), raw).alias(raw.name)
+
+
+def parse_address(address: str) -> dict:
+    """
+    Identify and return the components of an address normalized by
+    normalize_address or normalize_address_expr. The raw and address_norm
+    components are left empty, to be filled in from the raw address. To parse
+    many addresses, use parse_addresses.
+
+    Args:
+        address (str): A normalized address.
+
+    Returns:
+        dict: A dictionary of address components.
+    """
+    return parse_addresses(pl.Series([address], dtype=pl.String))[0]
+
+
+def parse_addresses(
+    addresses: pl.Series,
+    tiers: Counter[str] | None = None,
+    trace: dict | None = None,
+    budget: float | None = None,
+    pool: dict | None = None,
+) -> pl.Series:
+    """
+    Vectorized version of parse_address for a Series of normalized addresses.
+    tiers, trace, budget and pool are passed on to tag_addresses.
+
+    Returns a pl.Series of address structs
+    """
+    tags = tag_addresses(addresses.to_list(), tiers, trace, budget, pool)
+
+    return finish_address_tags(pl.DataFrame(tags)).alias(addresses.name)
+
+
+def trace_address(trace: dict, address: str, seconds: float, timed_out: bool = False) -> None:
+    """
+    Records the parse latency of an address in an address trace. Latencies are
+    counted in logarithmic buckets 10% wide, from a microsecond, and the
+    address is kept if it is among the trace's slowest.
+
+    Returns None
+    """
+    trace["latencies"][math.ceil(math.log(max(seconds, 1e-6) / 1e-6, 1.1))] += 1
+    keep_slowest(trace, (seconds, address, timed_out))
+
+
+def keep_slowest(trace: dict, record: tuple[float, str, bool]) -> None:
+    """
+    Adds a (seconds, address, timed_out) record to the slowest addresses of a
+    trace, dropping the fastest record once there are more than trace["slowest"].
+
+    Returns None
+    """
+    if len(trace["records"]) < trace["slowest"]:
+        heapq.heappush(trace["records"], record)
+    elif trace["slowest"] > 0:
+        heapq.heappushpop(trace["records"], record)
+
+
+def merge_address_trace(trace: dict, other: dict) -> None:
+    """
+    Adds the latencies, slowest addresses and timeouts of other to trace.
+
+    Returns None
+    """
+    trace["latencies"].update(other["latencies"])
+    trace["timed_out"].extend(other["timed_out"])
+    for record in other["records"]:
+        keep_slowest(trace, record)
 
-    street_fields = [
-        "address_number",
-        "street_pre_directional",
-        "street_name",
-        "street_post_type",
-    ]
-    record["street"] = " ".join([
-        record[field] for field in street_fields if (record[field] is not None) and (record[field] != "")
-    ])
-    if (record["street"] == "") or (record["street"] == " "):
-        record["street"] = None
 
-    if suffixes.get(record["street_post_type"]):
-        record["street_post_type"] = suffixes.get(record["street_post_type"])
+def address_latency_percentiles(trace: dict, percentiles: list[float]) -> list[float]:
+    """
+    Estimates percentiles of the parse latencies in an address trace, in
+    seconds, to within 10%.
 
-    for key, value in record.items():
-        record[key] = None if value == "" else value
+    Returns a list of float
+    """
+    total = trace["latencies"].total()
+    buckets = sorted(trace["latencies"].items())
+    estimates = []
+    for percentile in percentiles:
+        count = 0
+        for bucket, n in buckets:
+            count += n
+            if count >= percentile / 100 * total:
+                estimates.append(1e-6 * 1.1**bucket)
+                break
+
+    return estimates
+
+
+def tag_addresses(
+    addresses: list[str | None],
+    tiers: Counter[str] | None = None,
+    trace: dict | None = None,
+    budget: float | None = None,
+    pool: dict | None = None,
+) -> dict[str, list[str | None]]:
+    """
+    Tags each normalized address with parse_address_fast, or with scourgify and
+    tag_address if the address is ambiguous, and collects the tags into one
+    column per component in ADDRESS_TAGS.
+
+    An ambiguous address that takes longer than budget seconds is left
+    untagged, so it falls back to its normalized form in address_norm.
+    Addresses longer than FULL_PARSE_MAX_CHARS or FULL_PARSE_MAX_TOKENS are
+    left untagged without parsing them. With a pool, the full parser runs in its
+    workers with tag_addresses_in_pool, which stops waiting at the deadline.
+    Otherwise the parsers can't be interrupted, so the time is checked after
+    scourgify, which is skipped past the budget, and again after tagging.
+
+    Args:
+        addresses (list): Normalized addresses.
+        tiers (Counter): If given, the number of addresses parsed by the fast
+            tier and by the full parser, and that ran out of time, are added to it.
+        trace (dict): If given, an address trace from new_address_trace that
+            addresses are traced in, if it is enabled, and that records the
+            addresses that ran out of time.
+        budget (float): Seconds an address may take in the full parser, or None.
+        pool (dict): If given with a budget, the worker pool for
+            tag_addresses_in_pool, such as a clean cache.
 
-    for k, v in record.items():
-        if v is None:
+    Returns:
+        dict: A list of tag values per address component.
+    """
+    if tiers is None:
+        tiers = Counter()
+    if trace is None:
+        trace = new_address_trace()
+    columns: dict[str, list[str | None]] = {field: [None] * len(addresses) for field in ADDRESS_TAGS}
+
+    def add_tags(i: int, tags: dict) -> None:
+        for field, label in ADDRESS_TAGS.items():
+            value = tags.get(label)
+            if value is not None:
+                columns[field][i] = str(value)
+
+    tracing = trace["slowest"] > 0
+
+    # well-formed addresses skip scourgify and usaddress
+    ambiguous: list[tuple[int, str]] = []
+    for i, address in enumerate(addresses):
+        if not address:
             continue
-        # Force everything to a Python string:
-        if not isinstance(v, str):
-            record[k] = str(v)
+        start = perf_counter() if tracing else 0
+        tags = parse_address_fast(address)
+        if tags is not None:
+            add_tags(i, tags)
+            if tracing:
+                trace_address(trace, address, perf_counter() - start)
+        else:
+            ambiguous.append((i, address))
+
+    tiers["fast"] += len(addresses) - addresses.count(None) - addresses.count("") - len(ambiguous)
+
+    if budget is not None:
+        # addresses too long to parse in time skip the full parser
+        oversized = [
+            (i, raw)
+            for i, raw in ambiguous
+            if len(raw) > FULL_PARSE_MAX_CHARS or raw.count(" ") >= FULL_PARSE_MAX_TOKENS
+        ]
+        if oversized:
+            tiers["oversized"] += len(oversized)
+            trace["timed_out"].extend(raw for _, raw in oversized)
+            skipped = {i for i, _ in oversized}
+            ambiguous = [(i, raw) for i, raw in ambiguous if i not in skipped]
+
+    tiers["full"] += len(ambiguous)
+
+    if budget is not None and pool is not None:
+        parsed = tag_addresses_in_pool([raw for _, raw in ambiguous], pool, budget)
+    else:
+        parsed = tag_ambiguous_addresses([raw for _, raw in ambiguous], budget)
+
+    for (i, raw), (tags, elapsed) in zip(ambiguous, parsed):
+        if tags is None:
+            tiers["timeout"] += 1
+            trace["timed_out"].append(raw)
+        else:
+            add_tags(i, tags)
+        if tracing:
+            trace_address(trace, raw, elapsed, tags is None)
+
+    return columns
+
+
+def tag_ambiguous_addresses(addresses: list[str], budget: float | None = None) -> list[tuple[dict | None, float]]:
+    """
+    Parses addresses with scourgify and tag_address in this process. An
+    address over budget seconds after scourgify skips tag_address, and its tags
+    are dropped if it is over budget after tag_address.
+
+    Returns a list of the tags of each address, or None if it ran out of time,
+    and the seconds it took
+    """
+    # scourgify every address before tagging them, which keeps each library's
+    # working set in the CPU caches
+    normalized: list[str | None] = []
+    seconds: list[float] = []
+    for raw in addresses:
+        start = perf_counter()
+        scourgified = normalize_address_scourgify(raw)
+        seconds.append(perf_counter() - start)
+        normalized.append(None if budget is not None and seconds[-1] > budget else scourgified)
+
+    # token features are shared by the whole batch, as in tag_address_batch
+    token_features: dict[str, tuple[list[str], list[str], list[str]]] = {}
+    results: list[tuple[dict | None, float]] = []
+    for address, elapsed in zip(normalized, seconds):
+        start = perf_counter()
+        tags = None if address is None else tag_address(address, token_features)
+        elapsed += perf_counter() - start
+        results.append((None if budget is not None and elapsed > budget else tags, elapsed))
+
+    return results
+
+
+def finish_address_tags(tags: pl.DataFrame, raw: pl.Series | None = None) -> pl.Series:
+    """
+    Turns the tag columns from tag_addresses into address components: strips
+    stray characters from the city, street name and unit number, builds the
+    street, standardizes the street type with the USPS suffixes, and replaces
+    empty strings with nulls.
+
+    Args:
+        tags (pl.DataFrame): Tag columns from tag_addresses.
+        raw (pl.Series): The raw addresses, for the raw and address_norm
+            components. If None, those components are left empty.
 
-    return record
+    Returns:
+        pl.Series: A Series of address structs.
+    """
+
+    def null_if_empty(expr: pl.Expr) -> pl.Expr:
+        return pl.when(expr != "").then(expr)
+
+    raw = pl.Series("raw", [None] * tags.height, dtype=pl.String) if raw is None else raw.cast(pl.String)
+    street_name = (
+        pl.col("street_name")
+        .str.replace_all(",.", "", literal=True)
+        .str.strip_chars(python_whitespace)
+        # Remove unit from street name for cases where the address parser
+        # erroneously included it
+        .str.replace_all("UNIT.*", "")
+        .str.strip_chars(python_whitespace)
+    )
+    street_fields = ["address_number", "street_pre_directional", "street_name", "street_post_type"]
+
+    return (
+        tags.with_columns(pl.col(field).cast(pl.String) for field in ADDRESS_TAGS)
+        .with_columns(
+            raw.alias("raw"),
+            address_norm_expr(pl.lit(raw)).alias("address_norm"),
+            null_if_empty(
+                pl.col("city").str.replace_all(f"[^A-z{whitespace_class}]", "").str.strip_chars(python_whitespace)
+            ).alias("city"),
+            null_if_empty(street_name).alias("street_name"),
+            null_if_empty(pl.col("unit_number").str.replace_all(r"[^\[A-z0-9]", "")).alias("unit_number"),
+        )
+        .with_columns(
+            null_if_empty(
+                pl.concat_str(
+                    [null_if_empty(pl.col(field)) for field in street_fields], separator=" ", ignore_nulls=True
+                )
+            ).alias("street"),
+            pl.col("street_post_type").replace(suffixes),
+        )
+        .select(
+            pl.col("raw"),
+            *(null_if_empty(pl.col(field)).alias(field) for field in ADDRESS_STRUCT.to_schema() if field != "raw"),
+        )
+        .to_struct()
+    )
 
 
 def remove_initial_I(raw: str) -> str:
@@ -359,3 +1146,200 @@ def clean_names(raw: str) -> str | None:
     else:
         return name
     return name
+
+
+def clean_names_expr(raw: pl.Expr, rules: dict | None = None) -> pl.Expr:
+    """
+    Vectorized version of clean_names as a Polars expression. Returns the same
+    values as applying clean_names to each raw name string, with nulls kept as
+    nulls.
+
+    The cleaning rules are compiled into one pass per kind of rule: all
+    exclusions are tested at once, all substitutions are replaced at once, and
+    word drops and synonyms are applied with a single map over the words of the
+    name, which is skipped if there are none.
+
+    Args:
+        raw (pl.Expr): An expression of raw name strings.
+        rules (dict): Cleaning rules from compile_rules, the built-in rules by default.
+
+    Returns:
+        pl.Expr: An expression of cleaned name strings.
+    """
+    rules = rules or default_rules
+
+    name = (
+        raw.str.to_uppercase()
+        .str.replace_many(rules["substitutions"], leftmost=True)
+        .str.replace_all(f"[^a-zA-Z0-9{whitespace_class}]", "")
+        .str.replace_all(f"[{whitespace_class}]{{2,}}", " ")
+    )
+    if rules["name_tokens"]:
+        tokens = rules["name_tokens"]
+        name = name.str.split(" ").list.eval(pl.element().replace(tokens).drop_nulls()).list.join(" ")
+    excluded = raw.str.contains(rules["exclusions"])
+
+    return pl.when(excluded | name.is_in(["", " "])).then(None).otherwise(name)
+
+
+def clean_names_batch(names: pl.Series, rules: dict | None = None) -> pl.Series:
+    """
+    Cleans a Series of raw name strings with clean_names_expr.
+
+    Returns a pl.Series
+    """
+    return names.to_frame("raw").select(clean_names_expr(pl.col("raw"), rules).alias(names.name)).to_series()
+
+
+def sql_string(value: str) -> str:
+    """
+    Quotes a str as a SQL string literal.
+
+    Returns a str
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def character_class(chars: pl.Series) -> str:
+    """
+    Writes a set of characters as the body of a regex character class of
+    code point ranges.
+
+    Returns a str
+    """
+    code_points = sorted(ord(c) for c in chars)
+    ranges: list[list[int]] = []
+    for code_point in code_points:
+        if ranges and ranges[-1][1] == code_point - 1:
+            ranges[-1][1] = code_point
+        else:
+            ranges.append([code_point, code_point])
+
+    return "".join(f"\\x{{{start:X}}}-\\x{{{end:X}}}" for start, end in ranges)
+
+
+def re2_pattern(pattern: str, classes: dict[str, str]) -> str:
+    """
+    Rewrites a Polars regex for DuckDB's RE2 engine, where \\d and \\w only match
+    ASCII and \\b is not Unicode-aware. \\d and \\w are replaced with the
+    characters they match in Polars. \\b is replaced with a non-word character
+    or the start or end of the string, which only gives the same result when
+    testing whether a string matches, as in regexp_matches.
+
+    Returns a str
+    """
+    word = classes["w"]
+    parts = re.split(r"(\\[bdw])", pattern)
+    for i, part in enumerate(parts):
+        if part in (r"\d", r"\w"):
+            parts[i] = f"[{classes[part[1]]}]"
+        elif part == r"\b":
+            # a boundary after a word or group is the end of a word
+            preceding = "".join(parts[:i]).rstrip("(")
+            if preceding and (preceding[-1] == ")" or preceding[-1].isalnum()):
+                parts[i] = f"(?:$|[^{word}])"
+            else:
+                parts[i] = f"(?:^|[^{word}])"
+
+    return "".join(parts)
+
+
+@cache
+def get_unicode_rules() -> dict:
+    """
+    Works out the differences between Polars and DuckDB text handling for
+    every character: DuckDB's upper() keeps characters whose uppercase is
+    several characters (e.g. ß), and its RE2 regex engine has ASCII-only \\d,
+    \\w and \\b.
+
+    Returns a dict of the characters matched by \\d and \\w in Polars, as
+    character class bodies, and of the uppercase of each character whose
+    uppercase is several characters including letters or digits
+    """
+    chars = pl.Series("c", [chr(i) for i in range(1, 0x110000) if not 0xD800 <= i < 0xE000])
+    upper = chars.str.to_uppercase()
+    expanded = (upper.str.len_chars() > 1) & upper.str.contains("[a-zA-Z0-9]")
+
+    return {
+        "d": character_class(chars.filter(chars.str.contains(r"^\d$"))),
+        "w": character_class(chars.filter(chars.str.contains(r"^\w$"))),
+        "upper": dict(zip(chars.filter(expanded), upper.filter(expanded))),
+    }
+
+
+def get_cleaning_macros(rules: dict | None = None) -> dict[str, str]:
+    """
+    The rule-based cleaning functions as DuckDB SQL macros of one argument, raw,
+    which return the same values as clean_names_expr, predict_org_expr,
+    normalize_address_expr, address_norm_expr and clean_zipcode_expr with the
+    same cleaning rules.
+
+    Args:
+        rules (dict): Cleaning rules from compile_rules, the built-in rules by default.
+
+    Returns:
+        dict: Macro names and SQL expressions.
+    """
+    rules = rules or default_rules
+    classes = get_unicode_rules()
+
+    to_upper = "raw"
+    for char, char_upper in classes["upper"].items():
+        to_upper = f"replace({to_upper}, {sql_string(char)}, {sql_string(char_upper)})"
+
+    # substitutions are replaced in one pass, as with str.replace_many: the name
+    # is split into substituted strings, longest first, runs of characters that
+    # can't start one and single characters, and each piece is looked up
+    name = f"upper({to_upper})"
+    substitutions = rules["substitutions"]
+    if substitutions:
+        starts = character_class(pl.Series(sorted({old[0] for old in substitutions})))
+        pieces = "|".join([*map(re.escape, substitutions), f"[^{starts}]+", "(?s:.)"])
+        substitution_map = ", ".join(f"{sql_string(old)}: {sql_string(new)}" for old, new in substitutions.items())
+        name = f"""array_to_string(list_transform(
+            regexp_extract_all({name}, {sql_string(pieces)}),
+            p -> coalesce(MAP {{{substitution_map}}}[p], p)), '')"""
+    not_name = sql_string(f"[^a-zA-Z0-9{whitespace_class}]")
+    spaces = sql_string(f"[{whitespace_class}]{{2,}}")
+    name = f"regexp_replace(regexp_replace({name}, {not_name}, '', 'g'), {spaces}, ' ', 'g')"
+
+    if rules["name_tokens"]:
+        drop_tokens = [token for token, replacement in rules["name_tokens"].items() if replacement is None]
+        synonyms = {
+            token: replacement for token, replacement in rules["name_tokens"].items() if replacement is not None
+        }
+        tokens = f"string_split({name}, ' ')"
+        if drop_tokens:
+            tokens = f"list_filter({tokens}, t -> NOT list_contains([{', '.join(map(sql_string, drop_tokens))}], t))"
+        if synonyms:
+            synonym_map = ", ".join(f"{sql_string(token)}: {sql_string(new)}" for token, new in synonyms.items())
+            tokens = f"list_transform({tokens}, t -> coalesce(MAP {{{synonym_map}}}[t], t))"
+        name = f"array_to_string({tokens}, ' ')"
+
+    excluded = sql_string(re2_pattern(rules["exclusions"], classes))
+    strip = sql_string(f"^[{whitespace_class}]+|[{whitespace_class}]+$")
+    stripped = f"regexp_replace(regexp_replace(raw, '[,.]', '', 'g'), {strip}, '', 'g')"
+
+    return {
+        "clean_name": f"""
+            CASE WHEN NOT regexp_matches(raw, {excluded})
+            THEN nullif(nullif({name}, ''), ' ')
+            END""",
+        "predict_org": f"regexp_matches(raw, {sql_string(re2_pattern(rules['organization'], classes))})",
+        "normalize_address": f"""
+            regexp_replace(replace({stripped}, '#', ' UNIT '), {sql_string(f"[{whitespace_class}]+")}, ' ', 'g')""",
+        "address_norm": "nullif(upper(regexp_replace(raw, '[^a-zA-Z0-9]+', '', 'g')), '')",
+        "clean_zipcode": "left(CAST(raw AS VARCHAR), 5)",
+    }
+
+
+def register_cleaning_macros(db_conn: DuckDBPyConnection, rules: dict | None = None) -> None:
+    """
+    Registers the macros from get_cleaning_macros as temporary macros on
+    db_conn, so the cleaning rules can run inside DuckDB queries, for example
+    SELECT clean_name(name) FROM read_csv('file.csv').
+
+    Returns None
+    """
+    for macro, sql in get_cleaning_macros(rules).items():
+        db_conn.execute(f"CREATE OR REPLACE TEMP MACRO {macro}(raw) AS {sql}")
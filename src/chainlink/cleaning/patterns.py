@@ -27,6 +27,11 @@ word_patterns = re.compile(
     flags=re.IGNORECASE,
 )
 
+individual_names_patterns = re.compile(
+    r"CURRENT OWNER|TAX PAYER OF|OWNER OF RECORD|PROPERTY OWNER",
+    flags=re.IGNORECASE,
+)
+
 excluded_patterns = re.compile(
     r"INVOLUNTARY|VACANT|VACATED|SOLE OFFICER|(\b)None(\b)|REVOKED|"
     r"DISSOLUTION|UNACCEPTABLE|MERGED|WITHDRAWN|BANKRUPTCY|CONVERSION|"
@@ -41,3 +46,55 @@ valid_states = re.compile(
     r"WI|WY|DC|PR|GU|AS|VI|MP",
     flags=re.IGNORECASE,
 )
+
+# words we will replace in ngram
+# replace with blanks
+blank_words = {
+    "LL",
+    "LLC",
+    "LP",
+    "CORP",
+    "CO",
+    "INC",
+    "LTD",
+    "CORPORATION",
+    "INCORPORATED",
+    "PROFESSIONALS",
+    "ASSOCIATION",
+    "COMPANY",
+}
+
+# replace with shortened versions
+ngram_adj = {
+    frozenset({
+        "DEVELOPMENT",
+        "DEVELOPMENTS",
+        "DVLPMNT",
+        "DEVLPMNT",
+        "DEVELOPMEN",
+        "DEVELOPMNT",
+    }): "DEV",
+    frozenset({"ESTATE", "ESTATES", "ESATE", "ESTAT"}): "EST",
+    frozenset({"HOUSING", "HOUSNG", "HOUSIN", "HOUISING", "HOUISNG"}): "HSNG",
+    frozenset({
+        "MANAGEMENT",
+        "MANAGEMEN",
+        "MANAGMENT",
+        "MANGAMENT",
+        "MANGAEMENT",
+        "MANAG",
+        "MGMNT",
+        "MNGMT",
+    }): "MGMT",
+    frozenset({
+        "PROPERTY",
+        "PROPERTIES",
+        "PROPRETY",
+        "PROPRETIES",
+        "PROPERT",
+        "PROPERTI",
+        "PROPERTIE",
+        "PROPS",
+    }): "PROP",
+    frozenset({"REALTY", "REALTIES", "RELATY", "RELATIES", "REALT", "REALTEIS", "RE", "REL"}): "RLTY",
+}
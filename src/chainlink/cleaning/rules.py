@@ -0,0 +1,158 @@
+import hashlib
+import json
+
+import polars as pl
+
+from chainlink.cleaning.patterns import (
+    abb_patterns,
+    blank_words,
+    end_of_line_patterns,
+    excluded_patterns,
+    ngram_adj,
+    word_patterns,
+)
+
+# the built-in cleaning rules. Rules supplied in the config's cleaning_rules
+# option are added to these:
+#   * name.exclusions: regex patterns (case insensitive); matching names are nulled
+#   * name.substitutions: literal replacements in names, before punctuation is removed
+#   * name.drop_tokens: words removed from cleaned names
+#   * name.synonyms: words in cleaned names replaced with a canonical word
+#   * organization.patterns: regex patterns (case insensitive) flagging organizations
+#   * similarity.drop_tokens: words ignored when comparing names for fuzzy matching
+#   * similarity.synonyms: words shortened to a canonical word for fuzzy matching
+DEFAULT_RULES: dict[str, dict] = {
+    "name": {
+        "exclusions": [excluded_patterns.pattern],
+        "substitutions": {"&": "AND", "-": " ", "@": "AT", "—": " "},
+        "drop_tokens": [],
+        "synonyms": {},
+    },
+    "organization": {
+        "patterns": ["0-1", abb_patterns.pattern, word_patterns.pattern, end_of_line_patterns.pattern],
+    },
+    "similarity": {
+        "drop_tokens": sorted(blank_words),
+        "synonyms": {replacement: sorted(words) for words, replacement in ngram_adj.items()},
+    },
+}
+
+# JSON schema of the cleaning_rules option
+RULES_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "name": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {
+                "exclusions": {"type": "array", "items": {"type": "string"}},
+                "substitutions": {"type": "object", "additionalProperties": {"type": "string"}},
+                "drop_tokens": {"type": "array", "items": {"type": "string"}},
+                "synonyms": {"type": "object", "additionalProperties": {"type": "array", "items": {"type": "string"}}},
+            },
+        },
+        "organization": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {"patterns": {"type": "array", "items": {"type": "string"}}},
+        },
+        "similarity": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {
+                "drop_tokens": {"type": "array", "items": {"type": "string"}},
+                "synonyms": {"type": "object", "additionalProperties": {"type": "array", "items": {"type": "string"}}},
+            },
+        },
+    },
+}
+
+
+def combine_patterns(patterns: list[str]) -> str:
+    """
+    Combines regex patterns into one case insensitive pattern matching any of
+    them, so they are tested in a single pass. The look-arounds in the built-in
+    patterns, which the Rust regex engine used by Polars does not support, are
+    replaced with \\b: each of their alternatives starts and ends with a word
+    character (INC\\. etc. are covered by INC), so both are equivalent to \\b.
+
+    Returns a str
+    """
+    patterns = [
+        pattern.replace(r"(?<!\w)", r"\b").replace(r"(?=\b|\s|$|[.,;:])", r"\b") for pattern in dict.fromkeys(patterns)
+    ]
+
+    return "(?i)" + "|".join(f"(?:{pattern})" for pattern in patterns)
+
+
+def token_map(drop_tokens: list[str], synonyms: dict[str, list[str]], dropped: str | None) -> dict[str, str | None]:
+    """
+    Combines token drops and synonyms into one map of uppercase words to their
+    replacement, with dropped words mapped to dropped. Drops take precedence.
+
+    Returns a dict
+    """
+    tokens: dict[str, str | None] = {
+        word.upper(): canonical.upper() for canonical, words in synonyms.items() for word in words
+    }
+    tokens.update(dict.fromkeys((word.upper() for word in drop_tokens), dropped))
+
+    return tokens
+
+
+def compile_rules(rules: dict | None = None) -> dict:
+    """
+    Merges rules from the config onto DEFAULT_RULES and compiles them into the
+    patterns and maps applied by the cleaning expressions:
+        * exclusions: one pattern of all name exclusions
+        * substitutions: map of name substitutions, longest first
+        * name_tokens: map of name words to their replacement, or None to drop them
+        * organization: one pattern of all organization patterns
+        * similarity_tokens: map of words to their replacement for fuzzy matching
+        * fingerprint: hash of the config rules, empty for the built-in rules
+
+    Substitutions are replaced in a single pass from left to right: where
+    substituted strings overlap, the longest is replaced, and replacements are
+    not substituted again. Patterns must be valid in Polars.
+
+    Returns a dict
+    """
+    rules = rules or {}
+    merged: dict[str, dict] = {}
+    for section, defaults in DEFAULT_RULES.items():
+        merged[section] = {}
+        for rule, default in defaults.items():
+            value = rules.get(section, {}).get(rule)
+            if value is None:
+                merged[section][rule] = default
+            elif isinstance(default, dict):
+                merged[section][rule] = {**default, **value}
+            else:
+                merged[section][rule] = default + value
+
+    if "" in merged["name"]["substitutions"]:
+        raise ValueError("Name substitutions can't replace an empty string")
+    # longest first, so overlapping substitutions replace the longest match
+    substitutions = dict(sorted(merged["name"]["substitutions"].items(), key=lambda item: -len(item[0])))
+
+    compiled: dict = {
+        "exclusions": combine_patterns(merged["name"]["exclusions"]),
+        "substitutions": substitutions,
+        "name_tokens": token_map(merged["name"]["drop_tokens"], merged["name"]["synonyms"], None),
+        "organization": combine_patterns(merged["organization"]["patterns"]),
+        "similarity_tokens": token_map(merged["similarity"]["drop_tokens"], merged["similarity"]["synonyms"], ""),
+        "fingerprint": hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:16] if rules else "",
+    }
+
+    for rule in ["exclusions", "organization"]:
+        try:
+            pl.select(pl.lit("").str.contains(compiled[rule]))
+        except pl.exceptions.ComputeError as e:
+            raise ValueError(f"Invalid {rule} pattern in cleaning rules: {e}") from None
+
+    return compiled
+
+
+# the built-in rules, used when no rules are given
+default_rules = compile_rules()
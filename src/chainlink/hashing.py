@@ -0,0 +1,114 @@
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+# primes of 64-bit xxHash
+XXH_PRIMES = [11400714785074694791, 14029467366897019727, 1609587929392839161, 9650029242287828579, 2870177450012600261]
+
+
+def xxhash64_strings(words: np.ndarray, data: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Hashes strings with 64-bit xxHash (XXH64, seed 0), given the byte data of
+    the strings, the view of data as the little endian 8 byte word starting at
+    each byte, and the start and length of each string.
+
+    Returns a np.ndarray of np.uint64
+    """
+    p1, p2, p3, p4, p5 = (np.uint64(prime) for prime in XXH_PRIMES)
+
+    def rotl(x: np.ndarray, r: int) -> np.ndarray:
+        return (x << np.uint64(r)) | (x >> np.uint64(64 - r))
+
+    def xxh_round(acc: np.ndarray, lane: np.ndarray) -> np.ndarray:
+        return rotl(acc + lane * p2, 31) * p1
+
+    n_stripes = lengths // 32
+    hashes = np.full(len(lengths), p5, dtype=np.uint64)
+
+    # strings of 32 bytes or more are consumed in stripes of four 8 byte lanes,
+    # longest first so the strings with a stripe left are a prefix of the order
+    order = np.argsort(-n_stripes, kind="stable")[: np.count_nonzero(n_stripes)]
+    if len(order):
+        acc = [
+            np.full(len(order), (XXH_PRIMES[0] + XXH_PRIMES[1]) % 2**64, dtype=np.uint64),
+            np.full(len(order), p2, dtype=np.uint64),
+            np.zeros(len(order), dtype=np.uint64),
+            np.full(len(order), -XXH_PRIMES[0] % 2**64, dtype=np.uint64),
+        ]
+        stripes_left = n_stripes[order]
+        for stripe in range(int(stripes_left[0])):
+            n = np.count_nonzero(stripes_left > stripe)
+            stripe_starts = starts[order[:n]] + 32 * stripe
+            for lane in range(4):
+                acc[lane][:n] = xxh_round(acc[lane][:n], words[stripe_starts + 8 * lane])
+
+        merged = rotl(acc[0], 1) + rotl(acc[1], 7) + rotl(acc[2], 12) + rotl(acc[3], 18)
+        for lane in range(4):
+            merged = (merged ^ xxh_round(np.zeros(len(order), dtype=np.uint64), acc[lane])) * p1 + p4
+        hashes[order] = merged
+
+    hashes += lengths.astype(np.uint64)
+
+    # the remaining bytes, 8, then 4, then 1 at a time
+    positions = starts + 32 * n_stripes
+    remaining = lengths - 32 * n_stripes
+    for _ in range(3):
+        todo = remaining >= 8
+        tail = xxh_round(np.zeros(len(hashes), dtype=np.uint64), words[np.where(todo, positions, 0)])
+        hashes = np.where(todo, rotl(hashes ^ tail, 27) * p1 + p4, hashes)
+        positions += 8 * todo
+        remaining -= 8 * todo
+
+    todo = remaining >= 4
+    tail = words[np.where(todo, positions, 0)] & np.uint64(0xFFFFFFFF)
+    hashes = np.where(todo, rotl(hashes ^ (tail * p1), 23) * p2 + p3, hashes)
+    positions += 4 * todo
+    remaining -= 4 * todo
+
+    for _ in range(3):
+        todo = remaining >= 1
+        tail = data[np.where(todo, positions, 0)].astype(np.uint64)
+        hashes = np.where(todo, rotl(hashes ^ (tail * p5), 11) * p1, hashes)
+        positions += todo
+        remaining -= todo
+
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= p2
+    hashes ^= hashes >> np.uint64(29)
+    hashes *= p3
+    hashes ^= hashes >> np.uint64(32)
+
+    return hashes
+
+
+def xxhash64(values: pl.Series) -> pl.Series:
+    """
+    Hashes the UTF-8 bytes of each string of values with 64-bit xxHash (XXH64,
+    seed 0), vectorized over the Arrow buffers of the Series. Unlike
+    pl.Expr.hash, the hashes are the same across Polars versions, sessions and
+    machines. Nulls are null.
+
+    Returns a pl.Series of pl.UInt64
+    """
+    array = values.cast(pl.String).to_arrow()
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    array = array.cast(pa.large_string())
+
+    _, offsets, data = array.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[array.offset : array.offset + len(array) + 1]
+    # padded so every 8 byte read is in bounds
+    data = np.concatenate([
+        np.frombuffer(data, dtype=np.uint8) if data else np.empty(0, dtype=np.uint8),
+        np.zeros(8, dtype=np.uint8),
+    ])
+    words = np.ndarray(shape=(len(data) - 7,), dtype="<u8", buffer=data, strides=(1,))
+
+    # hashed in chunks, which keeps the intermediate arrays in the CPU caches
+    chunk_size = 1 << 14
+    hashes = np.empty(len(array), dtype=np.uint64)
+    for start in range(0, len(array), chunk_size):
+        starts = offsets[start : start + chunk_size + 1]
+        hashes[start : start + chunk_size] = xxhash64_strings(words, data, starts[:-1], np.diff(starts))
+
+    return pl.Series(values.name, hashes, dtype=pl.UInt64).scatter(values.is_null().arg_true(), None)
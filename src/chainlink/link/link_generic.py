@@ -2,15 +2,21 @@ import itertools
 from pathlib import Path
 
 from chainlink.link.link_utils import (
+    count_delta_ids,
+    drop_delta_ids,
     execute_address_fuzzy_link,
     execute_fuzzy_link,
     execute_match,
     execute_match_address,
     generate_combos_within_across_tables,
+    merge_delta_links,
+    split_delta_links,
 )
 
 
-def create_within_links(db_path: str | Path, schema_config: dict, link_exclusions: list) -> None:
+def create_within_links(
+    db_path: str | Path, schema_config: dict, link_exclusions: list, delta_entity: str | None = None
+) -> None:
     """
     Creates exact string matches on name and address fields for entity and
     entity.
@@ -24,6 +30,9 @@ def create_within_links(db_path: str | Path, schema_config: dict, link_exclusion
             -match street name and number if zipcode matches
         -find all name and address links across tables within the entity
 
+    If delta_entity is given, only the links of its records in
+    {delta_entity}.delta_ids are created.
+
     Returns: None
     """
 
@@ -47,14 +56,15 @@ def create_within_links(db_path: str | Path, schema_config: dict, link_exclusion
                     left_entity=entity,
                     left_table=table,
                     left_matching_col=left_name,
-                    left_matching_id=f"{left_name}_name_id",
+                    left_matching_id=f"{left_name}_name_key",
                     left_ent_id=table_config["id_col"],
                     right_entity=entity,
                     right_table=table,
                     right_matching_col=right_name,
                     right_ent_id=table_config["id_col"],
-                    right_matching_id=f"{right_name}_name_id",
+                    right_matching_id=f"{right_name}_name_key",
                     link_exclusions=link_exclusions,
+                    delta_entity=delta_entity,
                 )
 
         if table_config.get("address_cols"):
@@ -74,6 +84,7 @@ def create_within_links(db_path: str | Path, schema_config: dict, link_exclusion
                     right_ent_id=table_config["id_col"],
                     skip_address=True,
                     link_exclusions=link_exclusions,
+                    delta_entity=delta_entity,
                 )
 
         # for across tables
@@ -104,13 +115,14 @@ def create_within_links(db_path: str | Path, schema_config: dict, link_exclusion
             left_table=left_table,
             left_matching_col=left_name,
             left_ent_id=left_ent_id,
-            left_matching_id=f"{left_name}_name_id",
+            left_matching_id=f"{left_name}_name_key",
             right_entity=entity,
             right_table=right_table,
             right_matching_col=right_name,
             right_ent_id=right_ent_id,
-            right_matching_id=f"{right_name}_name_id",
+            right_matching_id=f"{right_name}_name_key",
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
     # across files for address
@@ -130,10 +142,17 @@ def create_within_links(db_path: str | Path, schema_config: dict, link_exclusion
             right_ent_id=right_ent_id,
             skip_address=True,
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
 
-def create_across_links(db_path: str | Path, new_schema: dict, existing_schema: dict, link_exclusions: list) -> None:
+def create_across_links(
+    db_path: str | Path,
+    new_schema: dict,
+    existing_schema: dict,
+    link_exclusions: list,
+    delta_entity: str | None = None,
+) -> None:
     """
     For each entity in the existing_db list, create links between the new entity
     and the existing entity.
@@ -146,6 +165,9 @@ def create_across_links(db_path: str | Path, new_schema: dict, existing_schema:
             -if street id matches, match by unit
             -match street name and number if zipcode matches
 
+    If delta_entity is given, only the links of its records in
+    {delta_entity}.delta_ids are created.
+
     Returns: None
     """
 
@@ -197,13 +219,14 @@ def create_across_links(db_path: str | Path, new_schema: dict, existing_schema:
             left_matching_col=left_name,
             left_ent_id=left_ent_id,
             match_type="name_match",
-            left_matching_id=f"{left_name}_name_id",
+            left_matching_id=f"{left_name}_name_key",
             right_entity=existing_entity,
             right_table=right_table,
             right_matching_col=right_name,
             right_ent_id=right_ent_id,
-            right_matching_id=f"{right_name}_name_id",
+            right_matching_id=f"{right_name}_name_key",
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
     # generate address match combos
@@ -225,13 +248,19 @@ def create_across_links(db_path: str | Path, new_schema: dict, existing_schema:
             right_ent_id=right_ent_id,
             skip_address=True,
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
 
-def create_tfidf_within_links(db_path: str | Path, schema_config: dict, link_exclusions: list) -> None:
+def create_tfidf_within_links(
+    db_path: str | Path, schema_config: dict, link_exclusions: list, delta_entity: str | None = None
+) -> None:
     """
     create tfidf links within entity
 
+    If delta_entity is given, only the links of its records in
+    {delta_entity}.delta_ids are created.
+
     Returns: None
     """
 
@@ -258,6 +287,7 @@ def create_tfidf_within_links(db_path: str | Path, schema_config: dict, link_exc
                 right_name_col=right_name,
                 tfidf_table="entity.name_similarity",
                 link_exclusions=link_exclusions,
+                delta_entity=delta_entity,
             )
 
         address_combos = list(itertools.product(table["address_cols"], repeat=2))
@@ -275,6 +305,7 @@ def create_tfidf_within_links(db_path: str | Path, schema_config: dict, link_exc
                 tfidf_table="entity.street_name_similarity",
                 skip_address=True,
                 link_exclusions=link_exclusions,
+                delta_entity=delta_entity,
             )
 
         # for across tables within entity
@@ -306,6 +337,7 @@ def create_tfidf_within_links(db_path: str | Path, schema_config: dict, link_exc
             right_name_col=right_name,
             tfidf_table="entity.name_similarity",
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
     for left, right in across_address_combos:
@@ -324,15 +356,23 @@ def create_tfidf_within_links(db_path: str | Path, schema_config: dict, link_exc
             tfidf_table="entity.street_name_similarity",
             skip_address=True,
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
 
 def create_tfidf_across_links(
-    db_path: str | Path, new_schema: dict, existing_schema: dict, link_exclusions: list
+    db_path: str | Path,
+    new_schema: dict,
+    existing_schema: dict,
+    link_exclusions: list,
+    delta_entity: str | None = None,
 ) -> None:
     """
     create all fuzzy links across new entity and existing entity
 
+    If delta_entity is given, only the links of its records in
+    {delta_entity}.delta_ids are created.
+
     Returns: None
     """
     new_entity = new_schema["schema_name"]
@@ -388,6 +428,7 @@ def create_tfidf_across_links(
             right_name_col=right_name,
             tfidf_table="entity.name_similarity",
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
     # generate address match combos
@@ -409,6 +450,68 @@ def create_tfidf_across_links(
             tfidf_table="entity.street_name_similarity",
             skip_address=True,
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
     return None
+
+
+def create_delta_links(
+    db_path: str | Path,
+    delta_schema: dict,
+    existing_schemas: list,
+    link_exclusions: list,
+    probabilistic: bool = False,
+) -> None:
+    """
+    Recreates the links of the records of a delta loaded schema that were
+    inserted, updated or deleted ({schema}.delta_ids):
+        -links not involving those records are set aside
+        -the within links and the across links with each existing schema are
+         created again for those records only
+        -the links set aside are added back
+
+    Only link tables that exist are recreated, in the direction they were
+    created in. Fuzzy links use the current similarity tables, so the scores of
+    links set aside are not updated.
+
+    Returns: None
+    """
+
+    delta_entity = delta_schema["schema_name"]
+
+    if count_delta_ids(db_path, delta_entity) == 0:
+        drop_delta_ids(db_path, delta_entity)
+        return None
+
+    link_tables = []
+    if split_delta_links(db_path, delta_entity, delta_entity, delta_entity):
+        link_tables.append(f"link.{delta_entity}_{delta_entity}")
+
+        create_within_links(db_path, delta_schema, link_exclusions, delta_entity)
+        if probabilistic:
+            create_tfidf_within_links(db_path, delta_schema, link_exclusions, delta_entity)
+
+    for existing_schema in existing_schemas:
+        existing_entity = existing_schema["schema_name"]
+
+        # links are stored under the schema that was loaded first
+        if split_delta_links(db_path, existing_entity, delta_entity, delta_entity):
+            link_tables.append(f"link.{existing_entity}_{delta_entity}")
+            left_schema, right_schema = existing_schema, delta_schema
+        elif split_delta_links(db_path, delta_entity, existing_entity, delta_entity):
+            link_tables.append(f"link.{delta_entity}_{existing_entity}")
+            left_schema, right_schema = delta_schema, existing_schema
+        else:
+            continue
+
+        create_across_links(db_path, left_schema, right_schema, link_exclusions, delta_entity)
+        if probabilistic:
+            create_tfidf_across_links(db_path, left_schema, right_schema, link_exclusions, delta_entity)
+
+    for link_table in link_tables:
+        merge_delta_links(db_path, link_table)
+
+    drop_delta_ids(db_path, delta_entity)
+
+    return None
@@ -6,7 +6,7 @@ import duckdb
 from duckdb import DuckDBPyConnection
 
 from chainlink.link.tfidf_utils import database_query, superfast_tfidf
-from chainlink.utils import console, logger
+from chainlink.utils import check_table_exists, console, create_index, logger
 
 
 def execute_match(
@@ -24,6 +24,7 @@ def execute_match(
     right_ent_id: str,
     skip_address: bool = False,
     link_exclusions: Optional[list] = None,
+    delta_entity: str | None = None,
 ) -> None:
     """
     Exact matches between two column in two tables.
@@ -31,6 +32,9 @@ def execute_match(
     {left_entity}_{left_table}_{left_matching_col}_{right_entity}_{right_table}_{right_matching_col}_{match_type}
     and appends to link table link.{left_entity}_{right_entity}
 
+    If delta_entity is given, only matches of its records in
+    {delta_entity}.delta_ids are created (see delta_condition).
+
     Returns: None
     """
     if link_exclusions is None:
@@ -79,6 +83,44 @@ def execute_match(
 
     temp_table = match_name_col + "_table"
 
+    left_id = f"l.{left_entity}_{left_ent_id_edit}"
+    right_id = f"r.{right_entity}_{right_ent_id_edit}"
+    if matching_condition == "!=":
+        with duckdb.connect(database=db_path, read_only=False) as db_conn:
+            left_type = column_type(db_conn, left_entity, left_table, left_ent_id)
+            right_type = column_type(db_conn, right_entity, right_table, right_ent_id)
+        # integer and string ids can't be compared directly, so compare them as strings
+        if left_type != right_type:
+            left_id = f"CAST({left_id} AS VARCHAR)"
+            right_id = f"CAST({right_id} AS VARCHAR)"
+
+    left_delta_condition = "TRUE"
+    right_delta_condition = "TRUE"
+    pair_delta_condition = "TRUE"
+    if delta_entity is not None:
+        # only rows sharing a key with a changed record can match one
+        delta_sides = [
+            (entity, table, ent_id, matching_id)
+            for entity, table, ent_id, matching_id in [
+                (left_entity, left_table, left_ent_id, left_matching_id),
+                (right_entity, right_table, right_ent_id, right_matching_id),
+            ]
+            if entity == delta_entity
+        ]
+        delta_keys = " UNION ".join(
+            f"SELECT {matching_id} FROM {entity}.{table} WHERE {delta_condition(ent_id, entity)}"
+            for entity, table, ent_id, matching_id in dict.fromkeys(delta_sides)
+        )
+        left_delta_condition = f"{left_matching_id} IN ({delta_keys})"
+        right_delta_condition = f"{right_matching_id} IN ({delta_keys})"
+        pair_delta_condition = delta_pair_condition(
+            delta_entity,
+            left_entity,
+            f"l.{left_entity}_{left_ent_id_edit}",
+            right_entity,
+            f"r.{right_entity}_{right_ent_id_edit}",
+        )
+
     matching_query = f"""
             CREATE SCHEMA IF NOT EXISTS link;
 
@@ -90,19 +132,22 @@ def execute_match(
                 (SELECT {left_ent_id} AS {left_entity}_{left_ent_id_edit},
                         {left_matching_id} {left_extra_col}
                 FROM {left_entity}.{left_table}
+                WHERE {left_delta_condition}
                 ) as l
             JOIN
                 (SELECT {right_ent_id} AS {right_entity}_{right_ent_id_edit},
                         {right_matching_id} {right_extra_col}
                 FROM {right_entity}.{right_table}
+                WHERE {right_delta_condition}
                 ) as r
                 ON l.{left_matching_id} = r.{right_matching_id}
                 AND l.{left_matching_id} IS NOT NULL
                 AND r.{right_matching_id} IS NOT NULL
-                AND l.{left_entity}_{left_ent_id_edit} {matching_condition} r.{right_entity}_{right_ent_id_edit}
+                AND {left_id} {matching_condition} {right_id}
             WHERE
                 {left_address_condition}
                 AND {right_address_condition}
+                AND {pair_delta_condition}
         ;"""
 
     with duckdb.connect(database=db_path, read_only=False) as db_conn:
@@ -123,6 +168,40 @@ def execute_match(
     return None
 
 
+def column_type(db_conn: DuckDBPyConnection, schema: str, table: str, col: str) -> str:
+    """
+    Returns the DuckDB type of column col of table schema.table, such as BIGINT or VARCHAR
+    """
+    return db_conn.execute(
+        """SELECT data_type
+           FROM information_schema.columns
+           WHERE table_schema = ? AND table_name = ? AND column_name = ?""",
+        [schema, table, col],
+    ).fetchone()[0]
+
+
+def delta_condition(id_col: str, entity: str) -> str:
+    """
+    Returns a SQL condition that id_col is the id of a record of entity
+    inserted, updated or deleted by a delta load, in {entity}.delta_ids
+    """
+    return f"{id_col} IN (SELECT id FROM {entity}.delta_ids WHERE id IS NOT NULL)"
+
+
+def delta_pair_condition(delta_entity: str, left_entity: str, left_id: str, right_entity: str, right_id: str) -> str:
+    """
+    Returns a SQL condition that a link between left_id and right_id involves
+    a record of delta_entity in {delta_entity}.delta_ids
+    """
+    conditions = [
+        delta_condition(id_col, delta_entity)
+        for entity, id_col in [(left_entity, left_id), (right_entity, right_id)]
+        if entity == delta_entity
+    ]
+
+    return f"({' OR '.join(conditions)})"
+
+
 def execute_match_address(
     db_path: str | Path,
     left_entity: str,
@@ -135,6 +214,7 @@ def execute_match_address(
     right_ent_id: str,
     skip_address: bool = False,
     link_exclusions: Optional[list] = None,
+    delta_entity: str | None = None,
 ) -> None:
     """
     given a two address columns, match the addresses:
@@ -163,15 +243,16 @@ def execute_match_address(
             left_entity=left_entity,
             left_table=left_table,
             left_matching_col=left_address,
-            left_matching_id=f"{left_address}_{match}_id",
+            left_matching_id=f"{left_address}_{match}_key",
             left_ent_id=left_ent_id,
             right_entity=right_entity,
             right_table=right_table,
             right_matching_col=right_address,
-            right_matching_id=f"{right_address}_{match}_id",
+            right_matching_id=f"{right_address}_{match}_key",
             right_ent_id=right_ent_id,
             skip_address=skip_address,
             link_exclusions=link_exclusions,
+            delta_entity=delta_entity,
         )
 
     ## If street id matches, match by unit
@@ -401,9 +482,11 @@ def generate_tfidf_links(
     table_location: str = "entity.name_similarity",
     source_table_name: str | None = None,
     match_score_threshold: float | None = None,
+    rules: dict | None = None,
 ) -> None:
     """
-    create a table of tfidf matches between two entities and adds to db
+    create a table of tfidf matches between two entities and adds to db,
+    comparing entities after applying the similarity cleaning rules
 
     Returns: None
     """
@@ -419,7 +502,8 @@ def generate_tfidf_links(
     # returns a pandas df
     entity_col = entity_list.columns[0]
     id_col = entity_list.columns[1]
-    matches_df = superfast_tfidf(entity_list, id_col, entity_col, match_score_threshold)
+    key_col = entity_list.columns[2]
+    matches_df = superfast_tfidf(entity_list, id_col, entity_col, match_score_threshold, rules, key_col)
 
     console.log("[yellow] Fuzzy Matching done")
     logger.info("Fuzzy Matching done")
@@ -445,6 +529,7 @@ def execute_fuzzy_link(
     right_name_col: str,
     tfidf_table: str = "link.tfidf_staging",
     link_exclusions: Optional[list] = None,
+    delta_entity: str | None = None,
 ) -> None:
     """
 
@@ -452,6 +537,9 @@ def execute_fuzzy_link(
     Creates a match column called
     {left_entity}_{left_table}_{left_name_col}_{right_entity}_{right_table}_{right_name_col}_fuzzy_match
     and appends to link table link.{left_entity}_{right_entity}
+
+    If delta_entity is given, only matches of its records in
+    {delta_entity}.delta_ids are created.
     """
     if link_exclusions is None:
         link_exclusions = []
@@ -484,25 +572,34 @@ def execute_fuzzy_link(
         left_ent_id_rename = left_ent_id
         right_ent_id_rename = right_ent_id
 
+    if delta_entity is not None:
+        same_condition += " AND " + delta_pair_condition(
+            delta_entity,
+            left_entity,
+            f"{left_entity}_{left_ent_id_rename}",
+            right_entity,
+            f"{right_entity}_{right_ent_id_rename}",
+        )
+
     query = f"""
     CREATE OR REPLACE TABLE {link_table} AS
 
     WITH tfidf_matches AS (
-        SELECT id_a,
-               id_b,
+        SELECT key_a,
+               key_b,
                similarity as {match_name}
         FROM {tfidf_table}
     ),
 
     left_source AS (
         SELECT {left_ent_id} as {left_entity}_{left_ent_id_rename},
-                {left_name_col}_name_id
+                {left_name_col}_name_key
         FROM {left_entity}.{left_table}
     ),
 
     right_source AS (
         SELECT {right_ent_id} as {right_entity}_{right_ent_id_rename},
-               {right_name_col}_name_id
+               {right_name_col}_name_key
         FROM {right_entity}.{right_table}
     ),
 
@@ -512,9 +609,9 @@ def execute_fuzzy_link(
                m.{match_name}
         FROM   tfidf_matches as m
         INNER JOIN left_source as l
-            ON m.id_a = l.{left_name_col}_name_id
+            ON m.key_a = l.{left_name_col}_name_key
         INNER JOIN right_source as r
-            ON m.id_b = r.{right_name_col}_name_id
+            ON m.key_b = r.{right_name_col}_name_key
     ),
 
     fuzzy_match_2 AS (
@@ -523,9 +620,9 @@ def execute_fuzzy_link(
                m.{match_name}
         FROM   tfidf_matches as m
         INNER JOIN left_source as l
-            ON m.id_b = l.{left_name_col}_name_id
+            ON m.key_b = l.{left_name_col}_name_key
         INNER JOIN right_source as r
-            ON m.id_a = r.{right_name_col}_name_id
+            ON m.key_a = r.{right_name_col}_name_key
     ),
 
     all_fuzzy_matches AS (
@@ -578,9 +675,13 @@ def execute_address_fuzzy_link(
     tfidf_table: str = "link.tfidf_staging",
     skip_address: bool = False,
     link_exclusions: Optional[list] = None,
+    delta_entity: str | None = None,
 ) -> None:
     """
     fuzzy address matching
+
+    If delta_entity is given, only matches of its records in
+    {delta_entity}.delta_ids are created.
     """
     if link_exclusions is None:
         link_exclusions = []
@@ -622,6 +723,15 @@ def execute_address_fuzzy_link(
         left_directional_rename = f"{left_address_col}_street_pre_directional"
         right_directional_rename = f"{right_address_col}_street_pre_directional"
 
+    if delta_entity is not None:
+        same_condition += " AND " + delta_pair_condition(
+            delta_entity,
+            left_entity,
+            f"{left_entity}_{left_ent_id_rename}",
+            right_entity,
+            f"{right_entity}_{right_ent_id_rename}",
+        )
+
     if skip_address:
         address_condition = " != 1"
         left_address_condition = f"{left_address_col}_skip {address_condition}"
@@ -653,15 +763,15 @@ def execute_address_fuzzy_link(
         CREATE OR REPLACE TABLE {link_table} AS
 
         WITH tfidf_matches AS (
-            SELECT id_a,
-                id_b,
+            SELECT key_a,
+                key_b,
                 similarity as {match_name}
             FROM {tfidf_table}
         ),
 
         left_source AS (
             SELECT {left_ent_id} as {left_entity}_{left_ent_id_rename},
-                    {left_address_col}_street_name_id,
+                    {left_address_col}_street_name_key,
                     {left_address_col}_unit_number as {left_entity}_{left_unit_num_rename},
                     {left_address_col}_street_pre_directional as {left_entity}_{left_directional_rename},
                     {left_address_col}_address_number as {left_entity}_{left_address_num_rename},
@@ -672,7 +782,7 @@ def execute_address_fuzzy_link(
 
         right_source AS (
             SELECT {right_ent_id} as {right_entity}_{right_ent_id_rename},
-                    {right_address_col}_street_name_id,
+                    {right_address_col}_street_name_key,
                     {right_address_col}_unit_number as {right_entity}_{right_unit_num_rename},
                     {right_address_col}_street_pre_directional as {right_entity}_{right_directional_rename},
                     {right_address_col}_address_number as {right_entity}_{right_address_num_rename},
@@ -691,9 +801,9 @@ def execute_address_fuzzy_link(
                 m.{match_name}
             FROM   tfidf_matches as m
             INNER JOIN left_source as l
-                ON m.id_a = l.{left_address_col}_street_name_id
+                ON m.key_a = l.{left_address_col}_street_name_key
             INNER JOIN right_source as r
-                ON m.id_b = r.{right_address_col}_street_name_id
+                ON m.key_b = r.{right_address_col}_street_name_key
         ),
 
         fuzzy_match_2 AS (
@@ -706,9 +816,9 @@ def execute_address_fuzzy_link(
                 m.{match_name}
             FROM   tfidf_matches as m
             INNER JOIN left_source as l
-                ON m.id_b = l.{left_address_col}_street_name_id
+                ON m.key_b = l.{left_address_col}_street_name_key
             INNER JOIN right_source as r
-                ON m.id_a = r.{right_address_col}_street_name_id
+                ON m.key_a = r.{right_address_col}_street_name_key
         ),
 
         all_fuzzy_matches AS (
@@ -781,3 +891,106 @@ def generate_combos_within_across_tables(name_idx: list, address_idx: Optional[l
 
     else:
         return across_name_combos, []
+
+
+def index_link_tables(db_path: str | Path) -> None:
+    """
+    create an index on each of the two id columns of every link table, so
+    links of one record can be looked up without scanning the table.
+    link tables are replaced while linking, which drops their indexes, so this
+    runs once linking is done
+
+    Returns: None
+    """
+    with duckdb.connect(database=db_path, read_only=False) as db_conn:
+        id_cols = db_conn.execute(
+            """SELECT table_name, column_name
+               FROM duckdb_columns()
+               WHERE schema_name = 'link'
+               AND column_index <= 2"""
+        ).fetchall()
+        for table, col in id_cols:
+            create_index(db_conn, f"link.{table}", col)
+
+
+def split_delta_links(db_path: str | Path, left_entity: str, right_entity: str, delta_entity: str) -> bool:
+    """
+    Moves the links of link.{left_entity}_{right_entity} that don't involve a
+    record of delta_entity in {delta_entity}.delta_ids to the table
+    link.{left_entity}_{right_entity}_base and drops the link table, so the
+    links of those records can be created again and added back with
+    merge_delta_links.
+
+    Returns True if the link table exists
+    """
+    table = f"{left_entity}_{right_entity}"
+    with duckdb.connect(database=db_path, read_only=False) as db_conn:
+        if not check_table_exists(db_conn, "link", table):
+            return False
+
+        # the first two columns are the ids of the left and right records
+        left_id, right_id = [row[1] for row in db_conn.execute(f"PRAGMA table_info('link.{table}')").fetchall()][:2]
+        conditions = delta_pair_condition(delta_entity, left_entity, left_id, right_entity, right_id)
+
+        db_conn.execute(f"CREATE OR REPLACE TABLE link.{table}_base AS SELECT * FROM link.{table} WHERE NOT {conditions}")
+        db_conn.execute(f"DROP TABLE link.{table}")
+
+    return True
+
+
+def merge_delta_links(db_path: str | Path, link_table: str) -> None:
+    """
+    Adds the links kept in {link_table}_base by split_delta_links back to the
+    recreated links in link_table, and drops {link_table}_base.
+    runs after the links of the changed records are created
+
+    Returns: None
+    """
+    schema, table = link_table.split(".")
+    with duckdb.connect(database=db_path, read_only=False) as db_conn:
+        if not check_table_exists(db_conn, schema, f"{table}_base"):
+            return None
+
+        if not check_table_exists(db_conn, schema, table):
+            db_conn.execute(f"ALTER TABLE {link_table}_base RENAME TO {table}")
+            return None
+
+        # match columns only in one of the tables are null in the other
+        base_cols = [row[1] for row in db_conn.execute(f"PRAGMA table_info('{link_table}_base')").fetchall()]
+        new_cols = [row[1] for row in db_conn.execute(f"PRAGMA table_info('{link_table}')").fetchall()]
+        cols = ", ".join(
+            f"COALESCE({col}, 0) AS {col}" if col.endswith("_match") else col
+            for col in dict.fromkeys(base_cols + new_cols)
+        )
+        db_conn.execute(f"""
+            CREATE OR REPLACE TABLE {link_table} AS
+            SELECT {cols} FROM (
+                SELECT * FROM {link_table}_base
+                UNION ALL BY NAME
+                SELECT * FROM {link_table})""")
+        db_conn.execute(f"DROP TABLE {link_table}_base")
+
+    return None
+
+
+def drop_delta_ids(db_path: str | Path, entity: str) -> None:
+    """
+    Drops {entity}.delta_ids once the links of its records are created again.
+
+    Returns: None
+    """
+    with duckdb.connect(database=db_path, read_only=False) as db_conn:
+        db_conn.execute(f"DROP TABLE IF EXISTS {entity}.delta_ids")
+
+
+def count_delta_ids(db_path: str | Path, entity: str) -> int:
+    """
+    Counts the records of entity inserted, updated or deleted by delta loads
+    since its links were last created, in {entity}.delta_ids
+
+    Returns: int
+    """
+    with duckdb.connect(database=db_path, read_only=False) as db_conn:
+        if not check_table_exists(db_conn, entity, "delta_ids"):
+            return 0
+        return db_conn.execute(f"SELECT COUNT(*) FROM {entity}.delta_ids").fetchone()[0]
@@ -2,73 +2,78 @@ import re
 from pathlib import Path
 
 import duckdb
-import numpy as np
 import polars as pl
 import sparse_dot_topn as ct
 from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+from chainlink.cleaning.cleaning_functions import python_whitespace, whitespace_class
+from chainlink.cleaning.rules import default_rules
+
 
 def superfast_tfidf(
     entity_list: pl.DataFrame,
     id_col: str = "name_id",
     entity_col: str = "entity",
     match_score_threshold: float | None = 0.8,
+    rules: dict | None = None,
+    key_col: str = "name_key",
 ) -> pl.DataFrame:
     """
-    returns sorted list of top matched names
+    returns sorted list of top matched names, compared after applying the
+    similarity cleaning rules (the built-in rules by default)
     """
 
     # matching
 
     entity_list = entity_list.filter(~pl.col(entity_col).is_null())
-    company_names = entity_list.select(entity_col).to_series()
-    if len(company_names) < 2:
-        matches_df = pl.DataFrame(data={"entity_a": [], "entity_b": [], "similarity": [], "id_a": [], "id_b": []})
+    if len(entity_list) < 2:
+        matches_df = pl.DataFrame(
+            data={"entity_a": [], "entity_b": [], "similarity": [], "id_a": [], "id_b": [], "key_a": [], "key_b": []}
+        )
         return matches_df
-    vectorizer = TfidfVectorizer(min_df=1, analyzer=ngrams)
-    tf_idf_matrix = vectorizer.fit_transform(company_names.to_numpy())
+    # adjust all names at once, then only split them into ngrams per name
+    adjusted_names = entity_list.select(adjust_and_replace_expr(pl.col(entity_col), rules)).to_series()
+    vectorizer = TfidfVectorizer(min_df=1, analyzer=char_ngrams)
+    tf_idf_matrix = vectorizer.fit_transform(adjusted_names.to_numpy())
     matches = ct.sp_matmul_topn(
         tf_idf_matrix, tf_idf_matrix.transpose(), 50, match_score_threshold, sort=True, n_threads=-1
     )
-    matches_df = get_matches_df(sparse_matrix=matches, name_vector=company_names.to_numpy())
+    entity_list = entity_list.select(entity=entity_col, id=id_col, key=key_col)
+    matches_df = get_matches_df(sparse_matrix=matches, entity_list=entity_list)
     matches_df = clean_matches(matches_df)
 
     return matches_df
 
 
-def get_matches_df(sparse_matrix: csr_matrix, name_vector: np.ndarray, top: None = None) -> pl.DataFrame:
+def get_matches_df(sparse_matrix: csr_matrix, entity_list: pl.DataFrame, top: None = None) -> pl.DataFrame:
     """
     create a matches dataframe given matrix of ngrams
     references
         sparse_matrix - matrix from vectorized comparison calculations
-        name_vector - list of names to compare
-        id_vector - id of distinct name from entities list
+        entity_list - entity, id and key of each row of the matrix
+    the entities, ids and keys of the matches are looked up by row index, so
+    names are never hashed again
     """
     non_zeros = sparse_matrix.nonzero()
 
-    sparserows = non_zeros[0]
-    sparsecols = non_zeros[1]
-
-    nr_matches = top if top else sparsecols.size
+    nr_matches = top if top else non_zeros[1].size
 
-    entity_a = np.empty([nr_matches], dtype=object)
-    entity_b = np.empty([nr_matches], dtype=object)
-    similarity = np.zeros(nr_matches)
+    sparserows = non_zeros[0][:nr_matches]
+    sparsecols = non_zeros[1][:nr_matches]
 
-    for index in range(0, nr_matches):
-        entity_a[index] = name_vector[sparserows[index]]
-        entity_b[index] = name_vector[sparsecols[index]]
-        similarity[index] = sparse_matrix.data[index]
+    entity_a = entity_list[sparserows]
+    entity_b = entity_list[sparsecols]
 
-    data = {
-        "entity_a": entity_a,
-        "entity_b": entity_b,
-        "similarity": similarity,
-    }
-    df = pl.DataFrame(data).with_columns(
-        pl.col("entity_a").hash().alias("id_a"), pl.col("entity_b").hash().alias("id_b")
-    )
+    df = pl.DataFrame({
+        "entity_a": entity_a["entity"],
+        "entity_b": entity_b["entity"],
+        "similarity": sparse_matrix.data[:nr_matches],
+        "id_a": entity_a["id"],
+        "id_b": entity_b["id"],
+        "key_a": entity_a["key"],
+        "key_b": entity_b["key"],
+    })
     return df
 
 
@@ -83,76 +88,24 @@ def clean_matches(matches_df: pl.DataFrame) -> pl.DataFrame:
     # matches_df = matches_df.copy()
     # remove self matches, duplicates and sort
     matches_df = (
-        matches_df.filter(pl.col("id_a") != pl.col("id_b"))
-        .with_columns(pl.concat_list(pl.col("id_a", "id_b")).list.sort().alias("sorted_id_pairs"))
-        .unique("sorted_id_pairs")
-        .drop("sorted_id_pairs")
+        matches_df.filter(pl.col("key_a") != pl.col("key_b"))
+        .with_columns(
+            pl.min_horizontal("key_a", "key_b").alias("first_key"),
+            pl.max_horizontal("key_a", "key_b").alias("second_key"),
+        )
+        .unique(["first_key", "second_key"])
+        .drop("first_key", "second_key")
         .sort("similarity", descending=True)
     )
 
     return matches_df
 
 
-# words we will replace in ngram
-# replace with blanks
-blank_words = {
-    "LL",
-    "LLC",
-    "LP",
-    "CORP",
-    "CO",
-    "INC",
-    "LTD",
-    "CORPORATION",
-    "INCORPORATED",
-    "PROFESSIONALS",
-    "ASSOCIATION",
-    "COMPANY",
-}
-
-# replace with shortened versions
-ngram_adj = {
-    frozenset({
-        "DEVELOPMENT",
-        "DEVELOPMENTS",
-        "DVLPMNT",
-        "DEVLPMNT",
-        "DEVELOPMEN",
-        "DEVELOPMNT",
-    }): "DEV",
-    frozenset({"ESTATE", "ESTATES", "ESATE", "ESTAT"}): "EST",
-    frozenset({"HOUSING", "HOUSNG", "HOUSIN", "HOUISING", "HOUISNG"}): "HSNG",
-    frozenset({
-        "MANAGEMENT",
-        "MANAGEMEN",
-        "MANAGMENT",
-        "MANGAMENT",
-        "MANGAEMENT",
-        "MANAG",
-        "MGMNT",
-        "MNGMT",
-    }): "MGMT",
-    frozenset({
-        "PROPERTY",
-        "PROPERTIES",
-        "PROPRETY",
-        "PROPRETIES",
-        "PROPERT",
-        "PROPERTI",
-        "PROPERTIE",
-        "PROPS",
-    }): "PROP",
-    frozenset({"REALTY", "REALTIES", "RELATY", "RELATIES", "REALT", "REALTEIS", "RE", "REL"}): "RLTY",
-}
-
-# Flatten ngram_adj for easier replacement
-flat_ngram_adj = {word: replacement for synonyms, replacement in ngram_adj.items() for word in synonyms}
-
-
-def adjust_and_replace(string: str) -> str:
+def adjust_and_replace(string: str, rules: dict | None = None) -> str:
     """
     replace specified words with blanks and other words with their corresponding values for ngrams
     """
+    tokens = (rules or default_rules)["similarity_tokens"]
 
     # remove punctuation
     string = re.sub(r"[,-./]", r"", string)
@@ -160,36 +113,61 @@ def adjust_and_replace(string: str) -> str:
     # split the string into words
     parts = string.split()
 
-    # replace words based on blank_words and flat_ngram_adj using list comprehension
-    adjusted_string = "".join(["" if part in blank_words else flat_ngram_adj.get(part, part) for part in parts])
+    # replace words based on the similarity drop_tokens and synonyms using list comprehension
+    adjusted_string = "".join([tokens.get(part, part) for part in parts])
 
     return adjusted_string.strip()
 
 
+def adjust_and_replace_expr(entity: pl.Expr, rules: dict | None = None) -> pl.Expr:
+    """
+    Vectorized version of adjust_and_replace as a Polars expression, mapping
+    every word with a single lookup in the compiled similarity token map.
+
+    Returns a pl.Expr
+    """
+    tokens = (rules or default_rules)["similarity_tokens"]
+
+    words = entity.str.replace_all(r"[,-./]", "").str.extract_all(f"[^{whitespace_class}]+")
+    if tokens:
+        words = words.list.eval(pl.element().replace(tokens))
+
+    return words.list.join("").str.strip_chars(python_whitespace)
+
+
+def char_ngrams(string: str, n: int = 3) -> list:
+    """
+    split an already adjusted string into substrings of length n, return list of substrings
+    """
+    ngrams = zip(*[string[i:] for i in range(n)])
+    return ["".join(ngram) for ngram in ngrams]
+
+
 def ngrams(string: str, n: int = 3) -> list:
     """
     split string into substrings of length n, return list of substrings
     """
-    pre_processing = adjust_and_replace(string)
-    ngrams = zip(*[pre_processing[i:] for i in range(n)])
-    return ["".join(ngram) for ngram in ngrams]
+    return char_ngrams(adjust_and_replace(string), n)
 
 
 def database_query(db_path: str | Path, table_name: str | None = None, limit: int | None = None) -> pl.DataFrame:
     """
-    queries entities for comparison
+    queries entities for comparison, with the surrogate keys of their ids, in
+    key order
     """
     if table_name is None:
         table_name = "entity.name"
-        id_col = "name_id"
-    else:
-        id_col = table_name.split(".")[1] + "_id"
+    id_col = table_name.split(".")[1] + "_id"
+    key_col = table_name.split(".")[1] + "_key"
 
     # start connection with woc db
     with duckdb.connect(db_path) as conn:
         entity_query = f"""
-        SELECT entity, {id_col}
-        FROM {table_name}
+        SELECT e.entity, e.{id_col}, k.{key_col}
+        FROM {table_name} e
+        JOIN {table_name}_key k
+        USING ({id_col})
+        ORDER BY k.{key_col}
         """
 
         # retreive entity list (all unique names in parcel, llc and corp data
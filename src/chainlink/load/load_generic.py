@@ -4,35 +4,87 @@ from pathlib import Path
 import duckdb
 import polars as pl
 
+from chainlink.cleaning.cleaning_functions import register_cleaning_macros
 from chainlink.load.load_utils import (
+    add_entity_keys,
+    bad_flag_expr,
     clean_generic,
-    execute_bad_flag,
+    cluster_cols,
+    detect_id_dtype,
+    get_read_cols,
     load_to_db,
+    order_table,
+    read_file,
+    read_file_batches,
+    row_hash_expr,
+    scan_file,
     update_entity_ids,
     validate_input_data,
 )
-from chainlink.utils import console, logger
-
-
-def load_generic(db_path: str | Path, schema_config: dict, bad_addresses: list, bad_names: list) -> None:
+from chainlink.utils import check_table_exists, console, create_index, logger
+
+
+def load_generic(
+    db_path: str | Path,
+    schema_config: dict,
+    bad_addresses: list,
+    bad_names: list,
+    clean_cache: dict | None = None,
+    cluster: bool = False,
+    index: bool = False,
+    delta: bool = False,
+) -> None:
     """
     Loads a generic file into the database.
 
     Reads config file, loops through each file listed, cleans the data,
     creates a unique id for name, street, and street_name,
-    loads into cleaned files into a database using the schema name from the config file,
-    and lastly updates the entity name files.
+    updates the entity name files and the surrogate keys of their ids,
+    and lastly loads the cleaned files, with the keys, into a database using the schema name from the config file.
+
+    If a table config sets batch_size, the file is streamed and cleaned, loaded
+    and added to the entity tables batch_size rows at a time.
+
+    Name and address columns are flagged as skipped if their value is in
+    bad_names or bad_addresses while each batch is cleaned, so every table is
+    written once.
+
+    Record ids are loaded as Int64 if every id of every table in the schema is
+    an integer (see detect_id_dtype), unless the schema sets id_type to string.
+
+    If cluster is True, tables are written ordered by their matching keys (see
+    cluster_cols), and if index is True, an index is created on their id column.
+
+    Every row is stored with a row_hash of its values (see row_hash_expr). If
+    delta is True, the schema is already in the database and its tables are
+    updated rather than replaced: only rows whose row_hash is not stored are
+    cleaned and inserted, and stored rows whose row_hash is not in the file are
+    deleted, so a changed row is a delete and an insert. The ids of the records
+    inserted, updated or deleted are added to {schema}.delta_ids, so only their
+    links need to be recomputed (see create_delta_links). Identical rows of a
+    record are compared as one row.
+
+    clean_cache (from new_clean_cache) is shared by every table cleaned, so names
+    and addresses already cleaned earlier in the run, or stored in the database's
+    parse cache, are not cleaned again. If the cache was created with in_db,
+    the cleaning macros are registered on the connection so names and
+    addresses are pre-cleaned in DuckDB.
 
     Returns None.
     """
 
     schema_name = schema_config["schema_name"]
+    bad_values = {
+        "address_cols": pl.Series(bad_addresses, dtype=pl.String, strict=False).unique(),
+        "name_cols": pl.Series(bad_names, dtype=pl.String, strict=False).unique(),
+    }
 
     with duckdb.connect(db_path, read_only=False) as conn:
+        if clean_cache is not None and clean_cache["in_db"]:
+            register_cleaning_macros(conn, clean_cache["rules"])
+
+        file_paths = []
         for table_config in schema_config["tables"]:
-            # Read the data
-            console.log(f"[yellow] Data: {table_config['table_name']} -- Reading data")
-            logger.info(f"Data: {table_config['table_name']} -- Reading data")
             file_path = table_config.get("table_name_path")
             if not file_path:
                 raise ValueError(f"No file path provided for table: {table_config['table_name']}")
@@ -44,80 +96,157 @@ def load_generic(db_path: str | Path, schema_config: dict, bad_addresses: list,
             if file_extension not in ["csv", "parquet"]:
                 raise ValueError(f"Unsupported file format: {file_extension}. Supported formats: csv, parquet")
 
-            try:
-                df = (
-                    pl.read_csv(file_path, infer_schema=False)
-                    if file_extension == "csv"
-                    else pl.read_parquet(file_path)
+            file_paths.append((file_path, file_extension))
+
+        # every table of a schema shares the id column, so record ids are
+        # integers only if they are integers in every file
+        id_dtype: pl.DataType | type[pl.DataType] = pl.String
+        if schema_config.get("id_type", "auto") == "auto":
+            id_dtypes = set()
+            for table_config, (file_path, file_extension) in zip(schema_config["tables"], file_paths):
+                lf = scan_file(file_path, file_extension)
+                # missing id columns are reported by validate_input_data
+                if table_config["id_col_og"] in lf.collect_schema().names():
+                    id_dtypes.add(detect_id_dtype(lf, table_config["id_col_og"]))
+            id_dtype = pl.Int64 if id_dtypes == {pl.Int64} else pl.String
+
+        if delta:
+            # ids keep the type they were stored with
+            stored_dtypes = set()
+            for table_config in schema_config["tables"]:
+                if check_table_exists(conn, schema_name, table_config["table_name"]):
+                    stored = conn.table(f"{schema_name}.{table_config['table_name']}").limit(0).pl()
+                    stored_dtypes.add(stored.schema[table_config["id_col"]])
+            if stored_dtypes == {pl.Int64} and id_dtype != pl.Int64:
+                raise ValueError(
+                    f"Record ids of {schema_name} are stored as integers, but not all new ids are integers. "
+                    "Reload the schema with overwrite_db"
                 )
-                # convert all columns to string
-                df = df.cast(pl.String)
-
-            except Exception as e:
-                raise Exception(f"Error reading file {file_path}: {e!s}") from None
+            if stored_dtypes:
+                id_dtype = pl.Int64 if stored_dtypes == {pl.Int64} else pl.String
+            sql_dtype = "BIGINT" if id_dtype == pl.Int64 else "VARCHAR"
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {schema_name}.delta_ids (id {sql_dtype})")
 
-            validate_input_data(df, table_config)
+        for table_config, (file_path, file_extension) in zip(schema_config["tables"], file_paths):
+            # Read the data
+            console.log(f"[yellow] Data: {table_config['table_name']} -- Reading data")
+            logger.info(f"Data: {table_config['table_name']} -- Reading data")
 
-            # Clean the data and create ids
-            console.log(f"""[yellow] Data: {table_config["table_name"]} -- Starting cleaning""")
-            logger.info(f"""Data: {table_config["table_name"]} -- Starting cleaning""")
+            # linkage columns are read as strings, other columns as configured by other_cols
+            string_cols, columns = get_read_cols(file_path, file_extension, table_config)
 
-            all_columns = []
-            all_columns.append(table_config["id_col_og"])
-            for col in table_config.get("name_cols_og", ""):
-                all_columns.append(col)
-            for col in table_config.get("address_cols_og", ""):
-                all_columns.append(col)
+            batch_size = table_config.get("batch_size")
+            if batch_size:
+                # stream the file so only one batch is held in memory at a time
+                validate_input_data(scan_file(file_path, file_extension, string_cols), table_config)
+                batches = read_file_batches(file_path, file_extension, batch_size, string_cols, columns)
+            else:
+                df = read_file(file_path, file_extension, string_cols, columns)
+                validate_input_data(df, table_config)
+                batches = iter([df])
 
-            # Make headers snake case
-            df.columns = [x.lower().replace(" ", "_") for x in df.columns]
-            # df.columns = df.columns.str, regex=True)
+            table_name = table_config["table_name"]
+            all_id_cols = ["name_id", "address_id", "street_id", "street_name_id"]
+            order_by = cluster_cols(table_config) if cluster else None
 
-            df = clean_generic(df, table_config)
+            table_exists = delta and check_table_exists(conn, schema_name, table_name)
+            if table_exists:
+                if "row_hash" not in conn.table(f"{schema_name}.{table_name}").columns:
+                    raise ValueError(
+                        f"{schema_name}.{table_name} was loaded without row hashes. Reload the schema with overwrite_db"
+                    )
+                conn.execute("CREATE OR REPLACE TEMP TABLE delta_seen (row_hash UBIGINT)")
+            inserted = 0
+
+            for batch_num, df in enumerate(batches):
+                if batch_size:
+                    console.log(f"[yellow] Data: {table_config['table_name']} -- Batch {batch_num + 1}")
+                    logger.info(f"Data: {table_config['table_name']} -- Batch {batch_num + 1} ({df.height} rows)")
+
+                # Clean the data and create ids
+                console.log(f"""[yellow] Data: {table_config["table_name"]} -- Starting cleaning""")
+                logger.info(f"""Data: {table_config["table_name"]} -- Starting cleaning""")
+
+                # Make headers snake case
+                df.columns = [x.lower().replace(" ", "_") for x in df.columns]
+                df = df.with_columns(pl.col(table_config["id_col"]).cast(id_dtype))
+                df = df.with_columns(row_hash_expr(df.columns))
+
+                if table_exists:
+                    # only new and changed rows are cleaned and inserted
+                    conn.execute("INSERT INTO delta_seen SELECT row_hash FROM df")
+                    stored = conn.execute(
+                        f"""SELECT row_hash
+                            FROM {schema_name}.{table_name}
+                            WHERE row_hash IN (SELECT row_hash FROM df)"""
+                    ).pl()
+                    df = df.join(stored, on="row_hash", how="anti")
+                    if df.is_empty():
+                        continue
+                    inserted += df.height
+                if delta:
+                    conn.execute(f"INSERT INTO {schema_name}.delta_ids SELECT {table_config['id_col']} FROM df")
+
+                df = clean_generic(df, table_config, clean_cache, conn)
+
+                # add new names to entity_names table
+                console.log(f"""[yellow] Data: {table_config["table_name"]} -- Updating entity name tables""")
+                logger.info(f"""Data: {table_config["table_name"]} -- Updating entity name tables""")
+
+                id_cols = []
+                for col in df.columns:
+                    if any(c in col for c in all_id_cols) and "subaddress_identifier" not in col:
+                        id_cols.append(col)
+
+                update_entity_ids(df=df, entity_id_cols=id_cols, db_conn=conn)
+
+                # store the surrogate keys of the ids, which the links join on
+                df = add_entity_keys(df=df, entity_id_cols=id_cols, db_conn=conn)
+
+                # create bad address and name flags
+                df = df.with_columns(
+                    bad_flag_expr(col, bad_values[cols])
+                    for cols in ["address_cols", "name_cols"]
+                    for col in table_config.get(cols) or []
+                )
 
-            # load the data to db
-            console.log(f"""[yellow] Data: {table_config["table_name"]} -- Starting load""")
+                # load the data to db
+                console.log(f"""[yellow] Data: {table_config["table_name"]} -- Starting load""")
 
-            table_name = table_config["table_name"]
-            load_to_db(
-                df=df,
-                table_name=table_name,
-                db_conn=conn,
-                schema=schema_name,
-            )
+                load_to_db(
+                    df=df,
+                    table_name=table_name,
+                    db_conn=conn,
+                    schema=schema_name,
+                    append=table_exists or batch_num > 0,
+                    order_by=order_by,
+                )
 
-            # add new names to entity_names table
-            console.log(f"""[yellow] Data: {table_config["table_name"]} -- Updating entity name tables""")
-            logger.info(f"""Data: {table_config["table_name"]} -- Updating entity name tables""")
+            if table_exists:
+                # stored rows no longer in the file were deleted or changed
+                deleted = conn.execute(
+                    f"""INSERT INTO {schema_name}.delta_ids
+                        SELECT {table_config["id_col"]}
+                        FROM {schema_name}.{table_name}
+                        ANTI JOIN delta_seen USING (row_hash)"""
+                ).fetchone()[0]
+                conn.execute(
+                    f"DELETE FROM {schema_name}.{table_name} WHERE row_hash NOT IN (SELECT row_hash FROM delta_seen)"
+                )
+                console.log(f"[yellow] Data: {table_name} -- {inserted} rows inserted, {deleted} rows deleted")
+                logger.info(f"Data: {table_name} -- {inserted} rows inserted, {deleted} rows deleted")
 
-            all_id_cols = ["name_id", "address_id", "street_id", "street_name_id"]
+            # batches are each ordered, so order the whole table once they are all loaded
+            if order_by and (batch_num > 0 or (table_exists and inserted)):
+                order_table(conn, f"{schema_name}.{table_name}", order_by)
 
-            id_cols = []
-            for col in df.columns:
-                if any(c in col for c in all_id_cols) and "subaddress_identifier" not in col:
-                    id_cols.append(col)
-
-            for col in id_cols:
-                update_entity_ids(df=df, entity_id_col=col, db_conn=conn)
-
-            # create bad address flag
-            if table_config.get("address_cols"):
-                for col in table_config["address_cols"]:
-                    execute_bad_flag(
-                        db_conn=conn,
-                        table=f"{schema_name}.{table_name}",
-                        col=col,
-                        bad_list=bad_addresses,
-                    )
+            if index:
+                create_index(conn, f"{schema_name}.{table_name}", table_config["id_col"])
 
-            if table_config.get("name_cols"):
-                for col in table_config["name_cols"]:
-                    execute_bad_flag(
-                        db_conn=conn,
-                        table=f"{schema_name}.{table_name}",
-                        col=col,
-                        bad_list=bad_names,
-                    )
+        if delta:
+            conn.execute(
+                f"CREATE OR REPLACE TABLE {schema_name}.delta_ids AS SELECT DISTINCT id FROM {schema_name}.delta_ids"
+            )
 
 
 if __name__ == "__main__":
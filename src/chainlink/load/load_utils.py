@@ -1,16 +1,191 @@
+from collections import Counter
+from collections.abc import Callable, Iterator
+from functools import partial
+from pathlib import Path
+
 import polars as pl
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 from duckdb import DuckDBPyConnection
 
 from chainlink.cleaning.cleaning_functions import (
-    clean_address,
-    clean_address_batch_parser,  # noqa: F401
+    ADDRESS_STRUCT,
+    address_latency_percentiles,
+    address_norm_expr,
+    backfill_city_state,
+    clean_address_batch_parser,
     clean_names,
-    clean_zipcode,
+    clean_names_batch,
+    clean_zipcode_expr,
+    get_cleaning_version,
+    new_address_executor,
+    new_address_trace,
+    normalize_address_expr,
+    parse_address,
+    parse_addresses,
+    predict_org_expr,
 )
-from chainlink.utils import check_table_exists, console
+from chainlink.cleaning.rules import default_rules
+from chainlink.hashing import xxhash64
+from chainlink.utils import console
+
+# cleaned value types of each kind of value in the cleaning and parse caches
+PARSE_CACHE_DTYPES: dict[str, pl.DataType | type[pl.DataType]] = {"name": pl.String, "address": ADDRESS_STRUCT}
+PARSE_CACHE_TYPES = {
+    "name": "VARCHAR",
+    "address": f"STRUCT({', '.join(f'{field.name} VARCHAR' for field in ADDRESS_STRUCT.fields)})",
+}
+
+
+def get_linkage_cols(table_config: dict) -> list[str]:
+    """
+    Returns the columns of the source file used for linking (id, name, and address
+    columns), by their original names in the file.
+    """
+    linkage_cols = [table_config["id_col_og"]]
+    linkage_cols += table_config.get("name_cols_og", [])
+    linkage_cols += table_config.get("address_cols_og", [])
+
+    return list(dict.fromkeys(linkage_cols))
+
+
+def get_read_cols(file_path: str, file_extension: str, table_config: dict) -> tuple[list | None, list | None]:
+    """
+    Works out which columns to read and which to read as String from the table's
+    other_cols option:
+        * string (default): read every column as String
+        * typed: read the linkage columns as String and keep the native types of all other columns
+        * drop: only read the linkage columns
+
+    Returns a tuple of (string_cols, columns), where None means all columns.
+    """
+    other_cols = table_config.get("other_cols", "string")
+    if other_cols == "string":
+        return None, None
 
+    # only keep linkage columns that exist, missing columns are reported by validate_input_data
+    file_cols = set(scan_file(file_path, file_extension).collect_schema().names())
+    string_cols = [col for col in get_linkage_cols(table_config) if col in file_cols]
+    columns = string_cols if other_cols == "drop" else None
 
-def load_to_db(df: pl.DataFrame, table_name: str, db_conn: DuckDBPyConnection, schema: str) -> None:
+    return string_cols, columns
+
+
+def detect_id_dtype(lf: pl.LazyFrame, id_col: str) -> pl.DataType | type[pl.DataType]:
+    """
+    Detects the type record ids in id_col can be stored as. Ids are integers if
+    every id is written exactly as its Int64 value (no leading zeros, signs or
+    spaces), so casting them back to String gives the ids in the file.
+
+    Returns pl.Int64 if the ids are integers, otherwise pl.String
+    """
+    ids = pl.col(id_col).cast(pl.String)
+    is_integer = lf.select(ids.cast(pl.Int64, strict=False).cast(pl.String).eq_missing(ids).all()).collect().item()
+
+    return pl.Int64 if is_integer else pl.String
+
+
+def read_file(
+    file_path: str,
+    file_extension: str,
+    string_cols: list | None = None,
+    columns: list | None = None,
+) -> pl.DataFrame:
+    """
+    Reads a csv or parquet file fully into memory. Only columns are read, and
+    string_cols are cast to String (see scan_file).
+
+    Returns a pl.DataFrame
+    """
+    try:
+        lf = scan_file(file_path, file_extension, string_cols)
+        if columns is not None:
+            lf = lf.select(columns)
+        df = lf.collect()
+
+    except Exception as e:
+        raise Exception(f"Error reading file {file_path}: {e!s}") from None
+
+    return df
+
+
+def scan_file(file_path: str, file_extension: str, string_cols: list | None = None) -> pl.LazyFrame:
+    """
+    Lazily scans a csv or parquet file without reading it into memory. Columns in
+    string_cols are read as String and all other columns keep their native types.
+    If string_cols is None, every column is read as String.
+
+    Returns a pl.LazyFrame
+    """
+    if file_extension == "csv":
+        if string_cols is None:
+            return pl.scan_csv(file_path, infer_schema=False)
+        return pl.scan_csv(file_path, schema_overrides=dict.fromkeys(string_cols, pl.String))
+
+    lf = pl.scan_parquet(file_path)
+    if string_cols is None:
+        return lf.cast(pl.String)
+    return lf.with_columns(pl.col(string_cols).cast(pl.String))
+
+
+def read_file_batches(
+    file_path: str,
+    file_extension: str,
+    batch_size: int,
+    string_cols: list | None = None,
+    columns: list | None = None,
+) -> Iterator[pl.DataFrame]:
+    """
+    Streams a csv or parquet file in batches of at most batch_size rows. Only one
+    batch is held in memory at a time, so peak memory depends on the batch size
+    rather than the file size. Only columns are decoded, and string_cols are cast
+    to String (see scan_file).
+
+    The types of csv columns are inferred once by Polars, as in read_file, and
+    every batch is read with them.
+
+    Returns an iterator of pl.DataFrame
+    """
+    schema = None
+    try:
+        if file_extension == "csv":
+            schema = scan_file(file_path, file_extension, string_cols).collect_schema()
+            arrow_schema = pl.DataFrame(schema=schema).to_arrow(compat_level=pl.CompatLevel.oldest()).schema
+            file_format = ds.CsvFileFormat(
+                convert_options=pacsv.ConvertOptions(
+                    column_types={field.name: field.type for field in arrow_schema},
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                )
+            )
+        else:
+            file_format = ds.ParquetFileFormat()
+        dataset = ds.dataset(file_path, format=file_format)
+        batches = dataset.to_batches(columns=columns, batch_size=batch_size)
+
+    except Exception as e:
+        raise Exception(f"Error reading file {file_path}: {e!s}") from None
+
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        df = pl.DataFrame(batch)
+        if schema is not None:
+            yield df.cast({col: schema[col] for col in df.columns})
+        elif string_cols is None:
+            yield df.cast(pl.String)
+        else:
+            yield df.with_columns(pl.col(string_cols).cast(pl.String))
+
+
+def load_to_db(
+    df: pl.DataFrame,
+    table_name: str,
+    db_conn: DuckDBPyConnection,
+    schema: str,
+    append: bool = False,
+    order_by: list[str] | None = None,
+) -> None:
     """Loads parquet file into table in database.
 
     Parameters
@@ -23,30 +198,426 @@ def load_to_db(df: pl.DataFrame, table_name: str, db_conn: DuckDBPyConnection, s
         Connection object to desired duckdb database.
     schema : str
         Name of schema for resulting table in database.
+    append : bool
+        If True, appends df to the existing table instead of replacing it.
+    order_by : list[str] | None
+        If given, df is written ordered by these columns, so DuckDB's zonemaps
+        can skip row groups when filtering or joining on them.
 
     Returns
     -------
     None
     """
     df = df
+    order = f"ORDER BY {', '.join(order_by)}" if order_by else ""
+    if append:
+        db_conn.execute(f"INSERT INTO {schema}.{table_name} BY NAME SELECT * FROM df {order}")
+        return None
+
     query = f"""
             CREATE SCHEMA IF NOT EXISTS {schema};
             DROP TABLE IF EXISTS {schema}.{table_name};
             CREATE TABLE {schema}.{table_name} AS
                SELECT *
-               FROM df;
+               FROM df
+               {order};
             """
 
     db_conn.execute(query)
 
 
-def clean_generic(df: pl.DataFrame, config: dict) -> pl.DataFrame:
+def order_table(db_conn: DuckDBPyConnection, table: str, order_by: list[str]) -> None:
+    """
+    Rewrites table ordered by order_by, such as a table loaded in batches that
+    were each ordered by them.
+
+    Returns None
+    """
+    db_conn.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {table} ORDER BY {', '.join(order_by)}")
+
+
+def cluster_cols(table_config: dict) -> list[str]:
+    """
+    Returns the matching key columns a table is ordered by when clustered: the
+    name key of its first name column and the street key of its first address
+    column.
+    """
+    order_by = [f"{col}_name_key" for col in table_config["name_cols"][:1]]
+    order_by += [f"{col}_street_key" for col in table_config["address_cols"][:1]]
+
+    return order_by
+
+
+def new_clean_cache(
+    reuse: bool = True,
+    persist: bool = False,
+    workers: int = 1,
+    chunk_size: int = 10_000,
+    in_db: bool = False,
+    streaming: bool = False,
+    rules: dict | None = None,
+    trace_slowest: int = 0,
+    time_budget: float | None = None,
+) -> dict:
+    """
+    Creates a cache of cleaned names and addresses to share across all the tables
+    and columns of a run, so each distinct raw value is only cleaned once.
+
+    If reuse is False, values are only reused within a single column. If persist
+    is True, values are also looked up in and saved to the parse cache tables in
+    the database (see init_parse_cache). If workers is more than 1, addresses are
+    cleaned in a pool of that many processes, chunk_size addresses at a time; the
+    pool is started on first use and shut down by close_clean_cache. If in_db is
+    True, names are cleaned and addresses normalized in the database with the
+    cleaning macros (see register_cleaning_macros) instead of in Polars. If
+    streaming is True, clean_generic runs with Polars' streaming engine. Names
+    are cleaned with rules from compile_rules, the built-in rules by default.
+    If trace_slowest is more than 0, address parse latencies and the
+    trace_slowest slowest addresses are traced (see store_address_trace). An
+    address that takes longer than time_budget seconds in the full parser falls
+    back to its normalized form; the full parser then runs in the worker pool,
+    which is started even with one worker, so it can be given a deadline.
+
+    Returns a dict
+    """
+    return {
+        **{kind: pl.DataFrame(schema={"raw": pl.String, "clean": dtype}) for kind, dtype in PARSE_CACHE_DTYPES.items()},
+        "reuse": reuse,
+        "persist": persist,
+        "workers": workers,
+        "chunk_size": chunk_size,
+        "in_db": in_db,
+        "streaming": streaming,
+        "rules": rules or default_rules,
+        "executor": None,
+        "stats": {kind: {"values": 0, "unique": 0, "stored": 0, "cleaned": 0} for kind in PARSE_CACHE_TYPES},
+        "address_tiers": Counter(),
+        "address_trace": new_address_trace(trace_slowest),
+        "time_budget": time_budget,
+    }
+
+
+def close_clean_cache(cache: dict) -> None:
+    """
+    Shuts down the cache's address cleaning worker pool, if it was started.
+
+    Returns None
+    """
+    if cache["executor"] is not None:
+        cache["executor"].shutdown()
+        cache["executor"] = None
+
+
+def clean_address_parallel(addresses: pl.Series, cache: dict) -> pl.Series:
+    """
+    Parses normalized addresses with parse_addresses. If the cache has more than
+    one worker, they are parsed in the cache's worker pool, starting the pool on
+    first use. Batches that fit in a single chunk are parsed in this process,
+    since they would only occupy one worker. With a time budget, addresses are
+    parsed in this process and only the full parser runs in the pool, so it can
+    be given a deadline (see tag_addresses_in_pool).
+
+    Returns a pl.Series
+    """
+    if cache["time_budget"] is not None:
+        return parse_addresses(
+            addresses, cache["address_tiers"], cache["address_trace"], cache["time_budget"], pool=cache
+        )
+
+    if cache["workers"] <= 1 or len(addresses) <= cache["chunk_size"]:
+        return parse_addresses(addresses, cache["address_tiers"], cache["address_trace"], cache["time_budget"])
+
+    if cache["executor"] is None:
+        cache["executor"] = new_address_executor(cache["workers"])
+
+    return clean_address_batch_parser(
+        addresses,
+        chunk_size=cache["chunk_size"],
+        executor=cache["executor"],
+        normalized=True,
+        tiers=cache["address_tiers"],
+        trace=cache["address_trace"],
+        budget=cache["time_budget"],
+    )
+
+
+def clean_in_db(db_conn: DuckDBPyConnection, macro: str, values: pl.Series) -> pl.Series:
+    """
+    Applies one of the cleaning macros registered by register_cleaning_macros to
+    values in the database, using DuckDB's thread pool.
+
+    Returns a pl.Series
+    """
+    to_clean = values.to_frame("raw")
+    cleaned = db_conn.execute(f"SELECT {macro}(raw) AS clean FROM to_clean").pl()
+
+    return cleaned["clean"].alias(values.name)
+
+
+def clean_cache_summary(cache: dict) -> str:
+    """
+    Summarizes how many values were cleaned versus looked up in the cache.
+
+    Returns a str
+    """
+    summary = []
+    for kind, stats in cache["stats"].items():
+        if stats["values"] == 0:
+            continue
+        hit_rate = 1 - stats["cleaned"] / stats["values"]
+        stored = f", {stats['stored']:,} from parse cache" if cache["persist"] else ""
+        summary.append(
+            f"{kind}: cleaned {stats['cleaned']:,} of {stats['values']:,} values "
+            f"({stats['unique']:,} unique per column{stored}, {hit_rate:.1%} hit rate)"
+        )
+
+    tiers = cache["address_tiers"]
+    if tiers.total() > 0:
+        summary.append(
+            f"addresses parsed: {tiers['fast']:,} fast path, {tiers['full']:,} full parser "
+            f"({tiers['full'] / tiers.total():.1%} fallback rate)"
+        )
+    if tiers["timeout"] > 0:
+        summary.append(f"{tiers['timeout']:,} addresses over the time budget")
+    if tiers["oversized"] > 0:
+        summary.append(f"{tiers['oversized']:,} addresses too long for the full parser")
+
+    trace = cache["address_trace"]
+    if trace["latencies"].total() > 0:
+        p50, p90, p99, p100 = address_latency_percentiles(trace, [50, 90, 99, 100])
+        summary.append(
+            f"address parse latency: p50 {p50 * 1000:.2f} ms, p90 {p90 * 1000:.2f} ms, "
+            f"p99 {p99 * 1000:.2f} ms, max {p100 * 1000:.2f} ms"
+        )
+
+    return "; ".join(summary)
+
+
+def clean_unique(
+    series: pl.Series,
+    clean_func: Callable,
+    return_dtype: pl.DataType | type[pl.DataType],
+    cache: dict,
+    kind: str,
+    db_conn: DuckDBPyConnection | None = None,
+    batch_func: Callable[[pl.Series], pl.Series] | None = None,
+) -> pl.Series:
+    """
+    Applies clean_func to each distinct value of series that is not already in
+    cache[kind], adds the results to the cache, and joins them back onto series.
+    If the cache persists and db_conn is given, values are first looked up in
+    entity.{kind}_parse_cache and newly cleaned values are saved to it.
+    If batch_func is given, it cleans the whole Series of values at once instead.
+
+    Returns a pl.Series
+    """
+    cleaned = clean_unique_values(
+        series.unique(), len(series), clean_func, return_dtype, cache, kind, db_conn, batch_func
+    )
+
+    return series.to_frame("raw").join(cleaned, on="raw", how="left", maintain_order="left")["clean"]
+
+
+def clean_unique_values(
+    uniques: pl.Series,
+    n_values: int,
+    clean_func: Callable,
+    return_dtype: pl.DataType | type[pl.DataType],
+    cache: dict,
+    kind: str,
+    db_conn: DuckDBPyConnection | None = None,
+    batch_func: Callable[[pl.Series], pl.Series] | None = None,
+) -> pl.DataFrame:
+    """
+    Cleans the distinct values of a column of n_values values as clean_unique
+    does, but returns the cleaned values to be joined onto the column instead.
+
+    Returns a pl.DataFrame of raw and clean values, including every value of uniques
+    """
+    stats = cache["stats"][kind]
+    misses = uniques.to_frame("raw").join(cache[kind], on="raw", how="anti")["raw"]
+
+    if cache["persist"] and db_conn is not None and len(misses) > 0:
+        stored = lookup_parse_cache(db_conn, kind, misses)
+        cache[kind] = pl.concat([cache[kind], stored])
+        misses = misses.to_frame("raw").join(stored, on="raw", how="anti")["raw"]
+        stats["stored"] += len(stored)
+
+    if len(misses) > 0:
+        if batch_func is None:
+            cleaned_values = misses.map_elements(clean_func, return_dtype=return_dtype)
+        else:
+            cleaned_values = batch_func(misses)
+        cleaned = pl.DataFrame({"raw": misses, "clean": cleaned_values})
+        cache[kind] = pl.concat([cache[kind], cleaned])
+        if cache["persist"] and db_conn is not None:
+            to_store = cleaned
+            if kind == "address":
+                # addresses that ran out of time are parsed again next run
+                to_store = cleaned.filter(~pl.col("raw").is_in(cache["address_trace"]["timed_out"]))
+            store_parse_cache(db_conn, kind, to_store, cache["rules"])
+
+    stats["values"] += n_values
+    stats["unique"] += len(uniques)
+    stats["cleaned"] += len(misses)
+
+    cleaned = cache[kind]
+    if not cache["reuse"]:
+        cache[kind] = cache[kind].clear()
+
+    return cleaned
+
+
+def init_parse_cache(db_conn: DuckDBPyConnection, rules: dict | None = None) -> None:
+    """
+    Creates the entity.name_parse_cache and entity.address_parse_cache tables if
+    they don't exist, and removes entries written by a different version of the
+    cleaning code.
+
+    Entries are keyed by md5_number_lower of the raw string, the lower 64 bits
+    of its md5 hash, and record when they were last used, so the least recently
+    used entries can be evicted. Lookups also compare the raw string, so a hash
+    collision only makes INSERT OR IGNORE skip storing the second value; it
+    never returns the parse of another value.
+
+    Returns None
+    """
+    version = get_cleaning_version((rules or default_rules)["fingerprint"])
+    db_conn.execute("CREATE SCHEMA IF NOT EXISTS entity")
+    for kind, clean_type in PARSE_CACHE_TYPES.items():
+        db_conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS entity.{kind}_parse_cache (
+                raw_hash UBIGINT PRIMARY KEY,
+                raw VARCHAR,
+                clean {clean_type},
+                version VARCHAR,
+                last_used TIMESTAMP
+            )""")
+        db_conn.execute(f"DELETE FROM entity.{kind}_parse_cache WHERE version != ?", [version])
+
+
+def lookup_parse_cache(db_conn: DuckDBPyConnection, kind: str, raw: pl.Series) -> pl.DataFrame:
+    """
+    Looks up raw values in entity.{kind}_parse_cache and marks the found entries as used.
+
+    Returns a pl.DataFrame of raw and clean values found
+    """
+    to_find = raw.to_frame("raw")
+    match_condition = "c.raw_hash = md5_number_lower(f.raw) AND c.raw = f.raw"
+
+    db_conn.execute(f"""
+        UPDATE entity.{kind}_parse_cache c
+        SET last_used = now()
+        FROM to_find f
+        WHERE {match_condition}""")
+    found = db_conn.execute(f"""
+        SELECT c.raw, c.clean
+        FROM to_find f
+        JOIN entity.{kind}_parse_cache c
+        ON {match_condition}""").pl()
+
+    return found.cast({"clean": PARSE_CACHE_DTYPES[kind]})
+
+
+def store_parse_cache(db_conn: DuckDBPyConnection, kind: str, cleaned: pl.DataFrame, rules: dict | None = None) -> None:
+    """
+    Saves newly cleaned values to entity.{kind}_parse_cache.
+
+    Returns None
+    """
+    db_conn.execute(
+        f"""
+        INSERT OR IGNORE INTO entity.{kind}_parse_cache
+        SELECT md5_number_lower(raw), raw, clean, ?, now()
+        FROM cleaned""",
+        [get_cleaning_version((rules or default_rules)["fingerprint"])],
+    )
+
+
+def evict_parse_cache(db_conn: DuckDBPyConnection, max_rows: int) -> None:
+    """
+    Evicts the least recently used entries of each parse cache table beyond max_rows.
+
+    Returns None
+    """
+    for kind in PARSE_CACHE_TYPES:
+        db_conn.execute(f"""
+            DELETE FROM entity.{kind}_parse_cache
+            WHERE raw_hash IN (
+                SELECT raw_hash
+                FROM entity.{kind}_parse_cache
+                ORDER BY last_used DESC
+                OFFSET {int(max_rows)}
+            )""")
+
+
+def store_address_trace(db_conn: DuckDBPyConnection, trace: dict) -> None:
+    """
+    Saves the slowest addresses of an address trace, slowest first, to
+    entity.address_parse_trace, replacing the trace of any earlier run.
+
+    Returns None
+    """
+    records = pl.DataFrame(
+        sorted(trace["records"], reverse=True),
+        schema={"seconds": pl.Float64, "address": pl.String, "timed_out": pl.Boolean},
+        orient="row",
+    ).select("address", "seconds", "timed_out")
+    db_conn.execute("CREATE SCHEMA IF NOT EXISTS entity")
+    db_conn.execute("CREATE OR REPLACE TABLE entity.address_parse_trace AS SELECT * FROM records")
+
+
+def copy_parse_cache(db_conn: DuckDBPyConnection, old_db_path: str | Path, rules: dict | None = None) -> None:
+    """
+    Copies the parse cache tables from another database, so the cache survives
+    when the database is overwritten.
+
+    Returns None
+    """
+    init_parse_cache(db_conn, rules)
+    db_conn.execute(f"ATTACH '{old_db_path}' AS old_db (READ_ONLY)")
+    for kind in PARSE_CACHE_TYPES:
+        old_table_exists = db_conn.execute(
+            f"""SELECT COUNT(*)
+                FROM duckdb_tables()
+                WHERE database_name = 'old_db'
+                AND schema_name = 'entity'
+                AND table_name = '{kind}_parse_cache'"""
+        ).fetchone()[0]
+        if old_table_exists:
+            db_conn.execute(
+                f"""INSERT OR IGNORE INTO entity.{kind}_parse_cache
+                    SELECT * FROM old_db.entity.{kind}_parse_cache
+                    WHERE version = ?""",
+                [get_cleaning_version((rules or default_rules)["fingerprint"])],
+            )
+    db_conn.execute("DETACH old_db")
+
+
+def clean_generic(
+    df: pl.DataFrame, config: dict, cache: dict | None = None, db_conn: DuckDBPyConnection | None = None
+) -> pl.DataFrame:
     """
     Cleans the name and address for a generic file. Appends a new
-    column with the cleaned name and address.
+    column with the cleaned name and address, and a {col}_is_org column
+    flagging names that look like organizations.
+
+    Names and addresses are cleaned once per distinct value. Pass a cache from
+    new_clean_cache() to also reuse values cleaned in other tables and columns,
+    and db_conn to use the parse cache tables in the database.
+
+    The cleaned values are joined onto df in a single lazy query, which is
+    collected once, with the streaming engine if the cache sets streaming.
 
     Returns a pl.DataFrame
     """
+    if cache is None:
+        cache = new_clean_cache()
+    # the connection to clean in, if the cache cleans in the database
+    in_db_conn = db_conn if cache["in_db"] else None
+    rules = cache["rules"]
+
+    lf = df.lazy()
 
     # Clean the name
     for col in config["name_cols"]:
@@ -54,25 +625,57 @@ def clean_generic(df: pl.DataFrame, config: dict) -> pl.DataFrame:
         col = col.lower().replace(" ", "_")
 
         raw_name = col + "_raw"
-        id_col_name = col + "_name"
+        temp_name = "temp_" + col
+
+        # clean each distinct name
+        names = df.select(pl.col(col).fill_null("").str.to_uppercase().unique()).to_series()
+        if in_db_conn is not None:
+            batch_func = partial(clean_in_db, in_db_conn, "clean_name")
+        else:
+            batch_func = partial(clean_names_batch, rules=rules)
+        cleaned = clean_unique_values(names, df.height, clean_names, pl.String, cache, "name", db_conn, batch_func)
+
+        # the clean name and id of each distinct name, so only those are hashed
+        name_ids = (
+            names.to_frame(col)
+            .join(cleaned.rename({"raw": col, "clean": temp_name}), on=col, how="left", maintain_order="left")
+            .with_columns(id_col_expr(temp_name))
+        )
 
         # weird case TODO
-        if raw_name in df.columns:
-            df = df.drop(columns=[raw_name])
-        df = (
-            df.rename({col: raw_name})
-            .with_columns(
-                pl.col(raw_name)
-                .fill_null("")
-                .str.to_uppercase()
-                .map_elements(clean_names, return_dtype=pl.String)
-                .alias(col)
-            )
-            .with_columns(pl.col(col).alias(id_col_name))
+        if raw_name in lf.collect_schema().names():
+            lf = lf.drop(raw_name)
+        lf = (
+            lf.rename({col: raw_name})
+            .with_columns(pl.col(raw_name).fill_null("").str.to_uppercase().alias(col))
+            .join(name_ids.lazy(), on=col, how="left", maintain_order="left")
+            .with_columns(pl.col(temp_name).alias(col))
+            .drop(temp_name)
         )
 
-        df = create_id_col(df, id_col_name)
-        df = df.drop(id_col_name)
+        if in_db_conn is not None:
+            # flag each distinct raw name
+            raw_names = df.select(pl.col(col).fill_null("").unique()).to_series()
+            temp_raw_name = temp_name + "_raw"
+            is_org = pl.DataFrame({
+                temp_raw_name: raw_names,
+                temp_name: clean_in_db(in_db_conn, "predict_org", raw_names),
+            })
+            lf = (
+                lf.join(
+                    is_org.lazy(),
+                    left_on=pl.col(raw_name).fill_null(""),
+                    right_on=temp_raw_name,
+                    how="left",
+                    maintain_order="left",
+                )
+                .with_columns(pl.col(temp_name).alias(col + "_is_org"))
+                .drop(temp_name, temp_raw_name)
+            )
+        else:
+            lf = lf.with_columns(predict_org_expr(pl.col(raw_name).fill_null(""), rules).alias(col + "_is_org"))
+
+        lf = lf.rename({temp_name + "_id": col + "_name_id"})
 
     # Clean the address
     if config.get("address_cols"):
@@ -84,79 +687,91 @@ def clean_generic(df: pl.DataFrame, config: dict) -> pl.DataFrame:
             temp_address = "temp_" + col
             console.log(f"[yellow] Cleaning address column {col}")
 
-            df = df.with_columns(
-                pl.col(col).fill_null("").str.to_uppercase().alias(raw_address),
-                pl.col(col).fill_null("").str.to_uppercase().alias(temp_address),
+            # parse each distinct normalized address
+            raws = df.select(pl.col(col).fill_null("").str.to_uppercase().unique()).to_series()
+            if in_db_conn is not None:
+                normalized = clean_in_db(in_db_conn, "normalize_address", raws)
+            else:
+                normalized = raws.to_frame().select(normalize_address_expr(pl.col(col))).to_series()
+
+            batch_func = partial(clean_address_parallel, cache=cache)
+            parsed = clean_unique_values(
+                normalized.unique(), df.height, parse_address, ADDRESS_STRUCT, cache, "address", db_conn, batch_func
             )
-            df = df.with_columns(
-                pl.col(temp_address).map_elements(
-                    clean_address,
-                    return_dtype=pl.Struct([
-                        pl.Field("raw", pl.Utf8),
-                        pl.Field("address_number", pl.Utf8),
-                        pl.Field("street_pre_directional", pl.Utf8),
-                        pl.Field("street_name", pl.Utf8),
-                        pl.Field("street_post_type", pl.Utf8),
-                        pl.Field("unit_type", pl.Utf8),
-                        pl.Field("unit_number", pl.Utf8),
-                        pl.Field("subaddress_type", pl.Utf8),
-                        pl.Field("subaddress_identifier", pl.Utf8),
-                        pl.Field("city", pl.Utf8),
-                        pl.Field("state", pl.Utf8),
-                        pl.Field("postal_code", pl.Utf8),
-                        pl.Field("street", pl.Utf8),
-                        pl.Field("address_norm", pl.Utf8),
-                    ]),
+
+            # fill in the raw address components of each distinct raw address
+            addresses = (
+                pl.DataFrame({raw_address: raws, temp_address: normalized})
+                .join(parsed.rename({"raw": temp_address}), on=temp_address, how="left", maintain_order="left")
+                .select(
+                    raw_address,
+                    pl.col("clean")
+                    .struct.with_fields(
+                        pl.col(raw_address).alias("raw"),
+                        address_norm_expr(pl.col(raw_address)).alias("address_norm"),
+                    )
+                    .alias(temp_address),
                 )
             )
-            ta_fields = df[temp_address].struct.fields
-            new_fields = [f"{col}_{f}" for f in ta_fields]
-            df = (
-                df.drop(raw_address)
-                .with_columns(pl.col(temp_address).struct.rename_fields(new_fields))
+            addresses = addresses.with_columns(backfill_city_state(addresses[temp_address]))
+            new_fields = [f"{col}_{f}" for f in addresses[temp_address].struct.fields]
+            addresses = (
+                addresses.with_columns(pl.col(temp_address).struct.rename_fields(new_fields))
+                .drop(raw_address)
                 .unnest(temp_address)
                 .with_columns(
-                    pl.col(f"{col}_postal_code").cast(pl.String).map_elements(clean_zipcode, return_dtype=pl.String),
+                    clean_zipcode_expr(pl.col(f"{col}_postal_code")),
                     pl.col(f"{col}_address_norm").cast(pl.String).alias(col + "_address"),
                 )
                 .with_columns(pl.col(col + "_address").replace("", None))
+                .with_columns(id_col_expr(col + "_" + id_col) for id_col in ["address", "street", "street_name"])
             )
 
-            id_cols = ["address", "street", "street_name"]
-
-            # create id col
-            for id_col in id_cols:
-                name = col + "_" + id_col
-                df = create_id_col(df, name)
+            lf = lf.with_columns(pl.col(col).fill_null("").str.to_uppercase().alias(raw_address)).join(
+                addresses.lazy(), on=raw_address, how="left", maintain_order="left"
+            )
 
         # drop temp cols
-        df = df.drop(col + "_address")
-    return df
+        lf = lf.drop(col + "_address")
+
+    return lf.collect(engine="streaming" if cache["streaming"] else "auto")
 
 
-def create_id_col(df: pl.DataFrame, col: str) -> pl.DataFrame:
+def id_col_expr(col: str) -> pl.Expr:
     """
-    Adds an id column to the DataFrame using pl.Series.hash function
+    Expression of an id column for col, named col + "_id": the xxhash64 of
+    each value, which is stable across runs and versions, or null
 
-    Returns a pl.DataFrame
+    Returns a pl.Expr
     """
+    return pl.col(col).map_batches(xxhash64, return_dtype=pl.UInt64, is_elementwise=True).alias(col + "_id")
 
-    col_id = col + "_id"
 
-    df = df.with_columns(pl.col(col).hash().alias(col_id)).with_columns(
-        pl.when(pl.col(col).is_null()).then(None).otherwise(pl.col(col_id)).alias(col_id).cast(pl.UInt64),
-    )
+def row_hash_expr(cols: list[str]) -> pl.Expr:
+    """
+    Expression of the row_hash column: the xxhash64 of the values of cols in
+    each row, which changes when any of them does, so changed rows can be found
+    without comparing every column. Columns are hashed in name order as
+    strings, with nulls distinct from empty strings.
 
-    return df
+    Returns a pl.Expr
+    """
+    values = [pl.col(col).cast(pl.String).fill_null("\x00") for col in sorted(cols)]
 
+    return (
+        pl.concat_str(values, separator="\x1f")
+        .map_batches(xxhash64, return_dtype=pl.UInt64, is_elementwise=True)
+        .alias("row_hash")
+    )
 
-def update_entity_ids(df: pl.DataFrame, entity_id_col: str, db_conn: DuckDBPyConnection) -> None:
-    """
-    Adds new ids to the entity schema table. If the value is already in the table, it is not added.
 
-    Returns None
+def entity_id_source(entity_id_col: str) -> tuple[str, str]:
     """
+    Finds the entity table an id column belongs to (name, address, street or
+    street_name) and the column holding its entities.
 
+    Returns a tuple of the entity table name and entity column
+    """
     split_col = entity_id_col.split("_")
     if "_".join(split_col[-3:]) == "street_name_id":
         entity_table_name = "street_name"
@@ -171,91 +786,180 @@ def update_entity_ids(df: pl.DataFrame, entity_id_col: str, db_conn: DuckDBPyCon
         entity_col = entity_id_col.replace("_name_id", "")
         entity_table_name = "name"
 
-    if not check_table_exists(db_conn, "entity", entity_table_name):
-        # a check if entity tables doesnt exist, just creates it
-        query = f"""
-                CREATE SCHEMA IF NOT EXISTS entity;
-
-                CREATE TABLE entity.{entity_table_name} AS
-                    SELECT {entity_col} as entity,
-                           {entity_id_col} as {entity_table_name + "_id"}
-                    from  df
-                ;
-                """
+    return entity_table_name, entity_col
 
-    else:
-        # otherwise, add any new entities to the existing table
 
-        query = f"""
-                CREATE OR REPLACE TABLE entity.{entity_table_name} AS (
+def update_entity_ids(df: pl.DataFrame, entity_id_cols: list[str], db_conn: DuckDBPyConnection) -> None:
+    """
+    Adds the new entities in the id columns of df to the entity schema tables,
+    with a single insert per entity table covering all of its id columns.
+    Entities already in a table are skipped with an anti-join on the entity
+    and id, so existing rows are never rewritten. Null entities and ids are
+    added once, like any other value.
 
+    Raises a ValueError if an id of df is the hash of different values, in df
+    or in the entity table (see check_entity_id_collisions), before any entity
+    is added.
 
-                SELECT {entity_col} as entity,
-                       {entity_id_col} as {entity_table_name + "_id"}
-                from  df
+    Returns None
+    """
+    sources: dict[str, list[tuple[str, str]]] = {}
+    for entity_id_col in entity_id_cols:
+        entity_table_name, entity_col = entity_id_source(entity_id_col)
+        sources.setdefault(entity_table_name, []).append((entity_col, entity_id_col))
+
+    db_conn.execute("CREATE SCHEMA IF NOT EXISTS entity")
+    for entity_table_name, cols in sources.items():
+        id_col = entity_table_name + "_id"
+        new_entities = " UNION ALL ".join(
+            f"SELECT {entity_col} AS entity, {entity_id_col} AS id FROM df" for entity_col, entity_id_col in cols
+        )
+        db_conn.execute(f"CREATE TABLE IF NOT EXISTS entity.{entity_table_name} (entity VARCHAR, {id_col} UBIGINT)")
+        candidates = db_conn.execute(f"""
+            SELECT DISTINCT new.entity, new.id
+            FROM ({new_entities}) new
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM entity.{entity_table_name} e
+                WHERE e.{id_col} IS NOT DISTINCT FROM new.id
+                AND e.entity IS NOT DISTINCT FROM new.entity
+            )""").pl()
+        # checked before the insert, so a collision leaves the table unchanged
+        check_entity_id_collisions(db_conn, entity_table_name, candidates)
+        db_conn.execute(f"INSERT INTO entity.{entity_table_name} SELECT entity, id FROM candidates")
+        ids = pl.concat([df[entity_id_col] for _, entity_id_col in cols]).unique()
+        update_entity_keys(db_conn, entity_table_name, ids)
+
+
+def update_entity_keys(db_conn: DuckDBPyConnection, entity_table_name: str, ids: pl.Series) -> None:
+    """
+    Assigns dense INTEGER surrogate keys to the ids without one in the
+    dictionary table entity.{entity_table_name}_key. Keys are assigned once,
+    in id order, continuing from the largest key in the table, so keys run
+    from 1 to the number of ids.
 
-                UNION DISTINCT
+    Returns None
+    """
+    id_col = entity_table_name + "_id"
+    key_col = entity_table_name + "_key"
+    new_ids = ids.drop_nulls().to_frame("id")
+    db_conn.execute(f"CREATE TABLE IF NOT EXISTS entity.{key_col} ({id_col} UBIGINT, {key_col} INTEGER)")
+    db_conn.execute(f"""
+        INSERT INTO entity.{key_col}
+        SELECT new.id, (SELECT COALESCE(MAX({key_col}), 0) FROM entity.{key_col}) + ROW_NUMBER() OVER (ORDER BY new.id)
+        FROM new_ids new
+        ANTI JOIN entity.{key_col} k
+        ON k.{id_col} = new.id""")
+
+
+def add_entity_keys(df: pl.DataFrame, entity_id_cols: list[str], db_conn: DuckDBPyConnection) -> pl.DataFrame:
+    """
+    Adds the surrogate key of each id column of df from the entity key tables
+    (see update_entity_keys), as {entity_id_col} with _id replaced by _key.
 
-                select entity,
-                       {entity_table_name + "_id"}
-                from   entity.{entity_table_name}
-                )
-                """
-    db_conn.execute(query)
+    Returns a pl.DataFrame
+    """
+    sources: dict[str, list[str]] = {}
+    for entity_id_col in entity_id_cols:
+        entity_table_name, _ = entity_id_source(entity_id_col)
+        sources.setdefault(entity_table_name, []).append(entity_id_col)
+
+    for entity_table_name, cols in sources.items():
+        id_col = entity_table_name + "_id"
+        key_col = entity_table_name + "_key"
+        new_ids = pl.concat([df[entity_id_col] for entity_id_col in cols]).unique().to_frame("id")
+        keys = db_conn.execute(f"""
+            SELECT k.{id_col}, k.{key_col}
+            FROM entity.{key_col} k
+            SEMI JOIN new_ids new
+            ON k.{id_col} = new.id""").pl()
+        for entity_id_col in cols:
+            df = df.join(
+                keys.rename({id_col: entity_id_col, key_col: entity_id_col.removesuffix("_id") + "_key"}),
+                on=entity_id_col,
+                how="left",
+                maintain_order="left",
+            )
 
-    return None
+    return df
 
 
-def execute_bad_flag(db_conn: DuckDBPyConnection, table: str, col: str, bad_list: list) -> None:
+def check_entity_id_collisions(db_conn: DuckDBPyConnection, entity_table_name: str, candidates: pl.DataFrame) -> None:
     """
-    Flags rows with bad values as provided by user
+    Checks that adding the candidates, a pl.DataFrame of new entity and id
+    rows, to entity.{entity_table_name} won't give an id to entities with
+    different hashed values. Entity ids hash the entity itself, except address
+    ids, which hash the address_norm of the raw address entity, so only ids
+    shared by several rows of the candidates and the table are checked.
+
+    Raises a ValueError listing the entities of the first colliding id.
+
+    Returns None
     """
-    console.log(f"[yellow] Flagging bad values in {table} table for {col} column")
-    if bad_list:
-        bad_values_tuple = tuple(bad_list)
+    id_col = entity_table_name + "_id"
+    shared = db_conn.execute(f"""
+        WITH rows AS (
+            SELECT entity, id FROM candidates WHERE id IS NOT NULL
+            UNION ALL
+            SELECT e.entity, e.{id_col} AS id
+            FROM entity.{entity_table_name} e
+            SEMI JOIN candidates c
+            ON e.{id_col} = c.id
+        )
+        SELECT entity, id
+        FROM rows
+        QUALIFY COUNT(*) OVER (PARTITION BY id) > 1""").pl()
 
-        query = f"""
-                CREATE OR REPLACE TABLE {table} AS
-                SELECT *,
-                        CASE WHEN
-                            ({col} in {bad_values_tuple}) THEN 1
-                        ELSE 0 END as {col}_skip
-                from {table}
-                """
+    hashed = (
+        address_norm_expr(pl.col("entity").str.to_uppercase()) if entity_table_name == "address" else pl.col("entity")
+    )
+    collisions = (
+        shared.group_by("id")
+        .agg(pl.col("entity").sort(), hashed.n_unique().alias("hashed"))
+        .filter(pl.col("hashed") > 1)
+    )
+    if not collisions.is_empty():
+        collision = collisions.sort("id").row(0, named=True)
+        raise ValueError(
+            f"Id collision in entity.{entity_table_name}: {collision['entity']} all have id {collision['id']}"
+        )
 
-    else:
-        query = f"""
-            CREATE OR REPLACE TABLE {table} AS
-            SELECT *, 0 as {col}_skip
-            from {table}
-            """
-        console.log(f"[yellow] No bad values to flag in {table} table for {col} column")
 
-    db_conn.execute(query)
-    return None
+def bad_flag_expr(col: str, bad_values: pl.Series) -> pl.Expr:
+    """
+    Expression flagging rows with bad values as provided by user, named
+    col + "_skip": 1 if the value of col is in bad_values, otherwise 0.
+    Values are looked up in a hash set of bad_values.
+
+    Returns a pl.Expr
+    """
+    return pl.col(col).is_in(bad_values.implode()).fill_null(False).cast(pl.Int32).alias(col + "_skip")
 
 
-def validate_input_data(df: pl.DataFrame, table_config: dict) -> None:
+def validate_input_data(df: pl.DataFrame | pl.LazyFrame, table_config: dict) -> None:
     """
-    Validates input data against configuration requirements
+    Validates input data against configuration requirements. Accepts a LazyFrame
+    so that files loaded in batches can be checked without reading them into memory.
     """
-    required_columns = set()
-    required_columns.add(table_config["id_col_og"])
-    if table_config.get("name_cols_og"):
-        required_columns.update(table_config["name_cols_og"])
-    if table_config.get("address_cols_og"):
-        required_columns.update(table_config["address_cols_og"])
+    required_columns = set(get_linkage_cols(table_config))
 
-    missing_columns = required_columns - set(df.columns)
+    missing_columns = required_columns - set(df.collect_schema().names())
     if missing_columns:
         raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
 
+    null_counts = (
+        df.lazy()
+        .select(pl.len().alias("__n_rows"), *[pl.col(col).null_count() for col in required_columns])
+        .collect()
+        .row(0, named=True)
+    )
+    n_rows = null_counts.pop("__n_rows")
+
     # Check for empty dataframe
-    if df.is_empty():
+    if n_rows == 0:
         raise ValueError("Input data is empty")
 
     # Check for minimum required non-null values
-    for col in required_columns:
-        null_count = df.select(pl.col(col).is_null().sum()).item()
-        if null_count == len(df):
+    for col, null_count in null_counts.items():
+        if null_count == n_rows:
             raise ValueError(f"Column {col} contains all null values")
@@ -6,21 +6,36 @@ import duckdb
 import polars as pl
 import typer
 
+from chainlink.cleaning.rules import compile_rules
 from chainlink.link.link_generic import (
     create_across_links,
+    create_delta_links,
     create_tfidf_across_links,
     create_tfidf_within_links,
     create_within_links,
 )
-from chainlink.link.link_utils import generate_tfidf_links
+from chainlink.link.link_utils import drop_delta_ids, generate_tfidf_links, index_link_tables
 from chainlink.load.load_generic import load_generic
+from chainlink.load.load_utils import (
+    clean_cache_summary,
+    close_clean_cache,
+    copy_parse_cache,
+    evict_parse_cache,
+    init_parse_cache,
+    new_clean_cache,
+    store_address_trace,
+)
 from chainlink.utils import (
     console,
     create_config,
+    drop_schema,
     export_tables,
     load_config,
     logger,
+    read_manifest,
+    stage_fingerprints,
     update_config,
+    update_manifest,
 )
 
 # parent path
@@ -38,6 +53,11 @@ def chainlink(
         * load in any schemas in the config that are not already in the database
         * create within links for each new schema
         * create across links for each new schema with all existing schemas
+        * if delta_load is set, update the schemas already in the database and
+          recreate the links of their changed records
+        * if skip_unchanged is set, record the fingerprint of each stage's
+          inputs in a run manifest, and with overwrite_db only redo the stages
+          whose inputs changed since the last run
 
 
     Returns true if the database was created successfully.
@@ -49,6 +69,9 @@ def chainlink(
     name_match_score_threshold = config["options"].get("name_match_score_threshold", 0.8)
     address_match_score_threshold = config["options"].get("address_match_score_threshold", 0.5)
 
+    # compile the cleaning rules once for the whole run
+    cleaning_rules = compile_rules(config["options"].get("cleaning_rules"))
+
     no_names = True
     no_addresses = True
 
@@ -78,8 +101,23 @@ def chainlink(
 
     # handle options
     overwrite_db = config["options"].get("overwrite_db", False)
-    if overwrite_db and os.path.exists(db_path):
-        os.remove(db_path)
+    parse_cache = config["options"].get("parse_cache", False)
+
+    # with a manifest of the last run, overwriting only redoes what changed
+    skip_unchanged = config["options"].get("skip_unchanged", False)
+    manifest = read_manifest(db_path) if skip_unchanged and os.path.exists(db_path) else {}
+    memoize = overwrite_db and bool(manifest)
+
+    if overwrite_db and os.path.exists(db_path) and not memoize:
+        if parse_cache:
+            # keep the parse cache from the database being overwritten
+            old_db_path = f"{db_path}.old"
+            os.replace(db_path, old_db_path)
+            with duckdb.connect(database=db_path, read_only=False) as con:
+                copy_parse_cache(con, old_db_path, cleaning_rules)
+            os.remove(old_db_path)
+        else:
+            os.remove(db_path)
         console.print(f"[red] Removed existing database at {db_path}")
         logger.info(f"Removed existing database at {db_path}")
 
@@ -121,50 +159,176 @@ def chainlink(
 
     schemas = config["schemas"]
     new_schemas = []
+    delta_schemas = []
+    delta_load = config["options"].get("delta_load", False)
+
+    stages = stage_fingerprints(config, manifest, cleaning_rules["fingerprint"]) if skip_unchanged else {}
+
+    def unchanged(stage: str) -> bool:
+        return stage in manifest and manifest[stage]["fingerprint"] == stages[stage]["fingerprint"]
+
+    # tables of the delta schemas to load, all of them unless memoizing
+    delta_tables = {}
+    # relink every schema if the link options changed
+    relink_all = memoize and not unchanged("links")
 
     # load each schema. if schema is a new entity, create links
     for schema_config in schemas:
         schema_name = schema_config["schema_name"]
 
+        if memoize:
+            # reload schemas whose config changed, and delta load the tables whose file changed
+            in_db = df_db_columns.filter(pl.col("schema") == schema_name).shape[0] > 0
+            if not in_db or not unchanged(f"schema:{schema_name}"):
+                new_schemas.append(schema_name)
+                continue
+            changed_tables = [
+                table
+                for table in schema_config["tables"]
+                if not unchanged(f"table:{schema_name}.{table['table_name']}")
+            ]
+            if changed_tables:
+                delta_schemas.append(schema_name)
+                delta_tables[schema_name] = changed_tables
         # if not force create, check if each col exists, and skip if so
-        if not overwrite_db:
+        elif not overwrite_db:
             if df_db_columns.filter(pl.col("schema") == schema_name).shape[0] == 0:
                 new_schemas.append(schema_name)
+            elif delta_load:
+                delta_schemas.append(schema_name)
         else:
             new_schemas.append(schema_name)
 
-    # load in all new schemas
-    for new_schema in new_schemas:
-        schema_config = [schema for schema in schemas if schema["schema_name"] == new_schema][0]
+    if parse_cache:
+        with duckdb.connect(database=db_path, read_only=False) as con:
+            init_parse_cache(con, cleaning_rules)
+
+    if memoize:
+        # drop reloaded schemas and schemas no longer in the config, with their links
+        schema_names = [schema["schema_name"] for schema in schemas]
+        db_schemas = set(df_db_columns["schema"].to_list()) - {"entity", "link", "main"}
+        with duckdb.connect(database=db_path, read_only=False) as con:
+            for schema_name in new_schemas + sorted(db_schemas - set(schema_names)):
+                drop_schema(con, schema_name, schema_names)
+            if relink_all:
+                con.execute("DROP SCHEMA IF EXISTS link CASCADE")
+
+        # forget the stages being redone, in case the run stops before they are
+        update_manifest(
+            db_path,
+            {},
+            remove=[f"schema:{schema_name}" for schema_name in new_schemas]
+            + [
+                f"table:{schema_name}.{table['table_name']}"
+                for schema_name, tables in delta_tables.items()
+                for table in tables
+            ]
+            + (["links"] if relink_all else []),
+        )
+
+        console.log(
+            f"[yellow] Manifest -- {len(new_schemas)} schemas to load, {len(delta_schemas)} to update, "
+            f"{len(schemas) - len(new_schemas) - len(delta_schemas)} unchanged"
+        )
+        logger.info(
+            f"Manifest -- {len(new_schemas)} schemas to load, {len(delta_schemas)} to update, "
+            f"{len(schemas) - len(new_schemas) - len(delta_schemas)} unchanged"
+        )
+
+    # schemas to create all links of, every schema if the link options changed
+    link_schemas = new_schemas + [
+        schema["schema_name"] for schema in schemas if relink_all and schema["schema_name"] not in new_schemas
+    ]
+
+    # order source tables by their matching keys and index the record ids
+    cluster_tables = config["options"].get("cluster_tables", False)
+    index_ids = config["options"].get("index_ids", False)
+
+    # share cleaned names and addresses across every table loaded in this run
+    clean_cache = new_clean_cache(
+        reuse=config["options"].get("clean_cache", True),
+        persist=parse_cache,
+        workers=config["options"].get("clean_workers", 1),
+        chunk_size=config["options"].get("clean_chunk_size", 10_000),
+        in_db=config["options"].get("clean_in_db", False),
+        streaming=config["options"].get("clean_streaming", False),
+        rules=cleaning_rules,
+        trace_slowest=config["options"].get("clean_trace_slowest", 0),
+        time_budget=config["options"].get("clean_time_budget", None),
+    )
+
+    try:
+        # load in all new schemas
+        for new_schema in new_schemas:
+            schema_config = [schema for schema in schemas if schema["schema_name"] == new_schema][0]
+
+            with console.status(f"[bold yellow] Working on loading {new_schema}") as status:
+                # load schema
+                load_generic(
+                    db_path=db_path,
+                    schema_config=schema_config,
+                    bad_addresses=bad_addresses,
+                    bad_names=bad_names,
+                    clean_cache=clean_cache,
+                    cluster=cluster_tables,
+                    index=index_ids,
+                )
 
-        with console.status(f"[bold yellow] Working on loading {new_schema}") as status:
-            # load schema
-            load_generic(
-                db_path=db_path,
-                schema_config=schema_config,
-                bad_addresses=bad_addresses,
-                bad_names=bad_names,
-            )
+        # update the schemas already in the database with the rows that changed
+        for delta_schema in delta_schemas:
+            schema_config = [schema for schema in schemas if schema["schema_name"] == delta_schema][0]
+            if delta_schema in delta_tables:
+                schema_config = {**schema_config, "tables": delta_tables[delta_schema]}
 
-        if not load_only:
-            # create exact links
-            with console.status(f"[bold yellow] Working on linking {new_schema}") as status:
-                create_within_links(
+            with console.status(f"[bold yellow] Working on delta loading {delta_schema}") as status:
+                load_generic(
                     db_path=db_path,
                     schema_config=schema_config,
-                    link_exclusions=link_exclusions,
+                    bad_addresses=bad_addresses,
+                    bad_names=bad_names,
+                    clean_cache=clean_cache,
+                    cluster=cluster_tables,
+                    index=index_ids,
+                    delta=True,
                 )
 
+        if not load_only:
+            # create exact links
+            for link_schema in link_schemas:
+                schema_config = [schema for schema in schemas if schema["schema_name"] == link_schema][0]
+
+                with console.status(f"[bold yellow] Working on linking {link_schema}") as status:
+                    create_within_links(
+                        db_path=db_path,
+                        schema_config=schema_config,
+                        link_exclusions=link_exclusions,
+                    )
+    finally:
+        # shut down the address workers even if a load fails
+        close_clean_cache(clean_cache)
+
+    if new_schemas or delta_schemas:
+        console.log(f"[yellow] Cleaning cache -- {clean_cache_summary(clean_cache)}")
+        logger.info(f"Cleaning cache -- {clean_cache_summary(clean_cache)}")
+        if clean_cache["address_trace"]["slowest"] > 0:
+            with duckdb.connect(database=db_path, read_only=False) as con:
+                store_address_trace(con, clean_cache["address_trace"])
+
+    if parse_cache:
+        with duckdb.connect(database=db_path, read_only=False) as con:
+            evict_parse_cache(con, config["options"].get("parse_cache_max_rows", 10_000_000))
+
     if not load_only and probabilistic:
         #  generate all the fuzzy links and store in entity.name_similarity
-        # only if there are new schemas added
-        if len(new_schemas) > 0:
+        # only if there are new or changed schemas
+        if len(new_schemas) > 0 or len(delta_schemas) > 0 or relink_all:
             with console.status("[bold yellow] Working on fuzzy matching scores") as status:
                 if not no_names:
                     generate_tfidf_links(
                         db_path,
                         table_location="entity.name_similarity",
                         match_score_threshold=name_match_score_threshold,
+                        rules=cleaning_rules,
                     )
                 if not no_addresses:
                     generate_tfidf_links(
@@ -172,6 +336,7 @@ def chainlink(
                         table_location="entity.street_name_similarity",
                         source_table_name="entity.street_name",
                         match_score_threshold=address_match_score_threshold,
+                        rules=cleaning_rules,
                     )
 
         # for across link
@@ -179,7 +344,7 @@ def chainlink(
         created_schemas = []
 
         # create tfidf links within each new schema
-        for new_schema in new_schemas:
+        for new_schema in link_schemas:
             schema_config = [schema for schema in schemas if schema["schema_name"] == new_schema][0]
 
             if probabilistic:
@@ -198,7 +363,11 @@ def chainlink(
             # make sure we havent already created this link combo
             for schema in existing_schemas:
                 if sorted(new_schema + schema["schema_name"]) not in created_schemas:
-                    links.append((new_schema_config, schema))
+                    # when memoizing, link in config order, as a full rebuild would
+                    if memoize and schemas.index(schema) < schemas.index(new_schema_config):
+                        links.append((schema, new_schema_config))
+                    else:
+                        links.append((new_schema_config, schema))
                     created_schemas.append(sorted(new_schema + schema["schema_name"]))
 
         # across links for each new_schema, link across to all existing entities
@@ -224,6 +393,49 @@ def chainlink(
                         link_exclusions=link_exclusions,
                     )
 
+    # recreate the links of changed records, with every schema linked above.
+    # with load_only, the changed records are kept until the next run that links
+    if not load_only:
+        for delta_schema in delta_schemas:
+            if relink_all:
+                # every link was created again above
+                drop_delta_ids(db_path, delta_schema)
+                continue
+
+            schema_config = [schema for schema in schemas if schema["schema_name"] == delta_schema][0]
+            existing_schemas = [
+                schema
+                for schema in schemas
+                if schema["schema_name"] != delta_schema and schema["schema_name"] not in link_schemas
+            ]
+
+            with console.status(f"[bold yellow] Working on relinking {delta_schema}") as status:
+                create_delta_links(
+                    db_path=db_path,
+                    delta_schema=schema_config,
+                    existing_schemas=existing_schemas,
+                    link_exclusions=link_exclusions,
+                    probabilistic=probabilistic,
+                )
+
+    if index_ids and not load_only:
+        index_link_tables(db_path)
+
+    if skip_unchanged:
+        # record the stages done in this run. links are only current for every
+        # schema if the database was overwritten
+        done = [f"schema:{schema_name}" for schema_name in new_schemas]
+        done += [
+            f"table:{schema['schema_name']}.{table['table_name']}"
+            for schema in schemas
+            if schema["schema_name"] in new_schemas + delta_schemas
+            for table in delta_tables.get(schema["schema_name"], schema["tables"])
+        ]
+        if overwrite_db and not load_only:
+            done.append("links")
+        removed = ["links"] if load_only and (new_schemas or delta_schemas) else []
+        update_manifest(db_path, {stage: stages[stage] for stage in done}, remove=removed)
+
     update_config(db_path, config, config_path)
 
     export_tables_flag = config["options"].get("export_tables", False)
@@ -1,7 +1,11 @@
 import datetime
+import hashlib
+import json
 import logging
 import os
 import readline  # noqa: F401
+from functools import cache
+from importlib.metadata import version
 from pathlib import Path
 
 import duckdb
@@ -12,6 +16,9 @@ from duckdb import DuckDBPyConnection
 from rich.console import Console
 from rich.prompt import Confirm, Prompt
 
+from chainlink.cleaning.cleaning_functions import get_cleaning_version
+from chainlink.cleaning.rules import RULES_SCHEMA
+
 console = Console(color_system="auto")
 
 
@@ -62,6 +69,8 @@ def validate_config(config: dict) -> bool:
                 "required": ["db_path"],
                 "properties": {
                     "overwrite_db": {"type": "boolean"},
+                    "delta_load": {"type": "boolean"},
+                    "skip_unchanged": {"type": "boolean"},
                     "export_tables": {"type": "boolean"},
                     "update_config_only": {"type": "boolean"},
                     "link_exclusions": {"type": ["array", "null"]},  # or none
@@ -69,6 +78,18 @@ def validate_config(config: dict) -> bool:
                     "address_match_score_threshold": {"type": "number"},
                     "bad_address_path": {"type": "string"},  # or none
                     "bad_name_path": {"type": "string"},  # or none
+                    "clean_cache": {"type": "boolean"},
+                    "parse_cache": {"type": "boolean"},
+                    "parse_cache_max_rows": {"type": "integer", "minimum": 0},
+                    "clean_workers": {"type": "integer", "minimum": 1},
+                    "clean_chunk_size": {"type": "integer", "minimum": 1},
+                    "clean_in_db": {"type": "boolean"},
+                    "clean_streaming": {"type": "boolean"},
+                    "clean_trace_slowest": {"type": "integer", "minimum": 0},
+                    "clean_time_budget": {"type": "number", "exclusiveMinimum": 0},
+                    "cluster_tables": {"type": "boolean"},
+                    "index_ids": {"type": "boolean"},
+                    "cleaning_rules": RULES_SCHEMA,
                 },
             },
             "schemas": {
@@ -78,6 +99,7 @@ def validate_config(config: dict) -> bool:
                     "required": ["schema_name", "tables"],
                     "properties": {
                         "schema_name": {"type": "string"},
+                        "id_type": {"enum": ["auto", "string"]},
                         "tables": {
                             "type": "array",
                             "items": {
@@ -95,6 +117,8 @@ def validate_config(config: dict) -> bool:
                                         "type": ["array", "null"],
                                         "items": {"type": "string"},
                                     },
+                                    "batch_size": {"type": "integer", "minimum": 1},
+                                    "other_cols": {"enum": ["string", "typed", "drop"]},
                                 },
                             },
                         },
@@ -149,9 +173,20 @@ def update_config(db_path: str | Path, config: dict, config_path: str | Path) ->
         yaml.dump(config, f)
 
 
+def create_index(db_conn: DuckDBPyConnection, table: str, col: str) -> None:
+    """
+    Creates an index on col of table (schema.table), named {table}_{col}_idx,
+    which speeds up lookups of single values such as one record id.
+
+    Returns None
+    """
+    db_conn.execute(f"CREATE INDEX IF NOT EXISTS {table.split('.')[1]}_{col}_idx ON {table} ({col})")
+
+
 def export_tables(db_path: str | Path, data_path: str | Path) -> None:
     """
-    export all tables from database to parquet files in {data_path}/export directory
+    export all tables from database to parquet files in {data_path}/export directory,
+    keeping the types of the id columns
 
     Returns: None
     """
@@ -171,6 +206,13 @@ def export_tables(db_path: str | Path, data_path: str | Path) -> None:
     with duckdb.connect(db_path) as conn:
         df_db_columns = conn.sql("show all tables").pl()
 
+        # parse caches, traces, delta ids and the run manifest are internal and not exported
+        df_db_columns = df_db_columns.filter(
+            ~pl.col("name").str.ends_with("_parse_cache")
+            & ~pl.col("name").str.ends_with("_parse_trace")
+            & ~pl.col("name").is_in(["delta_ids", "run_manifest"])
+        )
+
         df_db_columns = df_db_columns.with_columns(
             schema_table=pl.col("schema") + "." + pl.col("name"),
             id_col=pl.struct(pl.all()).map_elements(lambda x: find_id_cols(x), return_dtype=pl.List(pl.String)),
@@ -187,7 +229,7 @@ def export_tables(db_path: str | Path, data_path: str | Path) -> None:
                 (select * from {link[0]}
                 order by {link[1][0]} ASC, {link[1][1]} ASC);
             """
-            d = conn.execute(links_query).pl().cast({link[1][0]: pl.String, link[1][1]: pl.String})
+            d = conn.execute(links_query).pl()
             d.write_parquet(f"{data_path}/{link[0].replace('.', '_')}.parquet")
 
         main_filter = (pl.col("schema") != "link") & (pl.col("name") != "name_similarity")
@@ -202,7 +244,7 @@ def export_tables(db_path: str | Path, data_path: str | Path) -> None:
                 (select * from {table}
                 order by {id_cols[0]} ASC);
             """
-            d = conn.execute(sql_to_exec).pl().cast({id_cols[0]: pl.String})
+            d = conn.execute(sql_to_exec).pl()
             d.write_parquet(f"{data_path}/{table.replace('.', '_')}.parquet")
 
     print("Exported all tables!")
@@ -226,6 +268,166 @@ def check_table_exists(db_conn: DuckDBPyConnection, schema: str, table_name: str
     return db_conn.fetchone()[0] == 1
 
 
+def drop_schema(db_conn: DuckDBPyConnection, schema: str, schemas: list[str]) -> None:
+    """
+    Drops schema and its link tables with itself and each of schemas, such as
+    a schema that is loaded again.
+
+    Returns None
+    """
+    db_conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    for other in dict.fromkeys([schema, *schemas]):
+        for link_table in dict.fromkeys([f"{schema}_{other}", f"{other}_{schema}"]):
+            if check_table_exists(db_conn, "link", link_table):
+                db_conn.execute(f"DROP TABLE link.{link_table}")
+
+
+@cache
+def get_code_version(rules_fingerprint: str = "") -> str:
+    """
+    Fingerprint of the chainlink code, the cleaning code, libraries and rules
+    (see get_cleaning_version), and the versions of DuckDB and Polars. Changes
+    whenever anything that produces the database does.
+
+    Returns a short hex digest
+    """
+    fingerprint = hashlib.sha256(get_cleaning_version(rules_fingerprint).encode())
+    for package in ["duckdb", "polars"]:
+        fingerprint.update(f"{package}=={version(package)}".encode())
+    for source in sorted(Path(__file__).parent.rglob("*.py")):
+        fingerprint.update(source.read_bytes())
+
+    return fingerprint.hexdigest()[:16]
+
+
+def fingerprint(value: object) -> str:
+    """
+    Fingerprint of a value that can be written as JSON, such as part of a
+    config, regardless of the order of its keys.
+
+    Returns a short hex digest
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def file_fingerprint(file_path: str | Path, previous: dict | None = None) -> dict:
+    """
+    Fingerprint of the content of a file. If the size and modification time of
+    the file are those recorded in previous, its entry in the manifest of an
+    earlier run, the file is not read again and previous is returned.
+
+    Returns a dict of the fingerprint, size and mtime of the file, with a None
+    fingerprint if it doesn't exist
+    """
+    if not os.path.exists(file_path):
+        return {"fingerprint": None, "size": None, "mtime": None}
+
+    stat = os.stat(file_path)
+    if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns:
+        return previous
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return {"fingerprint": digest.hexdigest()[:16], "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def stage_fingerprints(config: dict, manifest: dict, rules_fingerprint: str = "") -> dict:
+    """
+    Fingerprints the inputs of each stage of a run, to compare with the run
+    manifest of an earlier run (see read_manifest):
+        * schema:{schema}: the schema config, except file paths and batch sizes,
+          the options used to load it, and the code version
+        * table:{schema}.{table}: the content of the table's file
+        * links: the options used to link and the code version
+
+    Returns a dict of each stage's manifest entry
+    """
+    options = config["options"]
+    code_version = get_code_version(rules_fingerprint)
+
+    bad_values = {
+        option: file_fingerprint(options[option])["fingerprint"]
+        for option in ["bad_address_path", "bad_name_path"]
+        if options.get(option)
+    }
+    load_options = {option: options.get(option) for option in ["cleaning_rules", "cluster_tables", "index_ids"]}
+
+    stages = {}
+    for schema in config["schemas"]:
+        schema_name = schema["schema_name"]
+        tables = [
+            {key: value for key, value in table.items() if key not in ["table_name_path", "batch_size"]}
+            for table in schema["tables"]
+        ]
+        stages[f"schema:{schema_name}"] = {
+            "fingerprint": fingerprint([{**schema, "tables": tables}, load_options, bad_values, code_version]),
+            "size": None,
+            "mtime": None,
+        }
+        for table in schema["tables"]:
+            stage = f"table:{schema_name}.{table['table_name']}"
+            stages[stage] = file_fingerprint(table["table_name_path"], manifest.get(stage))
+
+    link_options = {
+        option: options.get(option)
+        for option in [
+            "probabilistic",
+            "link_exclusions",
+            "name_match_score_threshold",
+            "address_match_score_threshold",
+        ]
+    }
+    stages["links"] = {"fingerprint": fingerprint([link_options, code_version]), "size": None, "mtime": None}
+
+    return stages
+
+
+def read_manifest(db_path: str | Path) -> dict:
+    """
+    Reads the run manifest, entity.run_manifest, which records the fingerprint
+    of the inputs of each stage of the runs that built the database.
+
+    Returns a dict of each stage's fingerprint, size and mtime, empty if there
+    is no manifest
+    """
+    with duckdb.connect(db_path) as conn:
+        if not check_table_exists(conn, "entity", "run_manifest"):
+            return {}
+        rows = conn.execute("SELECT stage, fingerprint, size, mtime FROM entity.run_manifest").fetchall()
+
+    return {stage: {"fingerprint": fp, "size": size, "mtime": mtime} for stage, fp, size, mtime in rows}
+
+
+def update_manifest(db_path: str | Path, stages: dict, remove: list | None = None) -> None:
+    """
+    Records stages, a dict of manifest entries (see stage_fingerprints), in the
+    run manifest, replacing their earlier entries, and removes the entries of
+    the stages in remove.
+
+    Returns None
+    """
+    remove = list(stages) + (remove or [])
+    with duckdb.connect(db_path) as conn:
+        conn.execute("CREATE SCHEMA IF NOT EXISTS entity")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entity.run_manifest (
+                stage VARCHAR,
+                fingerprint VARCHAR,
+                size BIGINT,
+                mtime BIGINT,
+                updated TIMESTAMP
+            )""")
+        conn.execute("DELETE FROM entity.run_manifest WHERE list_contains(?, stage)", [remove])
+        if stages:
+            conn.executemany(
+                "INSERT INTO entity.run_manifest VALUES (?, ?, ?, ?, current_timestamp)",
+                [[stage, entry["fingerprint"], entry["size"], entry["mtime"]] for stage, entry in stages.items()],
+            )
+
+
 def create_config() -> dict:
     """
     Helper to create config file from user input if not pre created
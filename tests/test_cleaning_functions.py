@@ -1,10 +1,54 @@
+import time
+from collections import Counter
+
+import duckdb
+import polars as pl
+import pytest
+import usaddress
+from polars.testing import assert_frame_equal, assert_series_equal
+
+import chainlink.cleaning.cleaning_functions as cleaning_functions
 from chainlink.cleaning.cleaning_functions import (
+    ADDRESS_STRUCT,
+    address_latency_percentiles,
+    address_norm_expr,
+    backfill_city_state,
     clean_address,
+    clean_address_batch_parser,
     clean_names,
+    clean_names_batch,
+    clean_names_expr,
     clean_zipcode,
+    clean_zipcode_expr,
     identify_state_city,
+    load_zip_table,
+    new_address_trace,
+    normalize_address,
+    normalize_address_expr,
+    normalize_address_scourgify,
+    parse_address,
+    parse_address_fast,
+    parse_address_full,
+    parse_addresses,
     predict_org,
+    predict_org_expr,
+    register_cleaning_macros,
+    tag_address_batch,
+    tag_addresses,
+    tag_addresses_in_pool,
 )
+from chainlink.cleaning.rules import compile_rules
+from chainlink.link.tfidf_utils import adjust_and_replace, adjust_and_replace_expr
+from chainlink.load.load_utils import (
+    clean_unique,
+    evict_parse_cache,
+    init_parse_cache,
+    new_clean_cache,
+)
+
+
+def clean_backfilled(raw: str) -> dict:
+    return backfill_city_state(pl.Series([clean_address(raw)], dtype=ADDRESS_STRUCT))[0]
 
 
 ############################## test functions
@@ -18,12 +62,40 @@ def test_predict_org():
     assert predict_org("D & L HALFMAN INC.") == 1
 
 
+def test_predict_org_expr():
+    names = [
+        "OLIMP FLOORING INC.",
+        "718 MULFORD AVENUE CONDOMINIUM ASSOCIATION",
+        "TAXPAYER OF",
+        "Joe DiMaggio",
+        "ELLI D COSKY TRUST",
+        "D & L HALFMAN",
+        "D & L HALFMAN INC.",
+        "GX PROPERTY OWNER LLC",
+        "CURRENT OWNER",
+        "ACME CO-OP",
+        "ACME CO.",
+        "ACME, LLC",
+        "INCA SMITH",
+        "JOHN SMITHINC",
+        "ANNA COLE",
+        "LOT 0-1",
+        "",
+    ]
+    is_org = pl.DataFrame({"name": names}).select(predict_org_expr(pl.col("name")))["name"]
+
+    assert is_org.to_list() == [bool(predict_org(name)) for name in names]
+
+
 def test_clean_zipcode():
     assert clean_zipcode(0) == "0"
     assert clean_zipcode("") == ""
     assert clean_zipcode(123456789) == "12345"
     assert clean_zipcode("abcdefghijk") == "abcde"
 
+    zipcodes = pl.DataFrame({"zip": ["", "606151234", "abcdefghijk", None]})
+    assert zipcodes.select(clean_zipcode_expr(pl.col("zip")))["zip"].to_list() == ["", "60615", "abcde", None]
+
 
 def test_identify_state_city_int_input():
     assert identify_state_city(60615) == ("CHICAGO", "IL")
@@ -39,6 +111,24 @@ def test_identify_state_city_str_input():
     assert identify_state_city("123xyz") == (None, None)
 
 
+def test_backfill_city_state():
+    addresses = pl.Series(
+        "address",
+        [
+            "123 E HYDE PARK BLVD APT 15 CHICAGO IL 60615",
+            "123 MAIN ST SPRINGFIELD XX 80126-1234",
+            "123 MAIN ST SPRINGFIELD XX 00000",
+            "",
+        ],
+    ).map_elements(clean_address, return_dtype=ADDRESS_STRUCT)
+    backfilled = backfill_city_state(addresses)
+
+    assert backfilled.name == "address"
+    assert backfilled.dtype == ADDRESS_STRUCT
+    assert backfilled.struct.field("city").to_list() == ["CHICAGO", "LITTLETON", "SPRINGFIELD", None]
+    assert backfilled.struct.field("state").to_list() == ["IL", "CO", "XX", None]
+
+
 def test_identify_state_city_invalid_input():
     assert identify_state_city(1.5) == (None, None)
     assert identify_state_city(-1) == (None, None)
@@ -84,8 +174,16 @@ def test_clean_address_empty():
     }
 
 
+def test_load_zip_table():
+    zips = load_zip_table()
+    assert zips.schema == pl.Schema({"zipcode": pl.String, "city": pl.String, "state": pl.String})
+    assert zips.height == 42_789
+    assert zips["zipcode"].is_unique().all()
+    assert zips["zipcode"].str.contains(r"^\d{5}$").all()
+
+
 def test_clean_address_zipcode_mismatch():
-    assert clean_address("123 E Hyde Park Blvd #15 Whoeville, Grinchtown 60615") == {
+    assert clean_backfilled("123 E Hyde Park Blvd #15 Whoeville, Grinchtown 60615") == {
         "raw": "123 E Hyde Park Blvd #15 Whoeville, Grinchtown 60615",
         "street": "123 E HYDE PARK BLVD",
         "address_number": "123",
@@ -120,7 +218,7 @@ def test_clean_address_zipcode_mismatch():
 
 
 def test_clean_address_missing_parts():
-    assert clean_address("123 E Hyde Park Blvd # 15 Whoeville, Grinchtown 60615") == {
+    assert clean_backfilled("123 E Hyde Park Blvd # 15 Whoeville, Grinchtown 60615") == {
         "raw": "123 E Hyde Park Blvd # 15 Whoeville, Grinchtown 60615",
         "street": "123 E HYDE PARK BLVD",
         "address_number": "123",
@@ -272,3 +370,434 @@ def test_clean_names_spaces():
 
 def test_clean_names_irregular():
     assert clean_names("CIESLIK RYSZARD2112245") == "CIESLIK RYSZARD2112245"
+
+
+def test_parse_address_fast():
+    assert parse_address_fast("1234 N MAIN ST APT 5 CHICAGO IL 60601") == {
+        "AddressNumber": "1234",
+        "StreetNamePreDirectional": "N",
+        "StreetName": "MAIN",
+        "StreetNamePostType": "ST",
+        "OccupancyType": "APT",
+        "OccupancyIdentifier": "5",
+        "PlaceName": "CHICAGO",
+        "StateName": "IL",
+        "ZipCode": "60601",
+    }
+    # ambiguous street names, cities, street types and non-street addresses fall back
+    assert parse_address_fast("123 E HYDE PARK BLVD APT 15 CHICAGO IL 60615") is None
+    assert parse_address_fast("123 MAIN ST LA GRANGE IL 60525") is None
+    assert parse_address_fast("123 MAPLE RUN CHICAGO IL 60601") is None
+    assert parse_address_fast("123 MAIN STREET CHICAGO IL 60601") is None
+    assert parse_address_fast("POB 362 CLAY CITY IL 62824") is None
+    assert parse_address_fast("123 MAIN ST CHICAGO XX 60601") is None
+
+
+def test_parse_address_tiers():
+    addresses = [
+        "1234 N MAIN ST APT 5 CHICAGO IL 60601",
+        "8041 SAYRE AVE BURBANK IL 60459",
+        "565 MAIN AVE CHICAGO IL 60601-1234",
+        "123 N MICHIGAN AVE CHICAGO IL 60611",
+        "100 W 55TH PL UNIT 2B EVANSTON IL 60202",
+        "9 S ELM CT STE 100 NEW LENOX IL 60451",
+        "77 CEDAR LN OAK LAWN IL 60453",
+    ]
+    for address in addresses:
+        assert parse_address_fast(address) == parse_address_full(address)
+
+    tiers = Counter()
+    parse_addresses(pl.Series(["8041 SAYRE AVE BURBANK IL 60459", "POB 362 CLAY CITY IL 62824", None]), tiers)
+    assert tiers == {"fast": 1, "full": 1}
+
+
+def test_tag_address_batch():
+    addresses = [
+        "123 E HYDE PARK BLVD APT 15 CHICAGO IL 60615",
+        "POB 362 CLAY CITY IL 62824",
+        "123 MAIN ST 456 OAK AVE CHICAGO IL",
+        "MAIN ST AND OAK AVE CHICAGO IL",
+        "1 2 3 MAIN ST",
+        "X",
+        "",
+    ]
+    batch = tag_address_batch(addresses)
+    assert len(batch) == len(addresses)
+    for address, tags in zip(addresses, batch):
+        assert tags == dict(usaddress.tag(address)[0])
+
+    # repeated labels keep the last value of each parsed field
+    repeated = "123 MAIN ST CHICAGO IL 60601 APT 5 CHICAGO"
+    with pytest.raises(usaddress.RepeatedLabelError):
+        usaddress.tag(repeated)
+    assert tag_address_batch([repeated]) == [
+        {
+            "AddressNumber": "123",
+            "StreetName": "MAIN",
+            "StreetNamePostType": "ST",
+            "PlaceName": "CHICAGO",
+            "StateName": "IL",
+            "ZipCode": "60601",
+            "OccupancyType": "APT",
+            "OccupancyIdentifier": "5",
+        }
+    ]
+    assert parse_address_full(repeated) == tag_address_batch([repeated])[0]
+
+
+def test_tag_address_matches_usaddress():
+    # the raw addresses of the cleaning and load fixtures
+    raw = [
+        "123 E Hyde Park Blvd Apt. 15 Chicago, IL 60615",
+        "123 E Hyde Park Blvd #15 Chicago, IL 12345",
+        "123 E Hyde Park Blvd # 15",
+        "CHICAGO, IL 60615",
+        "POB 362 CLAY CITY IL 62824",
+        "US STEEL TWR 600 GRANT 44TH FL PITTSBURGH PA 15219",
+        "1 WESTBROOK CORPORATE CENTER, SUITE #300 WESTCHESTER IL 60154",
+        "2851 JOHN STREET, SUITE ONE MARKHAM, ONTARIO AO L3R 5",
+        "645 LEAMINGTON, WILMETTE, IL 60091",
+        "8041 SAYRE AVE, BURBANK, IL 60459",
+        "1212 S NAPER BLVD 119, NAPERVILLE, IL 60540",
+        "1319 E 89TH ST, CHICAGO, IL 60619",
+        "100 MAPLE ROAD, AURORA, IL 60506",
+        "123 LAKE SHORE DR, CHICAGO, IL 60611",
+        "565 MAIN ST, CHICAGO, IL 60601",
+        "742 MAPLE ST, SKOKIE, IL 60077",
+    ]
+    normalized = [normalize_address(address) for address in raw]
+    # tag_address is given both the raw and the scourgify normalized addresses
+    addresses = normalized + [normalize_address_scourgify(address) for address in normalized]
+
+    for address, tags in zip(addresses, tag_address_batch(addresses)):
+        try:
+            expected = dict(usaddress.tag(address)[0])
+        except usaddress.RepeatedLabelError:
+            expected = {label: token for token, label in usaddress.parse(address) if label in tags}
+        assert tags == expected, address
+
+
+def test_address_trace(monkeypatch):
+    addresses = pl.Series(["1234 N MAIN ST APT 5 CHICAGO IL 60601", "POB 362 CLAY CITY IL 62824", None])
+    expected = parse_addresses(addresses)
+
+    trace = new_address_trace(slowest=1)
+    assert_series_equal(parse_addresses(addresses, trace=trace), expected)
+    assert trace["latencies"].total() == 2
+    p50, p100 = address_latency_percentiles(trace, [50, 100])
+    assert 0 < p50 <= p100
+    ((seconds, address, timed_out),) = trace["records"]
+    assert p100 / 1.1 <= seconds <= p100
+    assert address in addresses and not timed_out
+
+    # an ambiguous address over the budget is left untagged
+    def slow_scourgify(address: str) -> str:
+        time.sleep(0.1)
+        return address
+
+    monkeypatch.setattr(cleaning_functions, "normalize_address_scourgify", slow_scourgify)
+    tiers = Counter()
+    trace = new_address_trace(slowest=1)
+    untagged = parse_addresses(addresses, tiers, trace, budget=0.05)
+    assert untagged[0] == expected[0]
+    assert untagged[1] == dict.fromkeys(ADDRESS_STRUCT.to_schema())
+    assert tiers["timeout"] == 1
+    assert trace["timed_out"] == ["POB 362 CLAY CITY IL 62824"]
+    assert trace["records"][0][1:] == ("POB 362 CLAY CITY IL 62824", True)
+
+    # without a budget, the slow address is tagged
+    assert parse_addresses(addresses, trace=new_address_trace())[1] == expected[1]
+
+
+def test_normalize_address_expr():
+    raws = [
+        "123 E Hyde Park Blvd Apt. 15 Chicago, IL 60615",
+        "  8041 SAYRE AVE,, BURBANK.IL 60459 ",
+        "123 MAIN ST #5",
+        "#",
+        "  ",
+        ",.,",
+        "A\x1c\x1cB\u3000C\t#\n1",
+        "ÀBC 12 ÑO",
+    ]
+    df = pl.DataFrame({"raw": raws}).select(
+        normalize_address_expr(pl.col("raw")).alias("normalized"),
+        address_norm_expr(pl.col("raw")).alias("address_norm"),
+    )
+
+    assert df["normalized"].to_list() == [normalize_address(raw) for raw in raws]
+    assert df["address_norm"].to_list() == [clean_address(raw)["address_norm"] for raw in raws]
+    for raw, normalized in zip(raws, df["normalized"]):
+        record = clean_address(raw)
+        assert parse_address(normalized) == {**record, "raw": None, "address_norm": None}
+
+
+def test_clean_names_batch():
+    names = [
+        "Joe DiMaggio",
+        "VACANT",
+        "MERGED",
+        "SAME AS ABOVE",
+        "TAX PAYER",
+        "None",
+        "J. TRAVIS DOWELL",
+        "DR. HORTON, INC-MIDWES",
+        "Mr. & Mrs. J. Schuman",
+        "CRAFTN' WIT FASHN' L.L.C.",
+        "M&M ROMEOVILLE, LLC",
+        "TOM'S QUALITY AUTO REPAIR, INC.",
+        "US BUILDERS  SERIES 15",
+        "US BUILDERS   SERIES 15",
+        "US BUILDERS    SERIES 15",
+        "US BUILDERS SERIES 15",
+        " ",
+        "  ",
+        "   ",
+        "",
+        "CIESLIK RYSZARD2112245",
+        "JOE @ HOME—STRAßE",
+        "TAB\tSEPARATED\x1c\x1cNAME",
+    ]
+    batch = clean_names_batch(pl.Series("name", names))
+
+    assert batch.name == "name"
+    assert batch.to_list() == [clean_names(name) for name in names]
+
+
+def test_cleaning_macros():
+    raws = pl.Series(
+        "raw",
+        [
+            "Smith & Sons, Inc.",
+            "GX PROPERTY OWNER LLC",
+            "ßtraße INCé",
+            "INCß",
+            "ﬁsh@home — 2nd",
+            "none of the above",
+            "VACANT",
+            "  123 N. Main St., #5\x1c ",
+            "#",
+            "\u3000",
+            "",
+            None,
+        ],
+    )
+    expected = raws.to_frame().select(
+        clean_names_expr(pl.col("raw")).alias("clean_name"),
+        predict_org_expr(pl.col("raw")).alias("predict_org"),
+        normalize_address_expr(pl.col("raw")).alias("normalize_address"),
+        address_norm_expr(pl.col("raw")).alias("address_norm"),
+        clean_zipcode_expr(pl.col("raw")).alias("clean_zipcode"),
+    )
+
+    db_conn = duckdb.connect()
+    register_cleaning_macros(db_conn)
+    to_clean = raws.to_frame()
+    cleaned = db_conn.execute(f"SELECT {', '.join(f'{c}(raw) AS {c}' for c in expected.columns)} FROM to_clean").pl()
+
+    assert_frame_equal(cleaned, expected)
+
+
+def test_cleaning_rules():
+    rules = compile_rules({
+        "name": {
+            "exclusions": ["ESTATE OF"],
+            "substitutions": {"+": "PLUS"},
+            "drop_tokens": ["the"],
+            "synonyms": {"ST": ["SAINT"]},
+        },
+        "organization": {"patterns": [r"\bCHURCH\b"]},
+        "similarity": {"synonyms": {"CH": ["CHURCH"]}},
+    })
+    names = pl.Series("raw", ["The Saint Paul Church", "ESTATE OF J SMITH", "A+B & Co.", "THE", "J. Smith", None])
+
+    cleaned = names.to_frame().select(
+        clean_names_expr(pl.col("raw"), rules).alias("clean_name"),
+        predict_org_expr(pl.col("raw"), rules).alias("predict_org"),
+    )
+    assert cleaned["clean_name"].to_list() == ["ST PAUL CHURCH", None, "APLUSB AND CO", None, "J SMITH", None]
+    assert cleaned["predict_org"].to_list() == [True, True, True, False, False, None]
+
+    # the built-in rules are unchanged
+    assert clean_names_batch(names).to_list() == [clean_names(name) if name else None for name in names]
+
+    db_conn = duckdb.connect()
+    register_cleaning_macros(db_conn, rules)
+    to_clean = names.to_frame()
+    assert_frame_equal(
+        db_conn.execute("SELECT clean_name(raw) AS clean_name, predict_org(raw) AS predict_org FROM to_clean").pl(),
+        cleaned,
+    )
+
+    entities = pl.Series("entity", ["FIRST CHURCH LLC", "ST. MARY-S CHURCH", "  PROPERTY  MGMT CO "])
+    adjusted = entities.to_frame().select(adjust_and_replace_expr(pl.col("entity"), rules)).to_series()
+    assert adjusted.to_list() == ["FIRSTCH", "STMARYSCH", "PROPMGMT"]
+    assert adjusted.to_list() == [adjust_and_replace(entity, rules) for entity in entities]
+
+    with pytest.raises(ValueError):
+        compile_rules({"name": {"substitutions": {"": "A"}}})
+    with pytest.raises(ValueError):
+        compile_rules({"organization": {"patterns": ["(?<=X)Y"]}})
+
+
+def test_overlapping_substitutions():
+    rules = compile_rules({
+        "name": {"substitutions": {"CO.": "COMPANY", "CORP.": "CORPORATION", "T.": "TRUST", "ST.": "SAINT", "AND": "N"}}
+    })
+    assert list(rules["substitutions"])[:2] == ["CORP.", "CO."]
+
+    names = pl.Series("raw", ["ACME CORP.", "ACME CO.", "ST. JUDE T.", "A & B CO.CORP.", "", None])
+    cleaned = names.to_frame().select(clean_names_expr(pl.col("raw"), rules).alias("clean_name"))
+    # the longest substitution wins, and replacements aren't substituted again
+    assert cleaned["clean_name"].to_list() == [
+        "ACME CORPORATION",
+        "ACME COMPANY",
+        "SAINT JUDE TRUST",
+        "A AND B COMPANYCORPORATION",
+        None,
+        None,
+    ]
+
+    db_conn = duckdb.connect()
+    register_cleaning_macros(db_conn, rules)
+    to_clean = names.to_frame()
+    assert_frame_equal(db_conn.execute("SELECT clean_name(raw) AS clean_name FROM to_clean").pl(), cleaned)
+
+
+def slow_parser(address: str) -> dict:
+    if address.startswith("SLOW"):
+        time.sleep(60)
+    return parse_address_full(address)
+
+
+def test_tag_addresses_in_pool():
+    fast = ["POB 362 CLAY CITY IL 62824", "123 MAIN ST 456 OAK AVE CHICAGO IL"]
+    pool = {"executor": None, "workers": 2}
+    try:
+        assert [tags for tags, _ in tag_addresses_in_pool(fast, pool, 1.0, slow_parser)] == [
+            parse_address_full(address) for address in fast
+        ]
+        hung = pool["executor"]
+        processes = list(hung._processes.values())
+
+        # the batch finishes within the budget, without the hung address
+        start = time.perf_counter()
+        results = tag_addresses_in_pool([fast[0], "SLOW 1 MAIN ST"], pool, 1.0, slow_parser)
+        assert time.perf_counter() - start < 1.5
+        assert results[0][0] == parse_address_full(fast[0])
+        assert results[1] == (None, 1.0)
+
+        # the pool with the hung worker is recycled
+        assert pool["executor"] is None
+        for process in processes:
+            process.join(5)
+            assert not process.is_alive()
+        assert [tags for tags, _ in tag_addresses_in_pool(fast, pool, 1.0, slow_parser)] == [
+            parse_address_full(address) for address in fast
+        ]
+        assert pool["executor"] is not hung
+    finally:
+        if pool["executor"] is not None:
+            pool["executor"].shutdown()
+
+
+def test_tag_addresses_oversized(monkeypatch):
+    oversized = " ".join(["123 MAIN ST"] * 11) + " CHICAGO IL"
+    addresses = ["1234 N MAIN ST APT 5 CHICAGO IL 60601", oversized]
+
+    def no_full_parser(address: str) -> str:
+        raise AssertionError(address)
+
+    monkeypatch.setattr(cleaning_functions, "normalize_address_scourgify", no_full_parser)
+    tiers, trace = Counter(), new_address_trace()
+    columns = tag_addresses(addresses, tiers, trace, budget=1.0)
+
+    assert columns["address_number"] == ["1234", None]
+    assert tiers == Counter({"fast": 1, "oversized": 1, "full": 0})
+    assert trace["timed_out"] == [oversized]
+
+
+def test_clean_address_batch_parser():
+    addresses = pl.Series(
+        "address",
+        [
+            "123 E HYDE PARK BLVD APT 15 CHICAGO IL 60615",
+            "",
+            "POB 362 CLAY CITY IL 62824",
+            "2851 JOHN STREET, SUITE ONE MARKHAM, ONTARIO AO L3R 5",
+            "8041 SAYRE AVE, BURBANK, IL 60459",
+        ],
+    )
+    parallel = clean_address_batch_parser(addresses, n_workers=2, chunk_size=2)
+    serial = addresses.map_elements(clean_address, return_dtype=ADDRESS_STRUCT)
+
+    assert parallel.dtype == serial.dtype
+    assert parallel.to_list() == serial.to_list()
+
+    normalized = addresses.to_frame().select(normalize_address_expr(pl.col("address"))).to_series()
+    tiers, serial_tiers = Counter(), Counter()
+    trace = new_address_trace(slowest=2)
+    parsed = clean_address_batch_parser(
+        normalized, n_workers=2, chunk_size=2, normalized=True, tiers=tiers, trace=trace, budget=10
+    )
+    assert parsed.to_list() == parse_addresses(normalized, serial_tiers).to_list()
+    assert tiers == serial_tiers
+    assert tiers.total() == 4
+    assert trace["latencies"].total() == 4
+    assert len(trace["records"]) == 2
+
+    empty = clean_address_batch_parser(addresses.clear(), n_workers=2)
+    assert empty.dtype == ADDRESS_STRUCT
+    assert empty.is_empty()
+
+
+def test_clean_unique():
+    calls = []
+
+    def clean_and_count(raw: str) -> str | None:
+        calls.append(raw)
+        return clean_names(raw)
+
+    cache = new_clean_cache()
+    names = pl.Series(["CITY OF CHICAGO", "J. SMITH", "CITY OF CHICAGO", "VACANT", "J. SMITH"])
+    cleaned = clean_unique(names, clean_and_count, pl.String, cache, "name")
+    assert cleaned.to_list() == ["CITY OF CHICAGO", "J SMITH", "CITY OF CHICAGO", None, "J SMITH"]
+    assert sorted(calls) == ["CITY OF CHICAGO", "J. SMITH", "VACANT"]
+
+    # values cleaned for an earlier column are not cleaned again
+    cleaned = clean_unique(pl.Series(["J. SMITH", "ACME LLC"]), clean_and_count, pl.String, cache, "name")
+    assert cleaned.to_list() == ["J SMITH", "ACME LLC"]
+    assert len(calls) == 4
+    assert cache["stats"]["name"] == {"values": 7, "unique": 5, "stored": 0, "cleaned": 4}
+
+
+def test_parse_cache():
+    calls = []
+
+    def clean_and_count(raw: str) -> dict:
+        calls.append(raw)
+        return clean_address(raw)
+
+    addresses = pl.Series(["123 E HYDE PARK BLVD", "POB 362 CLAY CITY IL 62824", "123 E HYDE PARK BLVD"])
+
+    with duckdb.connect() as db_conn:
+        init_parse_cache(db_conn)
+        cache = new_clean_cache(persist=True)
+        first = clean_unique(addresses, clean_and_count, ADDRESS_STRUCT, cache, "address", db_conn)
+        assert len(calls) == 2
+
+        # a new run finds both addresses in the parse cache
+        cache = new_clean_cache(persist=True)
+        second = clean_unique(addresses, clean_and_count, ADDRESS_STRUCT, cache, "address", db_conn)
+        assert len(calls) == 2
+        assert cache["stats"]["address"]["stored"] == 2
+        assert second.to_list() == first.to_list()
+
+        # least recently used entries are evicted beyond the size cap
+        evict_parse_cache(db_conn, max_rows=1)
+        assert db_conn.execute("SELECT COUNT(*) FROM entity.address_parse_cache").fetchone()[0] == 1
+
+        # entries from other versions of the cleaning code are invalidated
+        db_conn.execute("UPDATE entity.address_parse_cache SET version = 'old'")
+        init_parse_cache(db_conn)
+        assert db_conn.execute("SELECT COUNT(*) FROM entity.address_parse_cache").fetchone()[0] == 0
@@ -1,10 +1,22 @@
 import os
+import shutil
+from datetime import date
 
 import duckdb
 import polars as pl
 import pytest
-from polars.testing import assert_frame_equal
-
+from polars.testing import assert_frame_equal, assert_series_equal
+
+from chainlink.hashing import xxhash64
+from chainlink.link.link_utils import merge_delta_links, split_delta_links
+from chainlink.load.load_generic import load_generic
+from chainlink.load.load_utils import (
+    add_entity_keys,
+    detect_id_dtype,
+    read_file,
+    read_file_batches,
+    update_entity_ids,
+)
 from chainlink.main import chainlink, export_tables
 
 # add pytest fixture
@@ -544,6 +556,7 @@ def test_small_entity_tables(make_small_db):
         query = "SELECT * FROM entity.street"
         df = db_conn.execute(query).pl()
         assert df.shape[0] == 6
+        assert df.n_unique() == df.height
 
 
 def test_small_exact_within(make_small_db):
@@ -553,8 +566,8 @@ def test_small_exact_within(make_small_db):
         df = db_conn.execute(query).pl()
 
         correct_df = pl.DataFrame({
-            "llc_file_num_1": ["1338397"],
-            "llc_file_num_2": ["325194"],
+            "llc_file_num_1": [325194],
+            "llc_file_num_2": [1338397],
             "llc_master_address_llc_master_address_unit_fuzzy_match": [0.0],
             "llc_master_address_llc_master_address_street_fuzzy_match": [0.0],
             "llc_master_name_raw_llc_master_name_raw_fuzzy_match": [0.0],
@@ -575,8 +588,8 @@ def test_small_exact_within(make_small_db):
         df = db_conn.execute(query).pl()
 
         correct_df = pl.DataFrame({
-            "parcel_pin_1": ["24171070561019"],
-            "parcel_pin_2": ["25022160020002"],
+            "parcel_pin_1": [24171070561019],
+            "parcel_pin_2": [25022160020002],
             "parcel_parcels_mailing_address_parcel_parcels_mailing_address_unit_fuzzy_match": [0.0],
             "parcel_parcels_mailing_address_parcel_parcels_mailing_address_street_fuzzy_match": [0.0],
             "parcel_parcels_tax_payer_name_parcel_parcels_tax_payer_name_fuzzy_match": [0.0],
@@ -602,24 +615,24 @@ def test_small_exact_across(make_small_db):
 
     correct_df = pl.DataFrame({
         "llc_file_num": [
-            "325194",
-            "717605",
-            "1127901",
-            "257730",
-            "1338397",
-            "717605",
-            "717605",
-            "257730",
+            325194,
+            717605,
+            1127901,
+            257730,
+            1338397,
+            717605,
+            717605,
+            257730,
         ],
         "parcel_pin": [
-            "25022160020001",
-            "20344100300000",
-            "25212140150000",
-            "25022160020000",
-            "20344100300000",
-            "25022160020002",
-            "24171070561019",
-            "25022160020001",
+            25022160020001,
+            20344100300000,
+            25212140150000,
+            25022160020000,
+            20344100300000,
+            25022160020002,
+            24171070561019,
+            25022160020001,
         ],
         "llc_master_address_parcel_parcels_mailing_address_unit_fuzzy_match": [
             0.0,
@@ -713,8 +726,8 @@ def test_small_fuzzy(make_small_db):
 
     # Create a DataFrame with the test data
     correct_df = pl.DataFrame({
-        "llc_file_num": ["257730"],
-        "parcel_pin": ["25022160020001"],
+        "llc_file_num": [257730],
+        "parcel_pin": [25022160020001],
         "llc_master_address_parcel_parcels_mailing_address_unit_fuzzy_match": [0.0],
         "llc_master_address_parcel_parcels_mailing_address_street_fuzzy_match": [0.0],
         "llc_master_name_raw_parcel_parcels_tax_payer_name_fuzzy_match": [0.9805094416874218],
@@ -965,7 +978,7 @@ def test_simple_cross(make_simple_cross_db):
 
     assert df.shape[1] == num_columns
 
-    assert df.filter((pl.col("test_simple1_id_1") == "1") & (pl.col("test_simple1_id_2") == "2")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 1) & (pl.col("test_simple1_id_2") == 2)).select(
         pl.concat_list(
             pl.col("test_simple1_test1_name1_test_simple1_test1_name1_name_match"),
             pl.col("test_simple1_test1_name1_test_simple1_test1_name2_name_match"),
@@ -979,7 +992,7 @@ def test_simple_cross(make_simple_cross_db):
         0,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "1") & (pl.col("test_simple1_id_2") == "4")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 1) & (pl.col("test_simple1_id_2") == 4)).select(
         pl.concat_list(
             pl.col("test_simple1_test1_name1_test_simple1_test1_name1_name_match"),
             pl.col("test_simple1_test1_name1_test_simple1_test1_name2_name_match"),
@@ -993,7 +1006,7 @@ def test_simple_cross(make_simple_cross_db):
         0,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "2") & (pl.col("test_simple1_id_2") == "4")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 2) & (pl.col("test_simple1_id_2") == 4)).select(
         pl.concat_list(
             pl.col("test_simple1_test1_name1_test_simple1_test1_name1_name_match"),
             pl.col("test_simple1_test1_name1_test_simple1_test1_name2_name_match"),
@@ -1007,7 +1020,7 @@ def test_simple_cross(make_simple_cross_db):
         1,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "1") & (pl.col("test_simple1_id_2") == "5")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 1) & (pl.col("test_simple1_id_2") == 5)).select(
         pl.concat_list(
             pl.col("test_simple1_test1_name1_test_simple1_test2_name1_name_match"),
             pl.col("test_simple1_test1_name1_test_simple1_test2_name2_name_match"),
@@ -1021,7 +1034,7 @@ def test_simple_cross(make_simple_cross_db):
         0,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "2") & (pl.col("test_simple1_id_2") == "5")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 2) & (pl.col("test_simple1_id_2") == 5)).select(
         pl.concat_list(
             pl.col("test_simple1_test1_name1_test_simple1_test2_name1_name_match"),
             pl.col("test_simple1_test1_name1_test_simple1_test2_name2_name_match"),
@@ -1035,7 +1048,7 @@ def test_simple_cross(make_simple_cross_db):
         1,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "4") & (pl.col("test_simple1_id_2") == "5")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 4) & (pl.col("test_simple1_id_2") == 5)).select(
         pl.concat_list(
             pl.col("test_simple1_test1_name1_test_simple1_test2_name1_name_match"),
             pl.col("test_simple1_test1_name1_test_simple1_test2_name2_name_match"),
@@ -1049,7 +1062,7 @@ def test_simple_cross(make_simple_cross_db):
         1,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "3") & (pl.col("test_simple1_id_2") == "7")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 3) & (pl.col("test_simple1_id_2") == 7)).select(
         pl.concat_list(
             pl.col("test_simple1_test1_name1_test_simple1_test2_name1_name_match"),
             pl.col("test_simple1_test1_name1_test_simple1_test2_name2_name_match"),
@@ -1063,7 +1076,7 @@ def test_simple_cross(make_simple_cross_db):
         1,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "1") & (pl.col("test_simple1_id_2") == "7")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 1) & (pl.col("test_simple1_id_2") == 7)).select(
         pl.concat_list(
             pl.col("test_simple1_test2_name1_test_simple1_test2_name1_name_match"),
             pl.col("test_simple1_test2_name1_test_simple1_test2_name2_name_match"),
@@ -1077,7 +1090,7 @@ def test_simple_cross(make_simple_cross_db):
         0,
     ]
 
-    assert df.filter((pl.col("test_simple1_id_1") == "1") & (pl.col("test_simple1_id_2") == "3")).select(
+    assert df.filter((pl.col("test_simple1_id_1") == 1) & (pl.col("test_simple1_id_2") == 3)).select(
         pl.concat_list(
             pl.col("test_simple1_test2_name1_test_simple1_test1_name1_name_match"),
             pl.col("test_simple1_test2_name1_test_simple1_test1_name2_name_match"),
@@ -1090,3 +1103,578 @@ def test_simple_cross(make_simple_cross_db):
         0,
         0,
     ]
+
+
+def test_batched_load(make_small_db):
+    db_path = "tests/db/test_small_batched.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    config_batched = {
+        "options": {**CONFIG_SMALL["options"], "db_path": db_path},
+        "schemas": [
+            {**schema, "tables": [{**table, "batch_size": 2} for table in schema["tables"]]}
+            for schema in (CONFIG_SMALL_LLC, CONFIG_SMALL_PARCEL)
+        ],
+    }
+
+    chainlink(
+        config_batched,
+        config_path="tests/configs/config_small_batched.yaml",
+    )
+
+    tables = {
+        "llc.master": "file_num",
+        "parcel.parcels": "pin",
+        "entity.name": "name_id",
+        "entity.address": "address_id",
+        "link.llc_parcel": "llc_file_num, parcel_pin",
+    }
+    for table, order_by in tables.items():
+        # surrogate keys are assigned in the order ids are first loaded, which depends on the batches
+        query = f"SELECT DISTINCT * FROM {table} ORDER BY {order_by}"
+        with duckdb.connect("tests/db/test_small.db", read_only=True) as db_conn:
+            expected = db_conn.execute(query).pl().select(pl.exclude("^.*_key$"))
+        with duckdb.connect(db_path, read_only=True) as db_conn:
+            batched = db_conn.execute(query).pl().select(pl.exclude("^.*_key$"))
+
+        assert_frame_equal(expected, batched, check_column_order=False)
+
+    with duckdb.connect(db_path, read_only=True) as db_conn:
+        keys = db_conn.execute("SELECT * FROM entity.name_key ORDER BY name_key").pl()
+        names = db_conn.execute("SELECT DISTINCT name_raw_name_id, name_raw_name_key FROM llc.master").pl()
+
+    assert keys["name_key"].to_list() == list(range(1, keys.height + 1))
+    names = names.drop_nulls().join(keys, left_on="name_raw_name_id", right_on="name_id")
+    assert names.height > 0
+    assert (names["name_raw_name_key"] == names["name_key"]).all()
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_cluster_tables(make_small_db, batch_size):
+    db_path = "tests/db/test_small_clustered.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    config_clustered = {
+        "options": {**CONFIG_SMALL["options"], "db_path": db_path, "cluster_tables": True, "index_ids": True},
+        "schemas": [
+            {**schema, "tables": [{**table, "batch_size": batch_size} for table in schema["tables"]]}
+            for schema in (CONFIG_SMALL_LLC, CONFIG_SMALL_PARCEL)
+        ],
+    }
+    chainlink(config_clustered, config_path="tests/configs/config_small_clustered.yaml")
+
+    tables = {
+        "llc.master": "file_num",
+        "parcel.parcels": "pin",
+        "link.llc_parcel": "llc_file_num, parcel_pin",
+        "link.llc_llc": "llc_file_num_1, llc_file_num_2",
+    }
+    for table, order_by in tables.items():
+        query = f"SELECT * FROM {table} ORDER BY {order_by}"
+        with duckdb.connect("tests/db/test_small.db", read_only=True) as db_conn:
+            expected = db_conn.execute(query).pl().select(pl.exclude("^.*_key$"))
+        with duckdb.connect(db_path, read_only=True) as db_conn:
+            clustered = db_conn.execute(query).pl().select(pl.exclude("^.*_key$"))
+
+        assert_frame_equal(expected, clustered, check_column_order=False)
+
+    with duckdb.connect(db_path, read_only=True) as db_conn:
+        llc = db_conn.execute("SELECT * FROM llc.master").pl()
+        indexes = db_conn.execute("SELECT schema_name, index_name FROM duckdb_indexes()").fetchall()
+
+    # written in name key order
+    assert llc["name_raw_name_key"].is_sorted(nulls_last=True)
+    assert ("llc", "master_file_num_idx") in indexes
+    assert ("parcel", "parcels_pin_idx") in indexes
+    assert ("link", "llc_parcel_llc_file_num_idx") in indexes
+    assert ("link", "llc_parcel_parcel_pin_idx") in indexes
+
+
+def test_delta_links_shared_prefix(tmp_path):
+    db_path = str(tmp_path / "delta_links.db")
+    with duckdb.connect(db_path) as db_conn:
+        for schema in ["parcel", "link"]:
+            db_conn.execute(f"CREATE SCHEMA {schema}")
+        db_conn.execute("CREATE TABLE parcel.delta_ids AS SELECT 1 AS id")
+        # parcel_owner ids start with the delta entity's prefix, but aren't parcel ids
+        db_conn.execute("""
+            CREATE TABLE link.parcel_parcel_owner AS
+            SELECT * FROM (VALUES (1, 1, 1), (2, 1, 1), (3, 2, 0)) t(parcel_pin, parcel_owner_pin, name_match)""")
+
+    assert split_delta_links(db_path, "parcel", "parcel_owner", "parcel")
+    assert not split_delta_links(db_path, "parcel_owner", "parcel", "parcel")
+
+    with duckdb.connect(db_path) as db_conn:
+        assert db_conn.execute("SELECT parcel_pin FROM link.parcel_parcel_owner_base ORDER BY 1").fetchall() == [
+            (2,),
+            (3,),
+        ]
+        db_conn.execute("""
+            CREATE TABLE link.parcel_parcel_owner AS
+            SELECT * FROM (VALUES (1, 3, 1)) t(parcel_pin, parcel_owner_pin, address_match)""")
+
+    merge_delta_links(db_path, "link.parcel_parcel_owner")
+
+    with duckdb.connect(db_path) as db_conn:
+        merged = db_conn.execute("SELECT * FROM link.parcel_parcel_owner ORDER BY parcel_pin").fetchall()
+
+    # match columns only in one of the tables are 0 in the other
+    assert merged == [(1, 3, 0, 1), (2, 1, 1, 0), (3, 2, 0, 0)]
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_delta_load(make_small_db, batch_size):
+    delta_path = "tests/db/test_small_delta.db"
+    full_path = "tests/db/test_small_delta_full.db"
+    shutil.copy("tests/db/test_small.db", delta_path)
+    if os.path.exists(full_path):
+        os.remove(full_path)
+
+    # one parcel changed, one deleted and one added
+    parcels = pl.read_csv("tests/data/small_parcel.csv", infer_schema=False)
+    parcels = pl.concat([
+        parcels.filter(pl.col("pin") != "25212140150000").with_columns(
+            tax_payer_name=pl.when(pl.col("pin") == "24171070561019")
+            .then(pl.lit("SANJAY PATEL"))
+            .otherwise("tax_payer_name")
+        ),
+        pl.DataFrame({
+            "pin": ["25022160020003"],
+            "tax_payer_name": ["WOOW HVAC LLC"],
+            "mailing_address": ["645 LEAMINGTON, WILMETTE, IL 60091"],
+            "skip_address": ["0"],
+        }),
+    ])
+    parcels.write_csv("tests/data/small_parcel_delta.csv")
+
+    schemas = [
+        CONFIG_SMALL_LLC,
+        {
+            **CONFIG_SMALL_PARCEL,
+            "tables": [
+                {**table, "table_name_path": "tests/data/small_parcel_delta.csv", "batch_size": batch_size}
+                for table in CONFIG_SMALL_PARCEL["tables"]
+            ],
+        },
+    ]
+    for db_path, options in [
+        (delta_path, {"overwrite_db": False, "delta_load": True}),
+        (full_path, {"overwrite_db": True}),
+    ]:
+        config = {
+            "options": {**CONFIG_SMALL["options"], "db_path": db_path, **options},
+            "schemas": [{**schema, "tables": [{**table} for table in schema["tables"]]} for schema in schemas],
+        }
+        chainlink(config, config_path="tests/configs/config_small_delta.yaml")
+
+    with duckdb.connect(delta_path, read_only=True) as db_conn:
+        assert db_conn.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'delta_ids'").fetchone()[0] == 0
+
+    # fuzzy scores depend on every name in the database, so only exact links are compared
+    tables = {
+        "parcel.parcels": ["pin"],
+        "llc.master": ["file_num"],
+        "link.llc_parcel": ["llc_file_num", "parcel_pin"],
+        "link.parcel_parcel": ["parcel_pin_1", "parcel_pin_2"],
+    }
+    for table, order_by in tables.items():
+        results = []
+        for db_path in [full_path, delta_path]:
+            with duckdb.connect(db_path, read_only=True) as db_conn:
+                df = db_conn.execute(f"SELECT * FROM {table}").pl().select(pl.exclude("^.*_key$|^.*fuzzy_match$"))
+            if table.startswith("link"):
+                df = df.filter(pl.any_horizontal(pl.exclude(order_by) == 1))
+            results.append(df.sort(order_by))
+
+        assert_frame_equal(*results, check_column_order=False)
+
+    with duckdb.connect(delta_path, read_only=True) as db_conn:
+        links = db_conn.execute("SELECT * FROM link.llc_parcel WHERE parcel_pin = 25212140150000").fetchall()
+    assert links == []
+
+
+def test_skip_unchanged(make_small_db, monkeypatch):
+    db_path = "tests/db/test_small_memo.db"
+    full_path = "tests/db/test_small_memo_full.db"
+    for path in [db_path, full_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.copy("tests/data/small_parcel.csv", "tests/data/small_parcel_memo.csv")
+
+    loads = []
+
+    def record_load(**kwargs):
+        schema_config = kwargs["schema_config"]
+        loads.append((schema_config["schema_name"], len(schema_config["tables"]), kwargs.get("delta", False)))
+        load_generic(**kwargs)
+
+    monkeypatch.setattr("chainlink.main.load_generic", record_load)
+
+    def run(parcel_path: str, db_path: str = db_path, id_type: str = "auto", **options) -> None:
+        loads.clear()
+        config = {
+            "options": {**CONFIG_SMALL["options"], "db_path": db_path, "skip_unchanged": True, **options},
+            "schemas": [
+                {**CONFIG_SMALL_LLC, "tables": [{**table} for table in CONFIG_SMALL_LLC["tables"]]},
+                {
+                    **CONFIG_SMALL_PARCEL,
+                    "id_type": id_type,
+                    "tables": [{**table, "table_name_path": parcel_path} for table in CONFIG_SMALL_PARCEL["tables"]],
+                },
+            ],
+        }
+        chainlink(config, config_path="tests/configs/config_small_memo.yaml")
+
+    run("tests/data/small_parcel_memo.csv")
+    assert loads == [("llc", 1, False), ("parcel", 1, False)]
+    with duckdb.connect(db_path, read_only=True) as db_conn:
+        stages = [row[0] for row in db_conn.execute("SELECT stage FROM entity.run_manifest").fetchall()]
+    assert sorted(stages) == ["links", "schema:llc", "schema:parcel", "table:llc.master", "table:parcel.parcels"]
+
+    # nothing changed
+    run("tests/data/small_parcel_memo.csv")
+    assert loads == []
+
+    # a new path to a changed file only updates that table
+    parcels = pl.read_csv("tests/data/small_parcel.csv", infer_schema=False).with_columns(
+        tax_payer_name=pl.when(pl.col("pin") == "20344100300000")
+        .then(pl.lit("MOBUCASA INC"))
+        .otherwise("tax_payer_name")
+    )
+    parcels.write_csv("tests/data/small_parcel_memo_changed.csv")
+    run("tests/data/small_parcel_memo_changed.csv")
+    assert loads == [("parcel", 1, True)]
+
+    # changed link options only link again
+    run("tests/data/small_parcel_memo_changed.csv", link_exclusions=["fuzzy"])
+    assert loads == []
+
+    # a changed schema config only loads that schema again
+    run("tests/data/small_parcel_memo_changed.csv", id_type="string", link_exclusions=["fuzzy"])
+    assert loads == [("parcel", 1, False)]
+
+    run("tests/data/small_parcel_memo_changed.csv", full_path, id_type="string", link_exclusions=["fuzzy"])
+    tables = {
+        "parcel.parcels": ["pin"],
+        "llc.master": ["file_num"],
+        "link.llc_parcel": ["llc_file_num", "parcel_pin"],
+        "link.llc_llc": ["llc_file_num_1", "llc_file_num_2"],
+        "link.parcel_parcel": ["parcel_pin_1", "parcel_pin_2"],
+    }
+    for table, order_by in tables.items():
+        results = []
+        for path in [full_path, db_path]:
+            with duckdb.connect(path, read_only=True) as db_conn:
+                results.append(
+                    db_conn.execute(f"SELECT * FROM {table}").pl().select(pl.exclude("^.*_key$")).sort(order_by)
+                )
+
+        assert not any("fuzzy" in col for col in results[1].columns)
+        assert_frame_equal(*results, check_column_order=False)
+
+
+def test_failed_load_closes_clean_cache(tmp_path, monkeypatch):
+    closed = []
+
+    def fail_load(**kwargs):
+        raise ValueError("load failed")
+
+    monkeypatch.setattr("chainlink.main.load_generic", fail_load)
+    monkeypatch.setattr("chainlink.main.close_clean_cache", closed.append)
+
+    config = {
+        "options": {"db_path": str(tmp_path / "failed.db"), "clean_workers": 2},
+        "schemas": [CONFIG_SMALL_LLC],
+    }
+    with pytest.raises(ValueError, match="load failed"):
+        chainlink(config, config_path=str(tmp_path / "config.yaml"))
+    assert len(closed) == 1
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_other_cols(batch_size):
+    db_path = "tests/db/test_other_cols.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    pl.DataFrame({
+        "id": [1, 2, 3],
+        "name": ["Aus St", "Big Calm", "Aus St"],
+        "address": ["1", "2", "3"],
+        "amount": [1.5, 2.5, 3.5],
+        "filed": [date(2020, 1, 1), date(2021, 1, 1), date(2022, 1, 1)],
+    }).write_parquet("tests/data/other_cols.parquet")
+
+    def load(other_cols: str, id_type: str = "auto") -> dict:
+        table = {
+            "table_name": f"other_{other_cols}",
+            "table_name_path": "tests/data/other_cols.parquet",
+            "id_col": "id",
+            "name_cols": ["name"],
+            "address_cols": ["address"],
+            "other_cols": other_cols,
+            "batch_size": batch_size,
+        }
+        config = {
+            "options": {"db_path": db_path, "load_only": True},
+            "schemas": [{"schema_name": f"other_{other_cols}_{id_type}", "id_type": id_type, "tables": [table]}],
+        }
+        chainlink(config, config_path="tests/configs/config_other_cols.yaml")
+
+        with duckdb.connect(db_path, read_only=True) as db_conn:
+            df = db_conn.execute(f"SELECT * FROM other_{other_cols}_{id_type}.other_{other_cols}").pl()
+        return df.schema
+
+    schema = load("string")
+    assert schema["id"] == pl.Int64
+    assert schema["amount"] == pl.String
+
+    schema = load("string", id_type="string")
+    assert schema["id"] == pl.String
+
+    schema = load("typed")
+    assert schema["id"] == pl.Int64
+    assert schema["name_name_id"] == pl.UInt64
+    assert schema["amount"] == pl.Float64
+    assert schema["filed"] == pl.Date
+
+    schema = load("drop")
+    assert "amount" not in schema
+    assert "filed" not in schema
+    assert "address_street_id" in schema
+
+
+def test_read_file_batches_csv_types(tmp_path):
+    file_path = str(tmp_path / "typed.csv")
+    pl.DataFrame({
+        "id": ["1", "2", "3"],
+        "amount": [1, 2, None],
+        "filed": ["2020-01-01", "2021-01-01", "2022-01-01"],
+        "flag": [True, False, True],
+    }).write_csv(file_path)
+
+    for string_cols in [None, ["id"]]:
+        expected = read_file(file_path, "csv", string_cols)
+        batches = list(read_file_batches(file_path, "csv", 2, string_cols))
+        assert [df.height for df in batches] == [2, 1]
+        assert_frame_equal(pl.concat(batches), expected)
+
+
+@pytest.mark.parametrize(
+    "ids, dtype",
+    [
+        (["1", "20", None, "-3"], pl.Int64),
+        (["1", "007"], pl.String),
+        (["1", "+2"], pl.String),
+        (["1", " 2"], pl.String),
+        (["1", "2.0"], pl.String),
+        (["1", "A2"], pl.String),
+        (["1", "9223372036854775808"], pl.String),
+    ],
+)
+def test_detect_id_dtype(ids, dtype):
+    assert detect_id_dtype(pl.LazyFrame({"id": ids}, schema={"id": pl.String}), "id") == dtype
+
+
+def test_parse_cache_overwrite(make_small_db):
+    db_path = "tests/db/test_small_parse_cache.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    config = {
+        "options": {**CONFIG_SMALL["options"], "db_path": db_path, "parse_cache": True},
+        "schemas": [CONFIG_SMALL_LLC, CONFIG_SMALL_PARCEL],
+    }
+    chainlink(config, config_path="tests/configs/config_small_parse_cache.yaml")
+
+    with duckdb.connect(db_path, read_only=True) as db_conn:
+        n_cached = db_conn.execute("SELECT COUNT(*) FROM entity.address_parse_cache").fetchone()[0]
+        first = db_conn.execute("SELECT * FROM parcel.parcels ORDER BY pin").pl()
+    assert n_cached == 8
+
+    # overwriting the database keeps the parse cache
+    chainlink(config, config_path="tests/configs/config_small_parse_cache.yaml")
+
+    with duckdb.connect(db_path, read_only=True) as db_conn:
+        assert db_conn.execute("SELECT COUNT(*) FROM entity.address_parse_cache").fetchone()[0] == n_cached
+        second = db_conn.execute("SELECT * FROM parcel.parcels ORDER BY pin").pl()
+    assert_frame_equal(first, second)
+
+
+def test_parallel_cleaning(make_small_db):
+    db_path = "tests/db/test_small_parallel.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    config = {
+        "options": {**CONFIG_SMALL["options"], "db_path": db_path, "clean_workers": 2, "clean_chunk_size": 2},
+        "schemas": [CONFIG_SMALL_LLC, CONFIG_SMALL_PARCEL],
+    }
+    chainlink(config, config_path="tests/configs/config_small_parallel.yaml")
+
+    for table, order_by in {"llc.master": "file_num", "parcel.parcels": "pin"}.items():
+        query = f"SELECT * FROM {table} ORDER BY {order_by}"
+        with duckdb.connect("tests/db/test_small.db", read_only=True) as db_conn:
+            expected = db_conn.execute(query).pl()
+        with duckdb.connect(db_path, read_only=True) as db_conn:
+            parallel = db_conn.execute(query).pl()
+
+        assert_frame_equal(expected, parallel)
+
+
+@pytest.mark.parametrize("option", ["clean_in_db", "clean_streaming"])
+def test_clean_options(make_small_db, option):
+    db_path = f"tests/db/test_small_{option}.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    config = {
+        "options": {**CONFIG_SMALL["options"], "db_path": db_path, option: True},
+        "schemas": [CONFIG_SMALL_LLC, CONFIG_SMALL_PARCEL],
+    }
+    chainlink(config, config_path=f"tests/configs/config_small_{option}.yaml")
+
+    for table, order_by in {"llc.master": "file_num", "parcel.parcels": "pin"}.items():
+        query = f"SELECT * FROM {table} ORDER BY {order_by}"
+        with duckdb.connect("tests/db/test_small.db", read_only=True) as db_conn:
+            expected = db_conn.execute(query).pl()
+        with duckdb.connect(db_path, read_only=True) as db_conn:
+            cleaned = db_conn.execute(query).pl()
+
+        assert_frame_equal(expected, cleaned)
+
+
+def test_address_trace_table(make_small_db):
+    db_path = "tests/db/test_small_trace.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    config = {
+        "options": {**CONFIG_SMALL["options"], "db_path": db_path, "clean_trace_slowest": 5, "clean_time_budget": 10},
+        "schemas": [CONFIG_SMALL_LLC, CONFIG_SMALL_PARCEL],
+    }
+    chainlink(config, config_path="tests/configs/config_small_trace.yaml")
+
+    with duckdb.connect("tests/db/test_small.db", read_only=True) as db_conn:
+        expected = db_conn.execute("SELECT * FROM llc.master ORDER BY file_num").pl()
+    with duckdb.connect(db_path, read_only=True) as db_conn:
+        cleaned = db_conn.execute("SELECT * FROM llc.master ORDER BY file_num").pl()
+        trace = db_conn.execute("SELECT * FROM entity.address_parse_trace").pl()
+
+    assert_frame_equal(expected, cleaned)
+    assert trace.columns == ["address", "seconds", "timed_out"]
+    assert trace.height == 5
+    assert trace["seconds"].is_sorted(descending=True)
+    assert not trace["timed_out"].any()
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_bad_flags(tmp_path, batch_size):
+    db_path = "tests/db/test_small_bad_flags.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    bad_address_path = tmp_path / "bad_addresses.csv"
+    bad_name_path = tmp_path / "bad_names.csv"
+    pl.DataFrame({"address": ["8041 SAYRE AVE, BURBANK, IL 60459"]}).write_csv(bad_address_path)
+    pl.DataFrame({"name": ["WOOW HVAC LLC", "NOT IN THE DATA"]}).write_csv(bad_name_path)
+
+    config = {
+        "options": {
+            "db_path": db_path,
+            "overwrite_db": True,
+            "load_only": True,
+            "bad_address_path": str(bad_address_path),
+            "bad_name_path": str(bad_name_path),
+        },
+        "schemas": [{**CONFIG_SMALL_LLC, "tables": [{**CONFIG_SMALL_LLC["tables"][0], "batch_size": batch_size}]}],
+    }
+    chainlink(config, config_path="tests/configs/config_small_bad_flags.yaml")
+
+    with duckdb.connect(db_path, read_only=True) as db_conn:
+        df = db_conn.execute("SELECT * FROM llc.master ORDER BY file_num").pl()
+
+    assert df.columns[-2:] == ["address_skip", "name_raw_skip"]
+    assert df.schema["address_skip"] == pl.Int32
+    assert df.filter(pl.col("address_skip") == 1)["file_num"].to_list() == [717605]
+    assert df.filter(pl.col("name_raw_skip") == 1)["file_num"].sort().to_list() == [325194, 1338397]
+
+
+def test_xxhash64():
+    values = pl.Series(
+        "value",
+        ["", "a", None, "WOOW HVAC LLC", "1319 E 89TH ST CHICAGO IL 60619 AND 2555 W 79TH ST", "ÉCOLE DU ß 漢字"],
+    )
+    expected = pl.Series(
+        "value",
+        [
+            17241709254077376921,
+            15154266338359012955,
+            None,
+            5563147240613179239,
+            18042773102615690071,
+            15121046464093225073,
+        ],
+        dtype=pl.UInt64,
+    )
+
+    assert_series_equal(xxhash64(values), expected)
+    assert_series_equal(xxhash64(values.slice(3)), expected.slice(3))
+
+
+def test_entity_id_collisions():
+    with duckdb.connect() as db_conn:
+        db_conn.execute("CREATE SCHEMA entity")
+        update_entity_ids(
+            df=pl.DataFrame({"address": ["1 MAIN ST", "1 MAIN ST."], "address_address_id": [1, 1]}),
+            entity_id_cols=["address_address_id"],
+            db_conn=db_conn,
+        )
+
+        with pytest.raises(ValueError, match=r"Id collision in entity\.name"):
+            update_entity_ids(
+                df=pl.DataFrame({"name": ["ACME LLC", "ACME INC"], "name_name_id": [2, 2]}),
+                entity_id_cols=["name_name_id"],
+                db_conn=db_conn,
+            )
+
+        update_entity_ids(
+            df=pl.DataFrame({"name": ["ACME LLC"], "name_name_id": [2]}),
+            entity_id_cols=["name_name_id"],
+            db_conn=db_conn,
+        )
+        before = db_conn.execute("SELECT * FROM entity.name ORDER BY ALL").pl()
+
+        # a collision with an entity already in the table adds nothing
+        with pytest.raises(ValueError, match=r"Id collision in entity\.name"):
+            update_entity_ids(
+                df=pl.DataFrame({"name": ["ACME INC", "BETA LLC"], "name_name_id": [2, 3]}),
+                entity_id_cols=["name_name_id"],
+                db_conn=db_conn,
+            )
+        assert_frame_equal(db_conn.execute("SELECT * FROM entity.name ORDER BY ALL").pl(), before)
+        assert db_conn.execute("SELECT COUNT(*) FROM entity.name_key").fetchone() == (1,)
+
+
+def test_entity_keys():
+    with duckdb.connect() as db_conn:
+        db_conn.execute("CREATE SCHEMA entity")
+        df = pl.DataFrame(
+            {"name": ["C", "A", None], "name_name_id": [30, 10, None]}, schema_overrides={"name_name_id": pl.UInt64}
+        )
+        update_entity_ids(df=df, entity_id_cols=["name_name_id"], db_conn=db_conn)
+
+        df = pl.DataFrame(
+            {"name": ["B", "C", "B"], "name_name_id": [20, 30, 20]}, schema_overrides={"name_name_id": pl.UInt64}
+        )
+        update_entity_ids(df=df, entity_id_cols=["name_name_id"], db_conn=db_conn)
+        df = add_entity_keys(df=df, entity_id_cols=["name_name_id"], db_conn=db_conn)
+
+        keys = db_conn.execute("SELECT * FROM entity.name_key ORDER BY name_key").pl()
+
+    # keys are assigned once, in id order within each load
+    assert keys.rows() == [(10, 1), (30, 2), (20, 3)]
+    assert df["name_name_key"].to_list() == [3, 2, 3]
+    assert df.schema["name_name_key"] == pl.Int32